@@ -26,6 +26,7 @@ setup(
     packages=find_packages(where='src'),  # Find packages in src/
     python_requires=">=3.6,<3.11", # ray doesn't support 3.11 as of now
     install_requires=install_requires,
+    extras_require={"numba": ["numba"]}, # engine="numba" and engine="dp"
         package_data={
         'FDD': ['models/*.pt'],
     },
@@ -13,7 +13,7 @@ import sys
 from ray.air.config import RunConfig
 
 
-def gridSearch(theta, args):
+def gridSearch(theta, args, batch_size = 1):
     lmbda_list = [1, 5, 10, 20, 50, 100, 300, 500]
     nu_list = [0.001, 0.005, 0.01, 0.02 ,0.03, 0.04, 0.05, 0.06, 0.07, 0.08, 0.09,0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1]
 
@@ -21,11 +21,17 @@ def gridSearch(theta, args):
     arglist = []
     for lmbda in lmbda_list:
         for nu in nu_list:
-            # perform a grid search on the SURE_objective, retain all the values
-            # and then pick the best one
+            arglist.append((lmbda, nu))
+    
+    # perform a grid search on the SURE_objective, retain all the values
+    # and then pick the best one
+    if batch_size > 1: # solve batch_size (lmbda, nu) pairs at once
+        for i in range(0, len(arglist), batch_size):
+            objlist.extend(SURE_objective_batch(np.array(arglist[i:(i + batch_size)]), *args))
+    else:
+        for lmbda, nu in arglist:
             theta = np.array([lmbda, nu])
             objlist.append(SURE_objective_tune(theta, *args))
-            arglist.append((lmbda, nu))
     
     # get index of minimum value
     min_idx = np.argmin(objlist)
@@ -187,4 +193,39 @@ def SURE_objective_tune(theta, tol, eps, f, repeats, level, grid_y, sigma_sq, b,
         # TODO: should be euclidean norm
     sure = np.mean(sure)
 
-    return sure
\ No newline at end of file
+    return sure
+
+
+def SURE_objective_batch(thetas, tol, eps, f, repeats, level, grid_y, sigma_sq, b, R):
+    # SURE_objective_tune for every row (lmbda, nu) of thetas, solved as one batch
+
+    device = f.device
+    B = thetas.shape[0]
+
+    lvl = level.cpu().detach().numpy()
+
+    lmbda_torch = torch.tensor(thetas[:,0], device = device, dtype = torch.float32)
+    nu_torch = torch.tensor(thetas[:,1], device = device, dtype = torch.float32)
+    n = grid_y.size
+    model = PrimalDual()
+    v = model.forwardBatch(torch.stack([f] * B), repeats, level, lmbda_torch, nu_torch, tol)[0]
+    u = [isosurface(v[i].cpu().detach().numpy(), lvl, grid_y) for i in range(B)]
+
+    u_dist = np.array([np.mean(np.abs(grid_y.flatten() - u[i].flatten())**2) for i in range(B)])
+
+    sure = np.zeros((R, B))
+    for r in range(R):
+
+        bt = b[...,r]
+        f_eps = f + bt * eps
+        f_eps = torch.clamp(f_eps, min = 0, max = 1)
+
+        v_eps = model.forwardBatch(torch.stack([f_eps] * B), repeats, level, lmbda_torch, nu_torch, tol)[0]
+        for i in range(B):
+            u_eps = isosurface(v_eps[i].cpu().detach().numpy(), lvl, grid_y)
+
+            divf_y = np.real(np.vdot(bt.cpu().detach().numpy().squeeze().flatten(), 
+                                    u_eps.flatten() - u[i].flatten())) / (eps)
+            sure[r, i] = u_dist[i] - sigma_sq + 2 * sigma_sq * divf_y / n
+    
+    return np.mean(sure, axis = 0)
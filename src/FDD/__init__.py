@@ -1,4 +1,4 @@
 # -*- coding: utf-8 -*-
 
 from .main import FDD
-from .primaldual_multi_scaled_tune import PrimalDual
+from .primaldual_multi_scaled_tune import PrimalDual, SolverState, EnergyTrace
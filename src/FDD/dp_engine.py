@@ -0,0 +1,140 @@
+import numpy as np
+from numba import njit
+from scipy.linalg import solveh_banded
+from typing import Tuple
+
+
+@njit(cache=True)
+def segment(x, y, c, penalty, lo, hi):
+    # Optimal partition of the nodes x[0] < ... < x[n-1] (data y, weights c) into segments for
+    #   sum_i c_i (u_i - y_i)^2 + sum_{edges in a segment} (u_{i+1} - u_i)^2 / (x_{i+1} - x_i) + penalty * #jumps
+    # by dynamic programming over the start of the last segment, with PELT pruning. For every candidate
+    # start s the cost of the segment s, ..., t as a function of u_t is a parabola a u^2 + b u + k, updated
+    # in O(1) per node (minimize over u_{t-1}, add the data term). A start s whose best energy plus its
+    # segment cost exceeds the best energy up to t can't be optimal later on (splitting a segment only
+    # lowers its cost) and is dropped. Within a long segment that only drops the starts before it, so a start
+    # is also dropped once its parabola lies above that of the best start wherever it is below F[t + 1]
+    # (elsewhere a jump after the best start is cheaper) and in [lo, hi] (the range of y, which contains the
+    # optimal u), leaving a few recent starts per segment.
+    # Returns F (F[t] = optimal energy of the nodes before t) and last (last[t] = start of the last segment
+    # of the optimal partition of the nodes up to t)
+
+    n = x.shape[0]
+    F = np.empty(n + 1)
+    F[0] = -penalty
+    last = np.empty(n, dtype=np.int64)
+    start = np.empty(n, dtype=np.int64)
+    a = np.empty(n)
+    b = np.empty(n)
+    k = np.empty(n)
+    m = 0 # active candidates
+
+    for t in range(n):
+        # edge (t - 1, t): u_{t-1} minimized out of every active segment
+        if t > 0:
+            w = 1.0 / (x[t] - x[t - 1])
+            for j in range(m):
+                k[j] -= b[j] * b[j] / (4.0 * (a[j] + w))
+                r = w / (a[j] + w)
+                a[j] *= r
+                b[j] *= r
+
+        # a new segment starting at t
+        start[m] = t
+        a[m] = 0.0
+        b[m] = 0.0
+        k[m] = 0.0
+        m += 1
+
+        best = np.inf
+        i = 0
+        for j in range(m):
+            a[j] += c[t]
+            b[j] -= 2.0 * c[t] * y[t]
+            k[j] += c[t] * y[t] * y[t]
+            cost = F[start[j]] + k[j] - b[j] * b[j] / (4.0 * a[j])
+            if cost < best:
+                best = cost
+                i = j
+        last[t] = start[i]
+        F[t + 1] = best + penalty
+
+        # prune
+        keep = 0
+        for j in range(m):
+            if j != i:
+                # values u_t where continuing segment j can beat a jump after the best one: its parabola
+                # below F[t + 1], within [lo, hi]
+                disc = b[j] * b[j] - 4.0 * a[j] * (F[start[j]] + k[j] - F[t + 1])
+                if disc < 0:
+                    continue
+                x1 = max(lo, (-b[j] - np.sqrt(disc)) / (2.0 * a[j]))
+                x2 = min(hi, (-b[j] + np.sqrt(disc)) / (2.0 * a[j]))
+                if x1 > x2:
+                    continue
+                # dominated there by the best segment: the minimization over u_{t-1} and the data terms
+                # preserve the order, so it stays dominated
+                da, db = a[j] - a[i], b[j] - b[i]
+                dk = F[start[j]] + k[j] - F[start[i]] - k[i]
+                gap = min(da * x1 * x1 + db * x1 + dk, da * x2 * x2 + db * x2 + dk)
+                if da > 0 and x1 < -db / (2.0 * da) < x2:
+                    gap = min(gap, dk - db * db / (4.0 * da))
+                if gap >= 0:
+                    continue
+            start[keep], a[keep], b[keep], k[keep] = start[j], a[j], b[j], k[j]
+            keep += 1
+        m = keep
+
+    return F, last
+
+
+def segmentNodes(x, y, c, penalty) -> Tuple[np.ndarray, np.ndarray, float]:
+    # exact minimizer of the energy of segment: u at the nodes, jump (jump[i]: u jumps between nodes i and
+    # i + 1) and the optimal energy. The partition comes from segment, u from one banded solve of the
+    # normal equations with the edges across jumps removed
+
+    n = x.shape[0]
+    if n == 1: # no edges, u is the data
+        return y.astype(np.float64), np.zeros(0, dtype=bool), 0.0
+    F, last = segment(x, y, c, penalty, y.min(), y.max())
+
+    jump = np.zeros(max(n - 1, 0), dtype=bool)
+    t = n - 1
+    while t >= 0:
+        s = last[t]
+        if s > 0:
+            jump[s - 1] = True
+        t = s - 1
+
+    # (diag(c) + graph Laplacian of the smooth edges) u = c y, in lower banded form
+    w = np.where(jump, 0.0, 1.0 / np.diff(x))
+    ab = np.zeros((2, n))
+    ab[0] = c
+    ab[0, :-1] += w
+    ab[0, 1:] += w
+    ab[1, :-1] = -w
+    u = solveh_banded(ab, c * y, lower=True)
+
+    return u, jump, float(F[n])
+
+
+def segmentPoints(X, Y, lmbda, nu, cells) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    # 1-D piecewise-smooth Mumford-Shah fit to the points (X, Y), X in [0, 1]:
+    #   lmbda / n sum_i (u_i - Y_i)^2 + int |u'|^2 + nu * sqrt(cells) * #jumps
+    # with u piecewise linear between the sorted points, which is lmbda sum (u - f)^2 + cells^2 sum du^2 of
+    # the grid solve (cells per side) over cells. The jump penalty of the grid solve depends on its
+    # l2projection, which bounds |s| by nu * cells but shrinks it to nu; nu * sqrt(cells) (in between)
+    # gives the jumps of the grid solve on the design of simulations_1d_SURE.py, see
+    # benchmarks/dp_engine.py. It only approximates that penalty: elsewhere the exact fit can miss, add or
+    # move jumps relative to engine="torch", so the two engines are not exact substitutes. Points with the
+    # same X are one node with their mean Y and summed weight.
+    # Returns the sorted distinct x, u there, jump between consecutive ones and the optimal energy
+
+    X, Y = np.asarray(X, dtype=np.float64).ravel(), np.asarray(Y, dtype=np.float64).ravel()
+    x, inverse, counts = np.unique(X, return_inverse=True, return_counts=True)
+    y = np.bincount(inverse, weights=Y) / counts
+    c = lmbda * counts / X.shape[0]
+
+    u, jump, nrj = segmentNodes(x, y, c, nu * np.sqrt(cells))
+
+    return x, u, jump, nrj
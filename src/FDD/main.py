@@ -4,6 +4,7 @@ import torch
 from .utils import * 
 from sklearn.cluster import KMeans
 from scipy.spatial import cKDTree
+from scipy.ndimage import distance_transform_edt
 from .primaldual_multi_scaled_tune import PrimalDual
 from matplotlib import pyplot as plt
 import pandas as pd
@@ -12,7 +13,13 @@ class FDD():
     def __init__(self, Y : np.array, X : np.array, pick_nu : str="kmeans", level : int=16, 
                  lmbda : float=1, nu : float=0.01, iter : int=1000, tol : float=5e-5, rectangle : bool=False, 
                  qtile : float=0.05, image : bool=False, grid : bool=False, resolution : float=None,
-                 scaled=False, scripted=True, average=False) -> None:
+                 scaled=False, scripted=True, average=False, inplace=False, check_every : int=10, 
+                 criterion : str="energy", sync_every : int=1, adaptive : bool=False,
+                 precondition : bool=False, relaxation : float=1.0, restart : bool=False, trace : bool=False,
+                 pyramid : int=0, compact : str=None, memory_budget : float=None, tile : int=0,
+                 tile_dir : str=None, workers : int=1, backend : str="eager", cache_dir : str=None,
+                 engine : str="torch", label_window : int=0, labels=None, mask=None, fill : str="kdtree",
+                 gridding : str="smooth", neighbors : int=1) -> None:
 
         self.device = setDevice()
         torch.set_grad_enabled(False)
@@ -37,8 +44,49 @@ class FDD():
         self.theta_u = 1 # placeholder
         self.theta_mu = 1
         
-        self.scripted = scripted
+        # backend="compile" builds the solver from PrimalDual with torch.compile instead of loading the
+        # TorchScript archives, with the compiled kernels cached in cache_dir (default ~/.cache/fdd)
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.scripted = scripted and backend == "eager" and engine == "torch"
+        self.engine = engine # "torch", "numba" for fused multithreaded CPU loops (see NumbaPrimalDual), or "dp"
+                             # for the exact fit of 1-D data by dynamic programming (see dp_engine.segmentPoints)
+                             # (exact for its own jump penalty, which approximates that of the torch engine)
         self.scaled = scaled
+        self.inplace = inplace # preallocated, in-place solver loop
+        
+        # convergence test: criterion ("energy", "relative", "residual", "plateau") evaluated every check_every
+        # iterations and read back from the device every sync_every checks, see ConvergenceMonitor
+        self.check_every = check_every
+        self.criterion = criterion
+        self.sync_every = sync_every
+        self.adaptive = adaptive # adaptive step sizes (residual balancing with backtracking)
+        self.precondition = precondition # diagonally preconditioned, per-variable step sizes
+        self.relaxation = relaxation # over-relaxation of the primal-dual update, in (0, 2)
+        self.restart = restart # restart the extrapolation when the convergence criterion goes up
+        self.trace = trace # record the convergence criterion at every check into energy_trace
+        self.pyramid = pyramid # number of coarser grids to solve first, each warm starting the next finer one
+        self.compact = compact # dtype of sx and mux ("float32", "bfloat16", "float16"), mubarx recomputed
+        self.memory_budget = memory_budget # bytes, lower level / coarsen the grid to fit, see plan_resources
+        self.tile = tile # cells per side of the tiles of the out-of-core solve (0: whole grid), see forwardTiled
+        self.tile_dir = tile_dir # directory for the memory-mapped variables of the tiled solve (default: temp)
+        self.workers = workers # processes sweeping the tiles in parallel, one torch thread each
+        self.label_window = label_window # labels per voxel around the solution (0: all level), see forwardWindowed
+        self.labels = labels # None (evenly spaced), "quantile" (at the quantiles of grid_y) or level values of Y
+        self.label_values = None # values of the labels of the last run in [0, 1] (None: evenly spaced), see labelValues
+        self.mask = mask # cells to solve on: None (all), "data" (cells with points, non-NaN pixels) or a grid-shaped array
+        self.grid_mask = None # boolean mask of the cells of the last run (None: all), see gridMask
+        self.fill = fill # value of empty cells: "kdtree" (closest point) or "edt" (closest cell with points), see fillEmptyCells
+        if fill not in ["kdtree", "edt"]:
+            raise ValueError(f"fill must be one of ['kdtree', 'edt'], got {fill}")
+        self.gridding = gridding # "smooth" (mean of the points in every cell) or "points" (closest points), see castDataToGrid
+        self.neighbors = neighbors # points averaged with inverse-distance weights for gridding="points"
+        if gridding not in ["smooth", "points"]:
+            raise ValueError(f"gridding must be one of ['smooth', 'points'], got {gridding}")
+        if int(neighbors) != neighbors or neighbors < 1:
+            raise ValueError(f"neighbors must be a positive integer, got {neighbors}")
+        if gridding == "points" and isinstance(mask, str):
+            raise ValueError("gridding='points' gives every cell a value, mask='data' needs gridding='smooth'")
         
         self.average = average
 
@@ -59,6 +107,43 @@ class FDD():
         self.nu = nu
         self.pick_nu = pick_nu
         
+        if self.scripted:
+            # the TorchScript archives run the original loop, with none of the options of PrimalDual
+            options = {"inplace" : inplace, "adaptive" : adaptive, "precondition" : precondition,
+                       "relaxation" : relaxation != 1.0, "restart" : restart, "trace" : trace,
+                       "compact" : compact is not None, "check_every" : check_every != 10,
+                       "criterion" : criterion != "energy", "sync_every" : sync_every != 1}
+            given = [name for name, value in options.items() if value]
+            if given:
+                raise ValueError(f"{', '.join(given)} need scripted=False, the scripted models run the original loop")
+        if label_window > 0 and (self.scripted or engine != "torch" or pyramid > 0 or tile > 0 or workers > 1):
+            raise ValueError("label_window runs on the torch engine with scripted=False, without pyramid or tiles")
+        if labels is not None:
+            if self.scripted or engine == "dp" or label_window > 0:
+                raise ValueError("labels need scripted=False and the torch or numba engine, without label_window")
+            if not isinstance(labels, str):
+                if np.ndim(labels) != 1 or len(labels) != level or memory_budget is not None:
+                    raise ValueError("labels must hold level values of Y (and fix the level, without memory_budget)")
+                if not self.image and self.Y.ndim > 1 and self.Y.shape[1] > 1:
+                    raise ValueError("label values of Y need a scalar Y, use labels='quantile'")
+            elif labels != "quantile":
+                raise ValueError(f"labels must be None, 'quantile' or an array of level values, got {labels}")
+        if mask is not None:
+            if self.scripted or engine != "torch" or self.inplace or adaptive or precondition or relaxation != 1.0 \
+                    or restart or compact is not None or tile > 0 or workers > 1 or pyramid > 0 or label_window > 0:
+                raise ValueError("the masked solve runs the allocating loop of the torch engine with scripted=False, "
+                                 "without the in-place, tiled, pyramid or label window options")
+            if isinstance(mask, str) and mask != "data":
+                raise ValueError(f"mask must be None, 'data' or a boolean array of the grid shape, got {mask}")
+            if not isinstance(mask, str) and memory_budget is not None:
+                raise ValueError("a mask of the grid shape fixes the grid, use mask='data' with memory_budget")
+            self.gridMask() # check the shape
+        if engine in ["numba", "dp"]:
+            try:
+                import numba # optional dependency of the numba and dp engines
+            except ImportError:
+                raise ValueError(f"engine={engine!r} needs numba, install it with pip install FDD[numba]")
+        
         if self.scripted:
             # scale gradients?
             if self.scaled:
@@ -67,30 +152,124 @@ class FDD():
                 script = "scripted_primal_dual"
             
             self.model = load_model(script + ".pt", device=self.device) #torch.jit.load(script + ".pt", map_location = self.device)
+        elif self.engine == "numba":
+            if self.inplace or adaptive or precondition or relaxation != 1.0 or restart or compact is not None \
+                    or backend != "eager" or tile > 0 or workers > 1:
+                raise ValueError("the numba engine runs the allocating loop, without the in-place, compile or tiled options")
+            from .numba_engine import NumbaPrimalDual # optional dependency
+            self.model = NumbaPrimalDual(check_every=self.check_every, criterion=self.criterion,
+                                         sync_every=self.sync_every, trace=self.trace)
+        elif self.engine == "dp":
+            if self.image or self.X.shape[1] > 1 or (self.Y.ndim > 1 and self.Y.shape[1] > 1):
+                raise ValueError("the dp engine fits a scalar Y on one-dimensional X")
+            if self.inplace or adaptive or precondition or relaxation != 1.0 or restart or compact is not None \
+                    or backend != "eager" or tile > 0 or workers > 1 or pyramid > 0 or memory_budget is not None:
+                raise ValueError("the dp engine solves exactly, without the options of the iterative solver")
+            self.model = None
+        elif self.engine != "torch":
+            raise ValueError(f"engine must be one of ['torch', 'numba', 'dp'], got {engine}")
         else:
-            self.model = PrimalDual()
-        
-        self.model = self.model.to(self.device)
+            self.model = PrimalDual(inplace=self.inplace, check_every=self.check_every, criterion=self.criterion,
+                                    sync_every=self.sync_every, adaptive=self.adaptive,
+                                    precondition=self.precondition, relaxation=self.relaxation,
+                                    restart=self.restart, trace=self.trace, compact=self.compact,
+                                    backend=self.backend, cache_dir=self.cache_dir, label_window=self.label_window)
+        
+        if self.model is not None:
+            self.model = self.model.to(self.device)
+        self.state = None # solver state of the last run, see run(warm_start=...)
+        self.energy_trace = None # EnergyTrace of the last run if trace=True
+        
+        if self.memory_budget is not None:
+            self.plan_resources(self.memory_budget)
         # TODO: exclude duplicate points (there shouldnt be any cause the variables are assumed to be continuous but anyway)
         
 
+    @classmethod
+    def from_chunks(cls, chunks, bounds=None, reservoir : int=0, prefetch : bool=True, seed=None, **kwargs):
+        # FDD on data read in chunks, without holding all points in memory: chunks is an iterable of (X, Y)
+        # arrays (or a function returning a new one), streamed through the binning of castDataToGridSmooth,
+        # which keeps only the sums of Y and the number of points per cell and, with reservoir > 0, a uniform
+        # sample of up to reservoir points per cell (cellPoints, boundaryGridToData, the fill of empty cells).
+        # bounds = (min of X, max of X, min of Y, max of Y), per column, must hold all the data; without them,
+        # chunks must be a function and the data is read twice. With prefetch, the next chunk is read in a
+        # thread while the current one is binned. Other keyword arguments are those of FDD
+        if kwargs.get("image") or kwargs.get("engine") == "dp" or kwargs.get("memory_budget") is not None \
+                or kwargs.get("gridding", "smooth") != "smooth":
+            raise ValueError("from_chunks bins points on the grid, without image, the dp engine, memory_budget or "
+                             "gridding='points'")
+        if bounds is None:
+            if not callable(chunks):
+                raise ValueError("bounds are needed to read chunks once, or pass a function returning the chunks")
+            bounds = chunkBounds(chunks())
+        min_x, max_x, min_y, max_y = (np.asarray(b, dtype = np.float64) for b in bounds)
+        model = cls(np.stack([min_y, max_y]), np.stack([min_x, max_x]).reshape(2, -1), **kwargs) # grid of the bounds
+        model.streamChunks(chunks() if callable(chunks) else chunks, reservoir, prefetch, seed)
+        return model
+
+    def streamChunks(self, chunks, reservoir=0, prefetch=True, seed=None):
+        # bin the (X, Y) chunks into the grid of castDataToGridSmooth (see from_chunks). Per cell, point k of
+        # the cell replaces a random one of the reservoir samples with probability reservoir / (k + 1)
+        shape = self.grid_x.shape[:-1]
+        n_cells = int(np.prod(shape))
+        channels = self.Y.shape[1] if self.Y.ndim > 1 else 1
+        sums = np.zeros((n_cells, channels))
+        counts = np.zeros(n_cells, dtype = np.int64)
+        sample_x = np.empty((n_cells, reservoir, self.X.shape[1]))
+        sample_y = np.empty((n_cells, reservoir, channels))
+        rng = np.random.default_rng(seed)
+
+        for X, Y in (prefetched(chunks) if prefetch else chunks):
+            X, Y = self.scalePoints(np.asarray(X, dtype = np.float64).reshape(len(X), -1), np.asarray(Y, dtype = np.float64))
+            Y = Y.reshape(len(Y), channels)
+            cells = self.gridCells(X, shape)
+            for c in range(channels):
+                sums[:, c] += np.bincount(cells, weights = Y[:, c], minlength = n_cells)
+            if reservoir > 0:
+                # number of points of its cell before every point, in this chunk and the ones before
+                order = np.argsort(cells, kind = "stable")
+                starts = np.searchsorted(cells[order], cells[order], side = "left")
+                seen = np.empty(len(cells), dtype = np.int64)
+                seen[order] = counts[cells[order]] + np.arange(len(cells)) - starts
+                slot = np.where(seen < reservoir, seen, np.floor(rng.random(len(cells)) * (seen + 1)).astype(np.int64))
+                keep = slot < reservoir # later points of a cell overwrite earlier ones, as if added one by one
+                sample_x[cells[keep], slot[keep]] = X[keep]
+                sample_y[cells[keep], slot[keep]] = Y[keep]
+            counts += np.bincount(cells, minlength = n_cells)
+
+        grid_y = np.divide(sums, counts[:, None], where = counts[:, None] != 0, out = sums).reshape(list(shape) + [channels])
+        self.grid_counts = counts.reshape(shape).astype(float)
+
+        # the reservoir samples as the points of every cell, see castDataToGridSmooth
+        kept = np.minimum(counts, reservoir)
+        sampled = np.arange(reservoir) < kept[:, None]
+        self.cell_points = sample_x[sampled]
+        self.cell_offsets = np.concatenate([[0], np.cumsum(kept)])
+        if reservoir > 0:
+            self.fillEmptyCells(grid_y, self.cell_points, sample_y[sampled])
+        else: # closest cell with points instead
+            self.fillEmptyCells(grid_y)
+        self.grid_y = grid_y
+
     def normalizeData(self):
         
-        min_y = np.min(self.Y, axis = 0)
-        min_x = np.min(self.X, axis = 0)
+        self.min_y = np.min(self.Y, axis = 0)
+        self.min_x = np.min(self.X, axis = 0)
         
-        self.Y = self.Y - min_y # start at 0
-        self.X = self.X - min_x
+        self.Y = self.Y - self.min_y # start at 0
+        self.X = self.X - self.min_x
         
-        max_y = np.max(self.Y, axis = 0)
+        self.max_y = np.max(self.Y, axis = 0)
         if self.rectangle: # retain proportions between data -- should be used when units are identical along all axes
-            max_x = np.max(self.X)
-            self.Y = self.Y / max_y
-            self.X = self.X / max_x
+            self.max_x = np.max(self.X)
         else: # else scale to square
-            max_x = np.max(self.X, axis = 0)
-            self.Y = self.Y / max_y
-            self.X = self.X / max_x
+            self.max_x = np.max(self.X, axis = 0)
+        self.Y = self.Y / self.max_y
+        self.X = self.X / self.max_x
+
+    def scalePoints(self, X, Y):
+        # scale points that were not in the data passed to FDD like normalizeData scaled the data
+        return (X - self.min_x) / self.max_x, (Y - self.min_y) / self.max_y
             
     def castImageToGrid(self):
         self.grid_y = np.expand_dims(self.Y.copy(), -1)
@@ -98,19 +277,17 @@ class FDD():
 
         self.grid_x = X_temp.copy() # , X_temp.copy()
         
-        # assign original data points as tuples to align with case for non-image data
-        self.grid_x_og = np.empty(list(self.grid_x.shape[:-1]), dtype = object) # assign original x values as well for later
-
-        it = np.nditer(self.grid_x[...,0], flags = ['multi_index'])
-        for x in it:
-            idx = it.multi_index
-            self.grid_x_og[idx] = [self.grid_x[idx]]
+        # every pixel holds one point, its own coordinates, to align with case for non-image data
+        self.cell_points = self.grid_x.reshape(-1, self.grid_x.shape[-1]).copy()
+        self.cell_offsets = np.arange(self.cell_points.shape[0] + 1)
 
         self.resolution = (1-np.max(self.grid_x)) 
     
     def castDataToGridPoints(self):
         
         n = self.Y.shape[0]
+        if self.X.ndim == 1:
+            self.X = np.expand_dims(self.X, -1)
         
         if self.resolution is None:
             # calculate 0.5% quantile of distances between points
@@ -139,33 +316,56 @@ class FDD():
         # set up grid
         grid_x = np.meshgrid(*[np.arange(0, xmax[i], self.resolution) for i in range(self.X.shape[1])])
         grid_x = np.stack(grid_x, axis = -1)
-        if self.Y.ndim > 1: # account for vector-valued outcomes
-            grid_y = np.zeros(list(grid_x.shape[:-1]) + [self.Y.shape[1]])
+
+        # find the closest data points of all points on the grid at once and assign their value, averaged with
+        # inverse-distance weights for neighbors > 1 (a data point on the grid point gets all the weight)
+        tree = cKDTree(self.X)
+        k = min(int(self.neighbors), n)
+        distances, closest = tree.query(grid_x.reshape(-1, grid_x.shape[-1]), k=k, workers=-1)
+        Y = self.Y.reshape(n, -1)
+        if k == 1:
+            values = Y[closest]
         else:
-            grid_y = np.zeros(list(grid_x.shape[:-1]))
-        grid_x_og = np.empty(list(grid_x.shape[:-1]), dtype = object) # assign original x values as well for later
+            exact = distances[:, :1] == 0
+            with np.errstate(divide = "ignore"):
+                weights = np.where(exact, distances == 0, 1 / distances)
+            values = np.einsum("ik,ikc->ic", weights, Y[closest]) / weights.sum(axis = 1, keepdims = True)
+            closest = closest[:, 0]
+        grid_y = values.reshape(grid_x.shape[:-1] + (Y.shape[1],)) # with a "channel" dimension for scalar outcomes
 
-        # find closest data point for each point on grid and assign value
-        # Iterate over the grid cells
-        it = np.nditer(grid_x[...,0], flags = ['multi_index'])
-        for x in it:
-            distances = np.linalg.norm(self.X - grid_x[it.multi_index], axis=1, ord = 2)
-            # Find the closest seed
-            closest_seed = np.argmin(distances)
-            # Assign the value of the corresponding data point to the grid cell
-            grid_y[it.multi_index] = self.Y[closest_seed] #.min()
+        # assign original x value of the closest point
+        self.cell_points = self.X_raw.reshape(n, -1)[closest, :]
+        self.cell_offsets = np.arange(self.cell_points.shape[0] + 1)
 
-            # assign original x value
-            grid_x_og[it.multi_index] = tuple(self.X_raw[closest_seed,:])
-        
-        if self.Y.ndim == 1:
-            grid_y = grid_y.reshape(grid_y.shape + (1,))
-
-        self.grid_x_og = grid_x_og
         self.grid_x = grid_x
         self.grid_y = grid_y
         
         
+    def gridCells(self, X, shape):
+        # flat index into a grid of the given shape of the cell of every (scaled) point, points outside the grid
+        # go to the cells on its edge
+        indices = [(np.clip(X[:, i] // self.resolution, 0, shape[i] - 1)).astype(int) for i in range(X.shape[1])]
+        return np.ravel_multi_index(indices, shape)
+
+    def fillEmptyCells(self, grid_y, X=None, Y=None):
+        # assign the cells of grid_y without points (grid_counts == 0) the Y of the closest of the points X
+        # (fill="kdtree", queried on all cores), or the mean of the closest cell with points by a Euclidean
+        # distance transform of the occupancy grid (fill="edt" or without points, linear in the number of cells)
+        empty = self.grid_counts == 0
+        if not empty.any() or empty.all() or isinstance(self.mask, str): # mask="data" leaves them out
+            return
+        empty_cells = np.where(empty)
+        if self.fill == "edt" or X is None or len(X) == 0:
+            closest = distance_transform_edt(empty, return_distances = False, return_indices = True)
+            grid_y[empty_cells] = grid_y[tuple(closest[d][empty_cells] for d in range(empty.ndim))]
+            return
+        empty_cell_coordinates = np.vstack(empty_cells).T * self.resolution
+        tree = cKDTree(X + self.resolution / 2) # get centerpoints of hypervoxels
+        _, closest_indices = tree.query(empty_cell_coordinates, k=1, workers=-1)
+
+        # Assign the closest data point values to the empty grid cells
+        grid_y[empty_cells] = Y[closest_indices]
+
     def castDataToGridSmooth(self):
         
         # if self.X only 1 dimension, add a second dimension
@@ -175,10 +375,8 @@ class FDD():
         if self.resolution is None:
             self.resolution = 1/int(self.X_raw.max(axis=0).min()) # int so we get a natural number of grid cells
         
-        xmax = np.max(self.X, axis = 0)
-        
         # set up grid
-        grid_x = np.meshgrid(*[np.arange(0, xmax[i], self.resolution) for i in reversed(range(self.X.shape[1]))])
+        grid_x = np.meshgrid(*self.gridAxes(self.resolution))
 
 
         grid_x = np.stack(grid_x, axis = -1)
@@ -186,69 +384,139 @@ class FDD():
             grid_y = np.zeros(list(grid_x.shape[:-1]) + [self.Y.shape[1]])
         else:
             grid_y = np.zeros(list(grid_x.shape[:-1]))
-        grid_x_og = np.empty(list(grid_x.shape[:-1]), dtype = object) # assign original x values as well for later
-        
-        # Get the indices of the grid cells for each data point
-        # indices = [(np.clip(self.X[:, i] // self.resolution, 0, grid_y.shape[i] - 1)).astype(int) for i in range(self.X.shape[1])]
-        indices = [(np.clip(self.X[:, i] // self.resolution, 0, grid_y.shape[i] - 1)).astype(int) for i in range(self.X.shape[1])]
-        
-        indices = np.array(indices).T
-
-        # Create a count array to store the number of data points in each cell
-        counts = np.zeros_like(grid_y)
-
-        # Initialize grid_x_og with empty lists
-        for index in np.ndindex(grid_x_og.shape):
-            grid_x_og[index] = []
         
+        # flat index of the cell of every point, and the sums of Y and the number of points per cell
+        # (bincount adds the points in their order, as a loop over them would)
+        cells = self.gridCells(self.X, grid_x.shape[:-1])
+        n_cells = int(np.prod(grid_x.shape[:-1]))
+        point_counts = np.bincount(cells, minlength = n_cells)
+        if self.Y.ndim > 1:
+            sums = np.stack([np.bincount(cells, weights = self.Y[:, c], minlength = n_cells)
+                             for c in range(self.Y.shape[1])], axis = -1)
+            counts = np.repeat(point_counts[:, None], self.Y.shape[1], axis = 1).astype(float)
+        else:
+            sums = np.bincount(cells, weights = self.Y, minlength = n_cells)
+            counts = point_counts.astype(float)
+        grid_y = sums.reshape(grid_y.shape)
+        counts = counts.reshape(grid_y.shape)
 
-
-        # Iterate through the data points and accumulate their values in grid_y and grid_x_og
-        for i, index_tuple in enumerate(indices):
-            index = tuple(index_tuple)
-            if np.all(index < grid_y.shape):
-                # add  Y value to grid cell
-                # print(index)
-                # print(i)
-                grid_y[index] += self.Y[i]
-                counts[index] += 1
-                grid_x_og[index].append(self.X[i])
-        
-        
+        # the points of every cell: the points sorted by cell, those of cell c in cell_offsets[c]:cell_offsets[c + 1]
+        order = np.argsort(cells, kind = "stable")
+        self.cell_points = self.X[order]
+        self.cell_offsets = np.concatenate([[0], np.cumsum(point_counts)])
 
         # Divide the grid_y by the counts to get the average values
         grid_y = np.divide(grid_y, counts, where=counts != 0, out=grid_y)
+        self.grid_counts = counts if self.Y.ndim == 1 else counts[..., 0] # points per cell
 
         # Find the closest data point for empty grid cells
-        empty_cells = np.where(counts == 0)
-        empty_cell_coordinates = np.vstack([empty_cells[i] for i in range(self.X.shape[1])]).T * self.resolution
-        if empty_cell_coordinates.size > 0:
-            tree = cKDTree(self.X + self.resolution / 2) # get centerpoints of hypervoxels
-            _, closest_indices = tree.query(empty_cell_coordinates, k=1)
-            closest_Y_values = self.Y[closest_indices]
-
-            # Assign the closest data point values to the empty grid cells
-            grid_y[empty_cells] = closest_Y_values
+        self.fillEmptyCells(grid_y, self.X, self.Y)
         
         # add an extra "channel" dimension if we have a scalar outcome
         if self.Y.ndim == 1:
             grid_y = grid_y.reshape(grid_y.shape + (1,))
 
-        self.grid_x_og = grid_x_og
         self.grid_x = grid_x
         self.grid_y = grid_y
         
         
     def castDataToGrid(self):
         
-        #self.castDataToGridPoints()
-        self.castDataToGridSmooth()
+        if self.gridding == "points":
+            self.castDataToGridPoints()
+        else:
+            self.castDataToGridSmooth()
+        
+    def gridAxes(self, resolution):
+        # cell coordinates along every dimension of the grid of castDataToGridSmooth
+        xmax = np.max(self.X, axis = 0)
+        return [np.arange(0, xmax[i], resolution) for i in reversed(range(self.X.shape[1]))]
+    
+    def gridShape(self, resolution):
+        # shape of grid_y at the given resolution, without building the grid
+        if self.image:
+            return list(self.grid_y.shape)
+        shape = list(np.broadcast(*np.meshgrid(*self.gridAxes(resolution), sparse = True)).shape)
+        return shape + [self.Y.shape[1] if self.Y.ndim > 1 else 1]
+    
+    def estimate_resources(self, level=None, shape=None):
+        # predicted peak memory (bytes) and floating point operations per iteration of run() at the
+        # given level (default self.level) on grid_y (or a grid of the given shape), see
+        # PrimalDual.estimateResources. The scripted models run the allocating loop, the tiled solve holds
+        # one tile and its halo in memory at a time in every worker
+        level = self.level if level is None else level
+        shape = list(self.grid_y.shape) if shape is None else shape
+        model = self.model if isinstance(self.model, PrimalDual) else PrimalDual()
+        active = None
+        if self.mask is not None: # the same fraction of cells on a grid of another shape
+            mask = self.gridMask()
+            active = int(round(mask.mean() * np.prod(shape[:-1])))
+        nbytes, flops = model.estimateResources(shape, int(level), warm_start = self.pyramid > 0, active = active)
+        if self.tile > 0 or self.workers > 1:
+            tile = self.tile if self.tile > 0 else -(-shape[0] // self.workers)
+            halo = model.check_every + 1
+            tile_shape = [min(n, tile + 2 * halo) for n in shape[:-1]] + shape[-1:]
+            nbytes = self.workers * model.estimateResources(tile_shape, int(level))[0]
+        return nbytes, flops
+    
+    def plan_resources(self, memory_budget, min_level=8):
+        # largest level between min_level and self.level whose solve fits in memory_budget bytes at the
+        # current resolution. If none does, the grid is coarsened in steps of 10% until min_level fits.
+        # Sets level and resolution (and rebuilds the grid) and returns them. The estimate counts tensor
+        # bytes, leave some headroom in the budget for the allocator
+        min_level = min(min_level, self.level)
+        resolution = self.resolution
+        while True:
+            shape = self.gridShape(resolution)
+            for level in range(self.level, min_level - 1, -1):
+                if self.estimate_resources(level, shape)[0] <= memory_budget:
+                    self.level = level
+                    if resolution != self.resolution:
+                        self.resolution = resolution
+                        self.castDataToGrid()
+                    return self.level, self.resolution
+            if self.image or max(shape[:-1]) == 1:
+                raise ValueError(f"no grid fits in a memory budget of {memory_budget} bytes at level {min_level}")
+            resolution = resolution * 1.1
         
 
         
     @staticmethod
     def interpolate(k, uk0, uk1, l):
         return (k + (0.5 - uk0) / (uk1 - uk0)) / l
+    
+    def gridMask(self):
+        # boolean array of the grid cells the solve runs on (None: all): the cells that hold points of the data
+        # (castDataToGridSmooth) or the pixels of an image without NaN for mask="data", else the mask given
+        if self.mask is None:
+            return None
+        if isinstance(self.mask, str):
+            if self.image:
+                return ~np.any(np.isnan(self.grid_y), axis = -1)
+            return self.grid_counts > 0
+        mask = np.asarray(self.mask, dtype = bool)
+        if list(mask.shape) != list(self.grid_y.shape[:-1]):
+            raise ValueError(f"mask has shape {list(mask.shape)}, expected the grid shape {list(self.grid_y.shape[:-1])}")
+        return mask
+    
+    def labelValues(self):
+        # values of the level labels in [0, 1] for the solve, None for evenly spaced (k / level). Labels at the
+        # quantiles (k / level) of grid_y on the cells of the solve (gridMask: not the empty or NaN cells left
+        # out by a mask) are mixed with 10% evenly spaced ones, so that they increase strictly (ties, e.g.
+        # clipped data) and no part of [0, 1] goes without labels. Values of Y are scaled like Y
+        if self.labels is None:
+            return None
+        if isinstance(self.labels, str):
+            k = np.arange(1, self.level + 1) / self.level
+            mask = self.gridMask()
+            values = 0.9 * np.nanquantile(self.grid_y if mask is None else self.grid_y[mask], k) + 0.1 * k
+        else:
+            values = np.asarray(self.labels, dtype = np.float64)
+            if not self.image:
+                values = (values - np.min(self.Y_raw)) / (np.max(self.Y_raw) - np.min(self.Y_raw))
+        if not np.all(np.isfinite(values)) or np.any(np.diff(values) <= 0) or values[0] < 0 or values[-1] > 1:
+            raise ValueError("labels must be finite and increase strictly within the range of Y")
+        return values
 
     def isosurface(self, u):
 
@@ -262,7 +530,12 @@ class FDD():
         # get the indices of the last dimension where mask is True
         k = np.where(mask == True)[-1] + 1
         
-        h_img = self.interpolate(k, uk0, uk1, self.level).reshape(self.grid_y.shape[:-1])
+        if self.label_values is None:
+            h_img = self.interpolate(k, uk0, uk1, self.level)
+        else: # between the values of the labels k - 1 and k
+            t0, t1 = self.label_values[k - 1], self.label_values[k]
+            h_img = t0 + (0.5 - uk0) / (uk1 - uk0) * (t1 - t0)
+        h_img = h_img.reshape(self.grid_y.shape[:-1])
         
         return h_img
     
@@ -302,11 +575,28 @@ class FDD():
 
         return visited_points
 
+    def cellPoints(self, index):
+        # original points in the grid cell at index (a view, empty for a cell without points)
+        c = np.ravel_multi_index(tuple(index), self.grid_x.shape[:-1])
+        return self.cell_points[self.cell_offsets[c]:self.cell_offsets[c + 1]]
+
+    def cellMeans(self):
+        # mean of the original points of every grid cell and their number, the centre of the cell for empty cells
+        counts = np.diff(self.cell_offsets)
+        cells = np.repeat(np.arange(counts.size), counts)
+        sums = np.stack([np.bincount(cells, weights = self.cell_points[:, d], minlength = counts.size)
+                         for d in range(self.cell_points.shape[1])], axis = -1)
+        means = self.grid_x.reshape(-1, self.grid_x.shape[-1]) + self.resolution / 2
+        means[counts > 0] = sums[counts > 0] / counts[counts > 0, None]
+        shape = self.grid_x.shape[:-1]
+        return means.reshape(tuple(shape) + (-1,)), counts.reshape(shape)
+
     def boundaryGridToData(self, J_grid, u, average = False):
         # get the indices of the J_grid where J_grid is 1
 
 
         k = np.array(np.where(J_grid == 1))
+        means, counts = self.cellMeans()
         
 
         # Store the average points
@@ -321,9 +611,6 @@ class FDD():
         # Iterate over the boundary points
         for i in range(k.shape[1]):
 
-            origin_points = []
-            dest_points = []
-
             # Get the coordinates of the current boundary point
             point = k[:, i]
 
@@ -344,65 +631,23 @@ class FDD():
             # Check if there are any valid neighbors
             if neighbors:
 
-                # origin_points
-                origin_points = self.grid_x_og[tuple(point)]
-                if len(origin_points) == 0:
-                    origin_points = self.grid_x[tuple(point)] + self.resolution / 2
+                # jumpfrom point: mean of the points in the hypervoxel, centerpoint if it is empty
+                jumpfrom = means[tuple(point)]
                 Yjumpfrom = float(u[tuple(point)])
 
-
-                # jumpfrom point
-                origin_points = np.stack(origin_points).squeeze()
-                if origin_points.ndim > 1: # if there are multiple points in the hypervoxel, take the mean
-                    jumpfrom = np.mean(origin_points, axis = 0)
-                else:
-                    jumpfrom = origin_points
-
-
                 # jumpto point
-                pointslist = [self.grid_x_og[tuple(neighbors[j])] if self.grid_x_og[tuple(neighbors[j])] != []  # if grid cell is empty, assign centerpoint
-                                else [self.grid_x[tuple(neighbors[j])] + self.resolution / 2] for j in range(len(neighbors))]
-
                 if average:
-                    counts = [len(pointslist[j]) for j in range(len(neighbors))]
-                    total = sum(counts) # TODO: jump sizes on diagonal boundary sections are off
-                    Yjumpto = np.sum([(u[tuple(neighbors[j])] * counts[j]) / total for j in range(len(neighbors))]) # proper unweighted average of the y values
-                    dest_points = np.stack([item for sublist in pointslist for item in sublist]).squeeze()
-                    if dest_points.ndim > 1: # if there are multiple points in the hypervoxel, take the mean
-                        jumpto = np.mean(dest_points, axis = 0)
-                    else:
-                        jumpto = dest_points
+                    weights = [max(counts[tuple(neighbors[j])], 1) for j in range(len(neighbors))] # empty cells count as their centerpoint
+                    total = sum(weights) # TODO: jump sizes on diagonal boundary sections are off
+                    Yjumpto = np.sum([(u[tuple(neighbors[j])] * weights[j]) / total for j in range(len(neighbors))]) # proper unweighted average of the y values
+                    jumpto = np.sum([means[tuple(neighbors[j])] * weights[j] for j in range(len(neighbors))], axis = 0) / total
                 else:
                     # get point with largest jump size
                     Yjumptos = [u[tuple(neighbors[j])] for j in range(len(neighbors))]
                     Yjumpsizes = [abs(Yjumptos[j] - Yjumpfrom) for j in range(len(neighbors))]
                     idx = np.argmax(Yjumpsizes)
                     Yjumpto = Yjumptos[idx]
-                    dest_points = self.grid_x_og[tuple(neighbors[idx])]
-                    if len(dest_points) == 0:
-                        dest_points = self.grid_x[tuple(neighbors[idx])] + self.resolution / 2
-                    dest_points = np.stack(dest_points).squeeze()
-                    
-                    if dest_points.ndim > 1: # if there are multiple points in the hypervoxel, take the mean
-                        jumpto = np.mean(dest_points, axis = 0)
-                    else:
-                        jumpto = dest_points
-                    
-                    # dists = [[np.linalg.norm(jumpfrom - point) for point in pointslist[j]] for j in range(len(neighbors))]
-                    # idx = np.argmin([np.argmin(sublist) for sublist in dists])
-                    # closest = tuple(neighbors[idx])
-                    # Yjumpto = u[closest]
-
-                    # dest_points = self.grid_x_og[closest]
-                    # if len(dest_points) == 0:
-                    #     dest_points = self.grid_x[closest] + self.resolution / 2
-                    # dest_points = np.stack(dest_points).squeeze()
-
-                    # if dest_points.ndim > 1: # if there are multiple points in the hypervoxel, take the mean
-                    #     jumpto = np.mean(dest_points, axis = 0)
-                    # else:
-                    #     jumpto = dest_points
-                        
+                    jumpto = means[tuple(neighbors[idx])]
 
                 # append to lists
                 Y_boundary.append(1)
@@ -438,8 +683,9 @@ class FDD():
         out = plt.hist(u_norm)
         plt.close()  # Close the figure to free up memory
 
-        X1 = np.tile(out[1][1:], out[0].shape[0])
-        X2 = out[0].reshape(-1,1).squeeze(1)
+        # one histogram per column of a 2-D u_norm, a single one for 1-D input
+        X1 = np.tile(out[1][1:], np.size(out[0]) // (len(out[1]) - 1))
+        X2 = np.ravel(out[0])
         Z = np.stack([X1, X2], axis = 1)
 
         # the histogram is "bimodal" (one large cluster and a bunch of smaller ones), so we use k-means to find the edge of the first "jump" cluster
@@ -449,19 +695,22 @@ class FDD():
         nu = X1[kmeans.labels_ == 1].max()
         return nu
         
-    def boundary(self, u):
-        
-        u_diff = self.forward_differences(u, D = len(u.shape))
-        # u_diff = u_diff / self.resolution # scale FD by side length
-        u_norm = np.linalg.norm(u_diff, axis = 0, ord = 2) # 2-norm
+    def boundary(self, u, J_grid=None):
+        # J_grid: boundary on the grid if known from the fit (dp engine), else thresholded from u
 
-        if self.pick_nu == "kmeans":
-            nu = self.pickKMeans(u_norm)
-        else:
-            nu = np.sqrt(self.nu)
-        
-        # find the boundary on the grid by comparing the gradient norm to the threshold
-        J_grid = (u_norm >= nu).astype(int)
+        if J_grid is None:
+            u_diff = self.forward_differences(u, D = len(u.shape))
+            # u_diff = u_diff / self.resolution # scale FD by side length
+            u_norm = np.linalg.norm(u_diff, axis = 0, ord = 2) # 2-norm
+
+            if self.pick_nu == "kmeans":
+                finite = np.isfinite(u_norm)
+                nu = self.pickKMeans(u_norm if finite.all() else u_norm[finite]) # u is NaN outside a mask
+            else:
+                nu = np.sqrt(self.nu)
+
+            # find the boundary on the grid by comparing the gradient norm to the threshold
+            J_grid = (u_norm >= nu).astype(int)
         
                 
         # scale u back to get correct jump sizes
@@ -519,7 +768,8 @@ class FDD():
         eps = eps.cpu().detach().numpy()
         
         u = self.isosurface(v) 
-        
+        if self.grid_mask is not None: # not solved
+            u[~self.grid_mask] = np.nan
         
         J_grid, jumps = self.boundary(u)
         
@@ -533,15 +783,92 @@ class FDD():
         
     
     
-    def run(self):
+    def processSegmentation(self, results):
+        # processResults for the exact 1-D fit of the dp engine: u on the grid is the mean of the fit over
+        # the points of every cell (the nearest point for empty cells), J_grid the cell before every jump
+        x, v, jump, nrj = results
+        cells = self.grid_y.shape[0]
+
+        idx = np.clip(x // self.resolution, 0, cells - 1).astype(int)
+        counts = np.bincount(idx, minlength = cells)
+        u = np.bincount(idx, weights = v, minlength = cells)
+        u = np.divide(u, counts, where = counts != 0, out = u)
+        empty = np.where(counts == 0)[0]
+        if empty.size > 0:
+            centers = (empty + 0.5) * self.resolution
+            right = np.clip(np.searchsorted(x, centers), 1, x.shape[0] - 1)
+            u[empty] = v[np.where(centers - x[right - 1] <= x[right] - centers, right - 1, right)]
+
+        J_grid = np.zeros(cells, dtype = int)
+        J_grid[np.maximum(idx[:-1], idx[1:] - 1)[jump]] = 1
+
+        u = u.reshape(self.grid_y.shape[:-1])
+        J_grid, jumps = self.boundary(u, J_grid.reshape(self.grid_y.shape[:-1]))
+
+        # scale u back to get correct jump sizes
+        u = u * np.max(self.Y_raw, axis = -1)  + np.min(self.Y_raw, axis = -1)
+
+        # exact solution: no iterations, no residual
+        return (u, jumps, J_grid, np.array(nrj), np.array(0.0), 0)
+
+    def run(self, warm_start=None, checkpoint_path=None, checkpoint_every=1000):
+        # warm_start: SolverState of a previous run on the same grid and level (e.g. model.state),
+        # to start from its primal and dual variables instead of from scratch
+        # checkpoint_path: file the solver state is saved to every checkpoint_every iterations; a run that
+        # finds it resumes from it, with the result of an uninterrupted run (see PrimalDual.saveCheckpoint)
         
+        if checkpoint_path is not None and (self.engine != "torch" or self.scripted or self.tile > 0 or
+                                            self.workers > 1 or self.pyramid > 0):
+            raise ValueError(f"checkpoints need the torch engine (got engine={self.engine!r}) with scripted=False, "
+                             "without tiles or pyramid")
+
+        if self.engine == "dp":
+            if warm_start is not None:
+                raise ValueError("the dp engine solves exactly, there is nothing to warm start")
+            from .dp_engine import segmentPoints # optional dependency
+            self.state = None
+            return self.processSegmentation(segmentPoints(self.X, self.Y, self.lmbda, self.nu, self.grid_y.shape[0]))
+
         f, repeats, level, lmbda, nu, tol = \
             self.arraysToTensors(self.grid_y, self.iter, self.level, self.lmbda, self.nu, self.tol)
+        self.label_values = self.labelValues()
+        self.grid_mask = self.gridMask()
+        if not self.scripted:
+            self.model.labels = None if self.label_values is None else \
+                torch.tensor(self.label_values, device = self.device, dtype = torch.float32)
         
         if self.scripted:
+            if warm_start is not None or self.pyramid > 0 or self.tile > 0 or self.workers > 1:
+                raise ValueError("warm starts, pyramid and tiled solves need scripted=False")
             results = self.model(f, repeats, level, lmbda, nu, tol)
+        elif self.tile > 0 or self.workers > 1:
+            if warm_start is not None or self.pyramid > 0:
+                raise ValueError("the tiled solve starts from scratch on the full grid, use tile=0 and workers=1")
+            # without a tile size, one band of tiles per worker along the first dimension
+            tile = self.tile if self.tile > 0 else -(-self.grid_y.shape[0] // self.workers)
+            results = self.model.forwardTiled(f, repeats, level, lmbda, nu, tol, tile, self.tile_dir, self.workers)
+            self.state = self.model.state
+            self.energy_trace = self.model.trace
+        elif self.pyramid > 0:
+            if warm_start is not None:
+                raise ValueError("the pyramid solve starts from the coarsest grid, use pyramid=0 to warm start")
+            results = self.model.forwardPyramid(f, repeats, level, lmbda, nu, tol, self.pyramid)
+            self.state = self.model.state
+            self.energy_trace = self.model.trace
+        elif self.grid_mask is not None:
+            if warm_start is not None:
+                raise ValueError("the masked solve starts from the data, without warm starts")
+            mask = torch.tensor(self.grid_mask, device = self.device)
+            results = self.model.forwardMasked(f, repeats, level, lmbda, nu, tol, mask, checkpoint_path,
+                                               checkpoint_every)
+            self.state = self.model.state
+            self.energy_trace = self.model.trace
         else:
-            results = self.model.forward(f, repeats, level, lmbda, nu, tol)
+            checkpoints = {} if checkpoint_path is None else \
+                {"checkpoint_path" : checkpoint_path, "checkpoint_every" : checkpoint_every}
+            results = self.model.forward(f, repeats, level, lmbda, nu, tol, warm_start=warm_start, **checkpoints)
+            self.state = self.model.state
+            self.energy_trace = self.model.trace
         
         u, jumps, J_grid, nrj, eps, it = self.processResults(results)
         
@@ -0,0 +1,264 @@
+import numpy as np
+import torch
+from numba import njit, prange
+from typing import List, Optional, Tuple
+from .primaldual_multi_scaled_tune import PrimalDual, ConvergenceMonitor, SolverState
+
+
+# voxels per parallel work item, each with its own scratch arrays
+BLOCK = 64
+
+
+@njit(parallel=True, cache=True)
+def dualStep(px, pt, sx, mux, mubarx, ubar, f, labels, alpha, dims, strides, lmbda, nu, sigmap, sigmas, tau, check):
+    # parabola, l2projection and mu of PrimalDual.forward in one pass over the voxels, in place, with the
+    # label values and parabola curvatures of PrimalDual.labelGeometry. The sums over the sets (k1, k2) that
+    # the torch engine takes with the incidence matrix are running sums here.
+    # Returns sum |px - px_old|, |pt - pt_old|, |mux - mux_old| if check
+
+    D, V, C, l = px.shape
+    inv_n = np.float32(1.0 / dims[0]) # differences are divided by the resolution
+    inv_l = np.float32(1.0 / l)
+    nblocks = (V + BLOCK - 1) // BLOCK
+    partial = np.zeros((nblocks, 3))
+
+    for blk in prange(nblocks):
+        ux = np.empty((D, l), dtype=np.float32)
+        rows = np.empty(l)
+        cols = np.empty(l)
+        run = np.empty(D)
+        mx = np.empty(D)
+        for v in range(blk * BLOCK, min(V, (blk + 1) * BLOCK)):
+            for c in range(C):
+
+                # ux = px + sigmap * (forward differences of ubar + sum of mux over the sets containing z)
+                for d in range(D):
+                    last = (v // strides[d]) % dims[d] == dims[d] - 1
+                    rows[:] = 0.0
+                    cols[:] = 0.0
+                    K = 0
+                    for k1 in range(l):
+                        for k2 in range(k1, l):
+                            rows[k1] += mux[d, v, c, K]
+                            cols[k2] += mux[d, v, c, K]
+                            K += 1
+                    musum = 0.0
+                    for z in range(l):
+                        # sets with k1 <= z <= k2: those containing z - 1, plus the ones starting at z,
+                        # minus the ones ending at z - 1
+                        musum += rows[z]
+                        if z > 0:
+                            musum -= cols[z - 1]
+                        g = 0.0 if last else (ubar[v + strides[d], c, z] - ubar[v, c, z]) / inv_n
+                        ux[d, z] = px[d, v, c, z] + sigmap * (g + musum)
+
+                # project (ux, ut) onto the parabola, label by label
+                for z in range(l):
+                    gt = 0.0 if z == l - 1 else (ubar[v, c, z + 1] - ubar[v, c, z]) / inv_l
+                    ut = pt[v, c, z] + sigmap * gt
+                    q = lmbda * (labels[z] - f[v, c]) ** 2
+                    sq = 0.0
+                    for d in range(D):
+                        sq += ux[d, z] * ux[d, z]
+
+                    if ut < alpha[z] * sq - q:
+                        norm = np.sqrt(sq)
+                        a = 2.0 * alpha[z] * norm
+                        b = 2.0 / 3.0 * (1.0 - 2.0 * alpha[z] * (ut + q))
+                        if b < 0:
+                            sb3 = np.sqrt(-b) ** 3
+                            disc = (a - sb3) * (a + sb3)
+                        else:
+                            disc = a * a + b * b * b
+                        if disc < 0:
+                            w = 2.0 * np.sqrt(-b) * np.cos(1.0 / 3.0 * np.arccos(a / np.sqrt(-b) ** 3))
+                        else:
+                            cr = (a + np.sqrt(disc)) ** (1.0 / 3.0)
+                            w = 0.0 if cr == 0 else cr - b / cr
+                        sq = 0.0
+                        for d in range(D):
+                            p = 0.0 if norm == 0 else (w / (2.0 * alpha[z])) * ux[d, z] / norm
+                            if check:
+                                partial[blk, 0] += abs(p - px[d, v, c, z])
+                            px[d, v, c, z] = p
+                            sq += px[d, v, c, z] * px[d, v, c, z]
+                        ut = alpha[z] * sq - q
+                    else:
+                        for d in range(D):
+                            if check:
+                                partial[blk, 0] += abs(ux[d, z] - px[d, v, c, z])
+                            px[d, v, c, z] = ux[d, z]
+                    if check:
+                        partial[blk, 1] += abs(ut - pt[v, c, z])
+                    pt[v, c, z] = ut
+
+                # l2 projection of sx - sigmas * mubarx and the mu update, set by set, with
+                # run[d] = sum of px over the labels k1, ..., k2
+                K = 0
+                for k1 in range(l):
+                    run[:] = 0.0
+                    for k2 in range(k1, l):
+                        norm = 0.0
+                        for d in range(D):
+                            run[d] += px[d, v, c, k2]
+                            mx[d] = sx[d, v, c, K] - sigmas * mubarx[d, v, c, K]
+                            norm += mx[d] * mx[d]
+                        norm = np.sqrt(norm)
+                        for d in range(D):
+                            s = mx[d] * nu / norm if norm > nu * dims[0] else mx[d]
+                            sx[d, v, c, K] = s
+                            m = mux[d, v, c, K]
+                            mux[d, v, c, K] = m + tau * (s - run[d])
+                            mubarx[d, v, c, K] = 2.0 * mux[d, v, c, K] - m
+                            if check:
+                                partial[blk, 2] += abs(mux[d, v, c, K] - m)
+                        K += 1
+
+    return partial[:, 0].sum(), partial[:, 1].sum(), partial[:, 2].sum()
+
+
+@njit(parallel=True, cache=True)
+def primalStep(u, ubar, px, pt, dims, strides, tauu):
+    # clipping of PrimalDual.forward in one pass over the voxels, in place. Returns sum |u - u_old| and
+    # sum |u|
+
+    D, V, C, l = px.shape
+    inv_n = np.float32(1.0 / dims[0])
+    inv_l = np.float32(1.0 / l)
+    nblocks = (V + BLOCK - 1) // BLOCK
+    partial = np.zeros((nblocks, 2))
+
+    for blk in prange(nblocks):
+        for v in range(blk * BLOCK, min(V, (blk + 1) * BLOCK)):
+            for c in range(C):
+                for z in range(l):
+                    # backward differences of px (p[-1] = p[n-1] = 0) and of pt along the labels
+                    div = 0.0
+                    for d in range(D):
+                        j = (v // strides[d]) % dims[d]
+                        before = px[d, v, c, z] if j < dims[d] - 1 else 0.0
+                        after = px[d, v - strides[d], c, z] if j > 0 else 0.0
+                        div += (before - after) / inv_n
+                    before = pt[v, c, z] if z < l - 1 else 0.0
+                    after = pt[v, c, z - 1] if z > 0 else 0.0
+                    div += (before - after) / inv_l
+
+                    old = u[v, c, z]
+                    new = min(max(old + tauu * div, 0.0), 1.0)
+                    if z == 0:
+                        new = 1.0
+                    elif z == l - 1:
+                        new = 0.0
+                    u[v, c, z] = new
+                    ubar[v, c, z] = 2.0 * new - old
+                    partial[blk, 0] += abs(new - old)
+                    partial[blk, 1] += abs(new)
+
+    return partial[:, 0].sum(), partial[:, 1].sum()
+
+
+class NumbaPrimalDual(PrimalDual):
+    # CPU engine for the iteration of PrimalDual.forward, as two multithreaded numba loops per iteration
+    # (dualStep, primalStep) that update every voxel in place instead of one torch op at a time. Same
+    # step sizes, convergence test, warm starts and solver state as the torch engine; the in-place
+    # options (adaptive, precondition, relaxation, restart, compact) are torch only
+
+    def __init__(self, check_every : int = 10, criterion : str = "energy", sync_every : int = 1,
+                 trace : bool = False, labels : Optional[torch.Tensor] = None) -> None:
+        super(NumbaPrimalDual, self).__init__(check_every=check_every, criterion=criterion, sync_every=sync_every,
+                                              trace=trace, labels=labels)
+
+    def estimateResources(self, dims : List[int], l : int, warm_start : bool = False,
+                          active : Optional[int] = None) -> Tuple[int, int]:
+        # the variables and f, updated in place: no work buffers. ~12 operations per element of sx and
+        # ~50 + 10 D per lifted voxel, see PrimalDual.estimateResources. active: number of voxels solved on
+        # (all for None), as for the torch engine
+
+        D = len(dims) - 1
+        proj = int(l * (l - 1) / 2 + l)
+        voxels = int(np.prod(dims)) if active is None else int(active) * dims[-1]
+        nbytes = 4 * (3 * D * voxels * proj + (D + 3) * voxels * l + voxels)
+        if warm_start:
+            nbytes *= 2
+        flops = 12 * D * voxels * proj + (50 + 10 * D) * voxels * l
+
+        return nbytes, flops
+
+    def forward(self, f, repeats, l, lmbda, nu, tol, warm_start : Optional[SolverState] = None,
+                checkpoint_path : Optional[str] = None, checkpoint_every : int = 1000):
+
+        if checkpoint_path is not None:
+            raise ValueError("checkpoints are saved by the torch engine only, use engine='torch'")
+        if warm_start is not None:
+            self.checkState(warm_start, f, int(l))
+
+        l = int(l)
+        D = f.dim() - 1
+        dims = [f.size(dim = x) for x in range(D)]
+        C = f.shape[-1]
+        V = int(np.prod(dims))
+        proj = int(l * (l - 1) / 2 + l)
+        steps = self.stepSizes(f, l)
+        tauu, sigmap, sigmas, tau = [float(x) for x in steps]
+        lmbda, nu = float(lmbda), float(nu)
+        strides = np.array([int(np.prod(dims[d + 1:])) for d in range(D)], dtype=np.int64)
+        dims_np = np.array(dims, dtype=np.int64)
+        labels, alpha = [x.numpy() for x in self.labelGeometry(l, torch.device("cpu"), torch.float64)]
+
+        # voxels flattened: u [V, C, l], px [D, V, C, l], sx [D, V, C, proj]
+        fv = f.detach().cpu().numpy().astype(np.float32).reshape(V, C)
+        if warm_start is None:
+            u = np.repeat(fv[..., None], l, axis=-1)
+            ubar = u.copy()
+            px = np.zeros((D, V, C, l), dtype=np.float32)
+            pt = np.zeros((V, C, l), dtype=np.float32)
+            sx, mux, mubarx = [np.zeros((D, V, C, proj), dtype=np.float32) for _ in range(3)]
+        else:
+            u, ubar, px, pt, sx, mux, mubarx = [x.detach().cpu().numpy().astype(np.float32).reshape(
+                ([D] if x.dim() == f.dim() + 2 else []) + [V, C, x.shape[-1]]) for x in warm_start]
+
+        n_voxels = V * l
+        monitor = ConvergenceMonitor(self.criterion, tol, n_voxels, self.check_every, self.sync_every, [],
+                                     torch.device("cpu"), self.trace_checks)
+
+        for it in range(int(repeats)):
+
+            check = monitor.due(it)
+            if self.sync_every > 1: # freeze once converged
+                active = float(monitor.active)
+                tauu, sigmap, sigmas, tau = [float(x) * active for x in steps]
+            dpx, dpt, dmu = dualStep(px, pt, sx, mux, mubarx, ubar, fv, labels, alpha, dims_np, strides, lmbda, nu,
+                                     sigmap, sigmas, tau, check)
+            nrj, unorm = primalStep(u, ubar, px, pt, dims_np, strides, tauu)
+            if check:
+                residual = torch.tensor(nrj / float(steps[0]) + (dpx + dpt) / float(steps[1]) + dmu / float(steps[3]),
+                                        dtype=torch.float32)
+                if monitor.update(it, torch.tensor(nrj, dtype=torch.float32), torch.tensor(unorm, dtype=torch.float32),
+                                  residual) and bool(monitor.converged):
+                    break
+
+        def tensor(x, lifted : int):
+            return torch.from_numpy(x).view(([D] if x.ndim == 4 else []) + dims + [C, lifted]).to(f.device)
+
+        self.state = SolverState(tensor(u, l), tensor(ubar, l), tensor(px, l), tensor(pt, l), tensor(sx, proj),
+                                 tensor(mux, proj), tensor(mubarx, proj))
+        self.trace = monitor.energyTrace()
+
+        return (self.state.u, monitor.nrj, monitor.eps, int(monitor.it))
+
+    def forwardInPlace(self, f, repeats, l, lmbda, nu, tol, warm_start : Optional[SolverState] = None,
+                       checkpoint_path : Optional[str] = None, checkpoint_every : int = 1000):
+        raise ValueError("the numba engine runs the allocating loop, use engine='torch' for the in-place loop")
+
+    def forwardWindowed(self, f, repeats, l, lmbda, nu, tol, window : int, checkpoint_path : Optional[str] = None,
+                        checkpoint_every : int = 1000):
+        raise ValueError("the label window solve runs on the torch engine, use engine='torch'")
+
+    def forwardMasked(self, f, repeats, l, lmbda, nu, tol, mask, checkpoint_path : Optional[str] = None,
+                      checkpoint_every : int = 1000):
+        raise ValueError("the masked solve runs on the torch engine, use engine='torch'")
+
+    def forwardTiled(self, f, repeats, l, lmbda, nu, tol, tile : int, directory : Optional[str] = None,
+                     workers : int = 1, threads : int = 1):
+        # the tiles take the step sizes of the full grid (grid_cells), which the numba kernels do not read
+        raise ValueError("the tiled solve runs on the torch engine, use engine='torch'")
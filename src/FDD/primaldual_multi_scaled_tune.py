@@ -1,21 +1,259 @@
 
 from torch import Tensor
 import torch
-from typing import Tuple, List, Dict
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+from typing import Tuple, List, Dict, NamedTuple, Optional
 #from .utils import setDevice
 
 
+class SolverState(NamedTuple):
+    # primal and dual variables of a solve, to warm start the next one
+    u : Tensor
+    ubar : Tensor
+    px : Tensor
+    pt : Tensor
+    sx : Tensor
+    mux : Tensor
+    mubarx : Tensor
+
+
+class EnergyTrace(NamedTuple):
+    # convergence criterion at every check of a solve: iteration, host wall time since the start,
+    # energy sum |u - u_old| and the criterion value eps
+    it : Tensor
+    time : Tensor
+    nrj : Tensor
+    eps : Tensor
+
+
+class ConvergenceMonitor():
+    # stopping test of the primal-dual iterations, evaluated on the device every check_every iterations
+    # and read back by the host only every sync_every checks. In between, problems that have already
+    # converged are frozen by scaling their step sizes with active = 0, so no iteration is wasted on them
+    #
+    # criteria (eps <= tol):
+    #   energy   -- sum |u - u_old| / number of lifted voxels (the original test)
+    #   relative -- sum |u - u_old| / sum |u|
+    #   residual -- primal-dual residual sum |u - u_old| / tauu + sum |p - p_old| / sigmap + sum |mu - mu_old| / tau,
+    #               per lifted voxel, which vanishes at a saddle point of the primal-dual gap
+    #   plateau  -- relative change of the energy between two consecutive checks
+    
+    criteria = ("energy", "relative", "residual", "plateau")
+    
+    def __init__(self, criterion : str, tol, n_voxels : int, check_every : int, sync_every : int, shape : List[int], dev,
+                 trace : bool = False) -> None:
+        
+        if criterion not in self.criteria:
+            raise ValueError(f"criterion must be one of {self.criteria}, got {criterion}")
+        if check_every < 1 or sync_every < 1:
+            raise ValueError("check_every and sync_every must be positive")
+        
+        self.criterion = criterion
+        self.tol = tol
+        self.n_voxels = n_voxels # normalizer, computed once
+        self.check_every = check_every
+        self.sync_every = sync_every
+        
+        self.converged = torch.zeros(shape, dtype=torch.bool, device=dev)
+        self.it = torch.zeros(shape, dtype=torch.int64, device=dev)
+        self.nrj = torch.zeros(shape, dtype=torch.float32, device=dev)
+        self.eps = torch.zeros(shape, dtype=torch.float32, device=dev)
+        self.last = torch.zeros(shape, dtype=torch.float32, device=dev)
+        self.active = torch.ones(shape, dtype=torch.float32, device=dev)
+        self.increased = torch.zeros(shape, dtype=torch.bool, device=dev) # eps went up since the last check
+        self.checks = 0
+        
+        self.trace = trace
+        self.history : List[Tuple[int, float, Tensor, Tensor]] = []
+        self.start = time.perf_counter()
+        
+    def due(self, it : int) -> bool:
+        return it % self.check_every == 0
+    
+    def update(self, it : int, nrj, unorm : Optional[Tensor] = None, residual : Optional[Tensor] = None) -> bool:
+        # record one check, returns True if the host should read back the convergence flags now
+        
+        if self.criterion == "energy":
+            eps = nrj / self.n_voxels
+        elif self.criterion == "relative":
+            eps = nrj / unorm
+        elif self.criterion == "residual":
+            eps = residual / self.n_voxels
+        else:
+            eps = torch.where(self.last > 0, torch.abs(nrj - self.last) / self.last, 0.0)
+            if self.checks == 0:
+                eps = torch.full_like(nrj, float("inf"))
+        self.last = nrj
+        
+        fresh = ~self.converged
+        self.increased = fresh & torch.gt(eps, self.eps) & (self.checks > 0)
+        self.nrj = torch.where(fresh, nrj, self.nrj)
+        self.eps = torch.where(fresh, eps, self.eps)
+        newly = fresh & torch.le(eps, self.tol)
+        self.it = torch.where(newly, it, self.it)
+        self.converged = self.converged | newly
+        if self.sync_every > 1:
+            self.active = (~self.converged).to(torch.float32)
+        if self.trace:
+            self.history.append((it, time.perf_counter() - self.start, nrj, eps))
+        
+        self.checks += 1
+        return (self.checks - 1) % self.sync_every == 0
+    
+    def saveState(self) -> Dict[str, object]:
+        # everything update reads, to resume a solve from a checkpoint, see PrimalDual.saveCheckpoint
+        state : Dict[str, object] = {name : getattr(self, name) for name in ["converged", "it", "nrj", "eps", "last",
+                                                                            "active", "increased", "checks", "history"]}
+        state["elapsed"] = time.perf_counter() - self.start
+        return state
+    
+    def loadState(self, state : Dict[str, object]) -> None:
+        for name, x in state.items():
+            if name != "elapsed":
+                setattr(self, name, x)
+        self.start = time.perf_counter() - state["elapsed"] # the trace times continue
+    
+    def compact(self, keep) -> None:
+        # keep only the given problems (batched solves)
+        for name in ["converged", "it", "nrj", "eps", "last", "active", "increased"]:
+            setattr(self, name, getattr(self, name)[keep])
+    
+    def energyTrace(self) -> Optional[EnergyTrace]:
+        if not self.trace:
+            return None
+        return EnergyTrace(torch.tensor([h[0] for h in self.history], dtype=torch.int64),
+                           torch.tensor([h[1] for h in self.history], dtype=torch.float64),
+                           torch.stack([h[2] for h in self.history]).cpu(),
+                           torch.stack([h[3] for h in self.history]).cpu())
+
+
+# context of a worker process of the tiled solve, see PrimalDual.forwardTiled
+tile_worker : Dict[str, object] = {}
+
+
+def initTileWorker(model, directory : str, shapes : Dict[str, List[int]], dims : List[int], l : int, lmbda, nu,
+                   steps : Tuple[Tensor, Tensor, Tensor, Tensor], threads : int):
+    torch.set_num_threads(threads)
+    torch.set_grad_enabled(False)
+    incidence = model.incidence(l, steps[0].device)
+    tile_worker["model"] = model
+    tile_worker["f"] = model.mapped(os.path.join(directory, "f"), dims)
+    tile_worker["variables"] = [{name : model.mapped(os.path.join(directory, f"{name}_{i}"), shape)
+                                 for name, shape in shapes.items()} for i in range(2)]
+    tile_worker["args"] = (l, lmbda, nu, steps, incidence, incidence.t().contiguous())
+
+
+def sweepTileWorker(task):
+    tiles, parity, it, end, check = task
+    variables = tile_worker["variables"]
+    return tile_worker["model"].sweepTiles(tiles, tile_worker["f"], variables[parity], variables[1 - parity],
+                                           it, end, check, *tile_worker["args"])
+
+
 class PrimalDual(torch.nn.Module):
-    def __init__(self) -> None:
+    compact_dtypes = {"float32" : torch.float32, "bfloat16" : torch.bfloat16, "float16" : torch.float16}
+    
+    def __init__(self, inplace : bool = False, check_every : int = 10, criterion : str = "energy", sync_every : int = 1,
+                 adaptive : bool = False, precondition : bool = False, relaxation : float = 1.0, restart : bool = False,
+                 trace : bool = False, compact : Optional[str] = None, compact_rows : int = 16, backend : str = "eager",
+                 cache_dir : Optional[str] = None, label_window : int = 0, labels : Optional[Tensor] = None) -> None:
 
         super(PrimalDual, self).__init__()
         
         
         torch.set_grad_enabled(False)
+        
+        # preallocate all work buffers once per solve and update them in place
+        self.inplace = inplace
+        
+        # primal and dual variables at the end of the last solve
+        self.state : Optional[SolverState] = None
+        
+        # convergence test, see ConvergenceMonitor
+        if criterion not in ConvergenceMonitor.criteria:
+            raise ValueError(f"criterion must be one of {ConvergenceMonitor.criteria}, got {criterion}")
+        self.check_every = check_every
+        self.criterion = criterion
+        self.sync_every = sync_every
+        
+        # adapt the step sizes on every check iteration, see adaptiveStepSizes (runs on the in-place loop)
+        self.adaptive = adaptive
+        
+        # per-variable step sizes from the operator structure, see preconditionedStepSizes (in-place loop)
+        self.precondition = precondition
+        
+        # over-relaxation x = x_old + relaxation * (x - x_old) of every variable after its update, with
+        # the extrapolation taken from the unrelaxed update, relaxation in (0, 2) (in-place loop). Values
+        # above 1 need step sizes that strictly satisfy tau * sigma * |K|^2 < 1, use precondition=True
+        if not 0 < relaxation < 2:
+            raise ValueError(f"relaxation must be in (0, 2), got {relaxation}")
+        self.relaxation = relaxation
+        
+        # restart the extrapolation (ubar = u, mubarx = mux) when the convergence criterion goes up
+        # between two checks (in-place loop)
+        self.restart = restart
+        
+        # record the convergence criterion at every check into self.trace, see EnergyTrace
+        self.trace_checks = trace
+        self.trace : Optional[EnergyTrace] = None
+        
+        # memory-compact storage of the O(l^2) variables (in-place loop): sx and mux are stored in the
+        # compact dtype, mubarx is recomputed from mux, sx and px instead of stored, and the updates of
+        # sx and mux run in float32 on blocks of compact_rows rows, see l2projectionCompact
+        if compact is not None and compact not in self.compact_dtypes:
+            raise ValueError(f"compact must be one of {list(self.compact_dtypes)}, got {compact}")
+        if compact is not None and (adaptive or restart or relaxation != 1.0):
+            raise ValueError("compact storage does not support adaptive, restart or relaxation")
+        self.compact = compact
+        self.compact_rows = compact_rows
+        self.buffer_bytes = 0 # size of the work buffers of the last solve
+        
+        # cells along the first dimension of the full grid, which scale the differences, while a tile of
+        # it or its masked voxels are solved (0 otherwise), see forwardTiled and forwardMasked
+        self.grid_cells = 0
+        
+        # options that run on the in-place loop
+        self.inplace = inplace or adaptive or precondition or restart or relaxation != 1.0 or compact is not None
+        
+        # "eager" runs the allocating loop op by op, "compile" builds it from this source with torch.compile,
+        # which fuses the elementwise projections into few kernels, see solverStep. Compiled graphs and
+        # kernels are cached in cache_dir (default ~/.cache/fdd), see compileCache
+        if backend not in ["eager", "compile"]:
+            raise ValueError(f"backend must be one of ['eager', 'compile'], got {backend}")
+        if backend == "compile" and self.inplace:
+            raise ValueError("the compile backend runs the allocating loop, which the in-place options do not")
+        if backend == "compile":
+            try: # torch.compile checks the interpreter when called, before compiling anything
+                torch.compile(self.iterate, dynamic=False)
+            except RuntimeError as error:
+                raise ValueError(f"backend='compile' needs torch.compile, which is not available here: {error}")
+            if torch.__version__ < "2.4": # inductor reads its cache directory once per process before 2.4
+                raise ValueError(f"backend='compile' needs torch >= 2.4 to cache compiled solves, got {torch.__version__}")
+        self.backend = backend
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(os.path.expanduser("~"), ".cache", "fdd")
+        self.compiled : Dict[Tuple[int, int, str, str], object] = {}
+        
+        # solve on a window of label_window labels around the 0.5-crossing of every voxel instead of all l
+        # labels (0: all), with u frozen at 1 / 0 below / above it, see forwardWindowed (allocating loop)
+        if label_window < 0 or (label_window > 0 and (self.inplace or backend != "eager")):
+            raise ValueError("label_window must be >= 0 and runs the allocating loop with backend='eager'")
+        self.label_window = label_window
+        
+        # values of the l labels, strictly increasing in [0, 1] (None: k / l, k = 1, ..., l), e.g. at the
+        # quantiles of the data so that fewer labels resolve it as finely where it is dense, see labelGeometry.
+        # Not with label_window
+        if labels is not None and label_window > 0:
+            raise ValueError("the label window solve runs on evenly spaced labels")
+        self.labels = labels
 
 
             
-    def forward(self, f, repeats, l, lmbda, nu, tol):
+    def forward(self, f, repeats, l, lmbda, nu, tol, warm_start : Optional[SolverState] = None,
+                checkpoint_path : Optional[str] = None, checkpoint_every : int = 1000):
     # Original __init__ code moved here (with 'self.' removed)
     
         # repeats = int(repeats_a)
@@ -23,6 +261,22 @@ class PrimalDual(torch.nn.Module):
         # lmbda = float(lmbda_a)
         # nu = float(nu_a)
         
+        # checkpoint_path: file the solver state is written to every checkpoint_every iterations and, if it
+        # exists, resumed from (instead of warm_start), with the same result as an uninterrupted solve. It is
+        # removed once the solve finishes, see saveCheckpoint
+        
+        if warm_start is not None:
+            self.checkState(warm_start, f, int(l))
+        if checkpoint_path is not None and checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be positive")
+        
+        if self.inplace:
+            return self.forwardInPlace(f, repeats, l, lmbda, nu, tol, warm_start, checkpoint_path, checkpoint_every)
+        if 0 < self.label_window < int(l):
+            if warm_start is not None or self.labels is not None:
+                raise ValueError("the label window solve starts from the data on evenly spaced labels, without warm starts")
+            return self.forwardWindowed(f, repeats, l, lmbda, nu, tol, self.label_window, checkpoint_path,
+                                        checkpoint_every)
         
         dev = f.device
         res = torch.tensor(1 / f.shape[0], device = dev)
@@ -83,63 +337,1393 @@ class PrimalDual(torch.nn.Module):
         u = torch.stack([f] * l, dim=-1).detach()
         ubar = u.clone().detach()
         
-        # preallocate indices for parabola projection set
-        k_indices = torch.jit.annotate(Dict[int, List[int]], {})
-        for z in range(int(l)):
-            K = 0
-            K_indices : List[int] = []
-            for k1 in range(0,int(l)): # l - z
-                for k2 in range(int(k1),int(l)):
-                    if ((z <= k2) and (z >= k1)): 
-                        K_indices.append(K)
-                    K += 1
-            k_indices[z] = K_indices
-        
-        # preallocate indices for helper variable
-        k1_k2_combinations =  torch.jit.annotate(List[Tensor], []) # TODO: take this out of loops
-        for k1 in range(int(l)):
-            for k2 in range(int(k1), int(l)):
-                k1_k2_combinations.append(torch.tensor([k1, k2]).unsqueeze(0))
-
-        k1_k2_combinations = torch.cat(k1_k2_combinations, dim=0)
+        if warm_start is not None:
+            u, ubar, px, pt, sx, mux, mubarx = [x.clone() for x in warm_start]
+        
+        # non-local constraint sets (k1, k2) as a label incidence matrix
+        incidence = self.incidence(int(l), dev)
+            
+        # number of lifted voxels, to normalize the energy
+        n_voxels = 1
+        for s in dims[:-1] + [int(l)]:
+            n_voxels *= s
+        steps = (tauu, sigmap, sigmas, tau)
+        step = self.solverStep(f.dim() - 1, int(l), f.dtype)
+        
+        def iteration(u, ubar, px, pt, sx, mux, mubarx, tauu, sigmap, sigmas, tau):
+            px, pt, sx, mux, mubarx, u, ubar = step(px, pt, ubar, mux, sx, mubarx, u, f, lmbda, nu, int(l), proj,
+                                                    incidence, dims, tauu, sigmap, sigmas, tau)
+            return u, ubar, px, pt, sx, mux, mubarx
+        
+        key = None
+        if checkpoint_path is not None:
+            key = self.checkpointKey(f, int(l), lmbda, nu, tol, "allocating")
+        with self.compileCache(f.dim() - 1, int(l), f.dtype): # step compiles on its first call
+            variables, monitor = self.solveLoop([u, ubar, px, pt, sx, mux, mubarx], iteration, steps, repeats, tol,
+                                                n_voxels, dev, checkpoint_path=checkpoint_path,
+                                                checkpoint_every=checkpoint_every, key=key)
+        
+        self.state = SolverState(*variables)
+        self.trace = monitor.energyTrace()
+        
+        return (self.state.u, monitor.nrj, monitor.eps, int(monitor.it))
+        
+    def iterate(self, px, pt, ubar, mux, sx, mubarx, u, f, lmbda, nu, l : int, proj : int, incidence, dims : List[int],
+                tauu, sigmap, sigmas, tau):
+        # one iteration of the allocating loop, which backend="compile" compiles into a few fused kernels
+        
+        px, pt = self.parabola(px, pt, ubar, mux, lmbda, l, f, incidence, dims, sigmap) # project onto parabola (set K)
+        sx = self.l2projection(sx, mubarx, sigmas, nu) # project onto l2 ball
+        mux, mubarx = self.mu(px, sx, mux, proj, l, incidence, tau) # constrain lagrange multipliers
+        u, ubar = self.clipping(px, pt, u, tauu, dims, l) # project onto set C
+        
+        return px, pt, sx, mux, mubarx, u, ubar
+    
+    def solveLoop(self, variables : List[Tensor], step, steps : Tuple[Tensor, Tensor, Tensor, Tensor], repeats, tol,
+                  n_voxels : int, dev : torch.device, unorm=None, moved=None, extra=None, resume=None,
+                  checkpoint_path : Optional[str] = None, checkpoint_every : int = 1000,
+                  key : Optional[Dict[str, object]] = None):
+        # the iteration of the allocating loop and its variants (label window, mask): step(*variables, tauu,
+        # sigmap, sigmas, tau) updates the variables (in the order of SolverState), every check_every
+        # iterations the convergence criterion is evaluated and the steps are frozen once converged
+        # (sync_every > 1). unorm(u): the norm of the relative criterion (default sum |u|), moved(variables):
+        # applied on every check that does not stop the solve, extra(): what the variant saves with a
+        # checkpoint besides the variables, restored by resume(extra). Returns the variables and the monitor
+        
+        monitor = ConvergenceMonitor(self.criterion, tol, n_voxels, self.check_every, self.sync_every, [], dev,
+                                     self.trace_checks)
+        tauu, sigmap, sigmas, tau = steps
+        
+        start = 0
+        if checkpoint_path is not None: # resume
+            checkpoint = self.loadCheckpoint(checkpoint_path, key, dev)
+            if checkpoint is not None:
+                variables = [checkpoint["variables"][name] for name in SolverState._fields]
+                monitor.loadState(checkpoint["monitor"])
+                if resume is not None:
+                    resume(checkpoint["extra"])
+                start = checkpoint["it"]
+        
+        for it in range(start, int(repeats)):
             
-        h_un = torch.zeros_like(u)  # Initialize h_un with a default value (None in this case)
-        h_u = torch.zeros_like(u)  # Initialize h_u with a default value (None in this case)
-        nrj = torch.tensor([0], device = dev)  # Initialize nrj with a default value (None in this case)
-        it_total = 0
+            check = monitor.due(it)
+            if self.sync_every > 1: # freeze once converged
+                tauu, sigmap, sigmas, tau = [x * monitor.active for x in steps]
+            old = variables if check else None # every update returns new tensors, so references suffice
+            
+            variables = list(step(*variables, tauu, sigmap, sigmas, tau))
+            if check:
+                u, px, pt, mux = variables[0], variables[2], variables[3], variables[5]
+                nrj = self.energy(u, old[0])
+                norm, residual = None, None
+                if self.criterion == "relative":
+                    norm = torch.sum(torch.abs(u)) if unorm is None else unorm(u)
+                elif self.criterion == "residual":
+                    residual = nrj / steps[0] + (self.energy(px, old[2]) + self.energy(pt, old[3])) / steps[1] + \
+                        self.energy(mux, old[5]) / steps[3]
+                if monitor.update(it, nrj, norm, residual) and bool(monitor.converged): # if tolerance criterion is met,
+                    break
+                if moved is not None:
+                    variables = moved(variables)
+            
+            if checkpoint_path is not None and (it + 1) % checkpoint_every == 0:
+                self.saveCheckpoint(checkpoint_path, it + 1, key, dict(zip(SolverState._fields, variables)), monitor,
+                                    {} if extra is None else extra())
+        
+        torch.cuda.empty_cache()
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        
+        return variables, monitor
+    
+    def liftedStep(self, gradient, difference, clipping, labels, alpha, img, lmbda, nu, l : int, incidence):
+        # step of solveLoop for a variant of forward given by its operators: gradient(ubar), the scaled
+        # spatial differences ([D] + shape of ubar), difference(ubar), the differences along the labels,
+        # clipping(px, pt, u, tauu), the backward differences and projection onto set C (returns u, ubar), and
+        # labels(), the label values of projectParabola. l: the number of labels the label differences are
+        # scaled by
+        
+        proj = incidence.shape[0]
+        
+        def step(u, ubar, px, pt, sx, mux, mubarx, tauu, sigmap, sigmas, tau):
+            ux = px + sigmap * (gradient(ubar) + torch.matmul(mux, incidence))
+            ut = pt + sigmap * (difference(ubar) * l)
+            px, pt = self.projectParabola(ux, ut, lmbda, labels(), alpha, img) # project onto parabola (set K)
+            sx = self.l2projection(sx, mubarx, sigmas, nu) # project onto l2 ball
+            mux, mubarx = self.mu(px, sx, mux, proj, u.shape[-1], incidence, tau) # constrain lagrange multipliers
+            u, ubar = clipping(px, pt, u, tauu) # project onto set C
+            return u, ubar, px, pt, sx, mux, mubarx
+        
+        return step
+    
+    def solverStep(self, D : int, l : int, dtype : torch.dtype):
+        # iterate, or for backend="compile" iterate compiled with torch.compile once per (D, l, dtype). It
+        # compiles on its first call, which runs within compileCache
+        
+        if self.backend == "eager":
+            return self.iterate
+        
+        key = (D, l, str(dtype), torch.__version__)
+        if key not in self.compiled:
+            self.compiled[key] = torch.compile(self.iterate, dynamic=False)
+        return self.compiled[key]
+    
+    @contextlib.contextmanager
+    def compileCache(self, D : int, l : int, dtype : torch.dtype):
+        # for backend="compile": inductor's FX graph cache on, and its caches (graphs, generated kernels) in
+        # cache_dir/torch-<version>/<D>d_l<l>_<dtype> while the block runs, so that the first solve of a new
+        # process with the same key loads what an earlier one compiled. The TORCHINDUCTOR_CACHE_DIR and
+        # the config of the process are restored afterwards
+        
+        if self.backend == "eager":
+            yield
+            return
+        
+        import torch._inductor.config # loaded by the first compile otherwise
+        
+        directory = os.path.join(self.cache_dir, "torch-" + torch.__version__,
+                                 f"{D}d_l{l}_{str(dtype).replace('torch.', '')}")
+        os.makedirs(directory, exist_ok=True)
+        previous = os.environ.get("TORCHINDUCTOR_CACHE_DIR")
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = directory
+        try:
+            with torch._inductor.config.patch(fx_graph_cache=True):
+                yield
+        finally:
+            if previous is None:
+                os.environ.pop("TORCHINDUCTOR_CACHE_DIR", None)
+            else:
+                os.environ["TORCHINDUCTOR_CACHE_DIR"] = previous
+    
+    def forwardInPlace(self, f, repeats, l, lmbda, nu, tol, warm_start : Optional[SolverState] = None,
+                       checkpoint_path : Optional[str] = None, checkpoint_every : int = 1000):
+        # same iteration as forward, but every work buffer is allocated once per solve
+        # and all updates write into it in place (out= / in-place ops)
+        
+        dev = f.device
+        l = int(l)
+        dims = [f.size(dim = x) for x in range(f.dim())]
+        proj = int(l * (l - 1) / 2 + l)
+        tauu, sigmap, sigmas, tau = self.stepSizes(f, l)
+        
+        buf = self.allocateBuffers(f, l, lmbda, nu, proj)
+        self.buffer_bytes = self.bufferBytes(buf)
+        if warm_start is not None:
+            for name, x in warm_start._asdict().items():
+                if name in buf: # mubarx is recomputed in compact mode
+                    buf[name].copy_(x)
+        
+        # non-local constraint sets (k1, k2) as a label incidence matrix
+        incidence = self.incidence(l, dev)
+        incidence_t = incidence.t().contiguous()
+        
+        # number of lifted voxels, to normalize the energy
+        n_voxels = 1
+        for s in dims[:-1] + [l]:
+            n_voxels *= s
+        monitor = ConvergenceMonitor(self.criterion, tol, n_voxels, self.check_every, self.sync_every, [], dev,
+                                     self.trace_checks)
+        steps = (tauu, sigmap, sigmas, tau)
+        scale_p, scale_d, alpha = [torch.tensor(x, device=dev) for x in [1.0, 1.0, 0.5]] # adaptive step sizes
+        
+        start = 0
+        if checkpoint_path is not None: # resume
+            key = self.checkpointKey(f, l, lmbda, nu, tol, "inplace")
+            key.update(adaptive=self.adaptive, precondition=self.precondition, relaxation=self.relaxation,
+                       restart=self.restart, compact=self.compact)
+            checkpoint = self.loadCheckpoint(checkpoint_path, key, dev)
+            if checkpoint is not None:
+                for name, x in checkpoint["variables"].items():
+                    buf[name].copy_(x)
+                scale_p, scale_d, alpha = [checkpoint["extra"][name] for name in ["scale_p", "scale_d", "alpha"]]
+                monitor.loadState(checkpoint["monitor"])
+                start = checkpoint["it"]
         
         # START loop
-        for it in range(int(repeats)):
+        for it in range(start, int(repeats)):
             
-            u_old, mux_old, px_old, pt_old, sx_old = u.clone(), mux.clone(), px.clone(), pt.clone(), sx.clone()
-
-            px, pt = self.parabola(px, pt, ubar, mux, lmbda, l, f, k_indices, dims, sigmap) # project onto parabola (set K)s
-
-            sx = self.l2projection(sx, mubarx, sigmas, nu) # project onto l2 ball 
-            #print("l2projection: ", time.time() - start)
-            #start = time.time()
-            mux, mubarx = self.mu(px, sx, mux, proj, l, k1_k2_combinations, tau) # constrain lagrange multipliers
-            #print("mu: ", time.time() - start)
-            if it%10 == 0:
-                h_un = u.detach().clone()
-            u, ubar = self.clipping(px, pt, u, tauu, dims, l) # project onto set C
-            if it%10 == 0:
-                h_u = u.detach().clone()
-                nrj = self.energy(h_u, h_un) # .detach().item() # calculate energy
-                if torch.le(nrj/(torch.prod(torch.tensor(dims[:-1] + [int(l)]))), tol): # if tolerance criterion is met,
-                    it_total = it
+            check = monitor.due(it)
+            if self.adaptive or self.sync_every > 1: # adapted steps, frozen once converged
+                tauu, sigmap, sigmas, tau = self.effectiveSteps(steps, scale_p, scale_d, monitor.active, 0)
+            self.iterateInPlace(buf, tauu, sigmap, sigmas, tau, incidence, incidence_t, check, False)
+            if check:
+                if self.adaptive:
+                    scale_p, scale_d, alpha = self.adaptiveStepSizes(buf, steps, scale_p, scale_d, alpha, incidence, 0)
+                current = self.effectiveSteps(steps, scale_p, scale_d, monitor.active.new_ones([]), 0)
+                self.criterionSums(buf, current, False)
+                residual = self.residual(buf, current[0])
+                sync = monitor.update(it, buf["nrj"].clone(), buf["unorm"], residual)
+                if self.restart:
+                    self.restartExtrapolation(buf, monitor.increased, 0)
+                if sync and bool(monitor.converged):
                     break
-                
-            #tauu, tau, sigmap, sigmas = self.updateStepSizes(tauu, tau, sigmap, sigmas, gamma_u, gamma_mu, theta_u, theta_mu) # update step sizes
+            
+            if checkpoint_path is not None and (it + 1) % checkpoint_every == 0:
+                variables = {name : buf[name] for name in SolverState._fields if name in buf}
+                extra = {"scale_p" : scale_p, "scale_d" : scale_d, "alpha" : alpha}
+                self.saveCheckpoint(checkpoint_path, it + 1, key, variables, monitor, extra)
+        
+        torch.cuda.empty_cache()
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        
+        if self.compact is not None:
+            buf["mubarx"] = self.mubarCompact(buf, steps[3], incidence_t)
+        self.state = SolverState(buf["u"], buf["ubar"], buf["px"], buf["pt"], buf["sx"], buf["mux"], buf["mubarx"])
+        self.trace = monitor.energyTrace()
+        
+        return (buf["u"], monitor.nrj, monitor.eps, int(monitor.it))
+    
+    def forwardPyramid(self, f, repeats, l, lmbda, nu, tol, levels : int):
+        # coarse-to-fine solve: halve the grid levels times (averaging 2 cells per spatial dimension),
+        # solve on the coarsest grid, and warm start every finer grid from the upsampled solver state
+        # of the coarser one. Every grid gets the full repeats and tol. Returns the result on f and
+        # keeps the iterations per grid, coarsest first, in self.pyramid_its
+        
+        D = f.dim() - 1
+        grids = [f]
+        for _ in range(int(levels)):
+            if min(grids[-1].shape[:D]) < 4: # too coarse to be useful
+                break
+            grids.append(self.downsample(grids[-1], D))
+        
+        self.pyramid_its : List[int] = []
+        state = None
+        for grid in reversed(grids):
+            if state is not None:
+                state = SolverState(*[self.upsample(x, grid.shape[:D], int(x.dim() > grid.dim() + 1))
+                                      for x in state])
+            results = self.forward(grid, repeats, l, lmbda, nu, tol, warm_start=state)
+            self.pyramid_its.append(results[3])
+            state = self.state
+        
+        return results
+    
+    def downsample(self, f, D : int):
+        # average over pairs of cells in each of the first D dimensions, repeating the last cell of odd ones
+        
+        for dim in range(D):
+            n = f.shape[dim]
+            if n % 2 == 1:
+                f = torch.cat([f, f.narrow(dim, n - 1, 1)], dim=dim)
+            f = f.unflatten(dim, (f.shape[dim] // 2, 2)).mean(dim=dim + 1)
+        return f
+    
+    def upsample(self, x, shape, offset : int):
+        # nearest neighbour upsampling by 2 of the spatial dimensions offset, ..., offset + len(shape) - 1,
+        # cropped to shape
+        
+        for i, n in enumerate(shape):
+            x = x.repeat_interleave(2, dim=offset + i).narrow(offset + i, 0, n)
+        return x.contiguous()
+    
+    def forwardWindowed(self, f, repeats, l, lmbda, nu, tol, window : int, checkpoint_path : Optional[str] = None,
+                        checkpoint_every : int = 1000):
+        # forward on a window of labels lo, ..., lo + window - 1 per voxel (and channel) around the 0.5-crossing
+        # of u, so that every variable holds window (or window (window + 1) / 2) values per voxel instead of
+        # l (or l (l + 1) / 2). u is 1 up to the first and 0 from the last label of the window on, as on the
+        # first and last of all labels in forward, and the dual variables of the labels and sets (k1, k2)
+        # outside the window are dropped. Differences to a neighbour read its window at the same labels, see
+        # windowGather. Starts from the lifted data (u = 1 on the labels below f) with the windows centred on
+        # it, and on every check moves the windows whose crossing came within window / 4 of an edge back
+        # around it. Returns u on all l labels; the windowed variables are not kept as a solver state
 
- 
-            # if torch.equal(iter, repeats-1):
-            #     print("debug")
+        l, W = int(l), int(window)
+        D = f.dim() - 1
+        dims = [f.size(dim = x) for x in range(f.dim())]
+        dev = f.device
+        proj = int(W * (W - 1) / 2 + W)
+        tauu, sigmap, sigmas, tau = self.stepSizes(f, W)
+        steps = (tauu, sigmap, sigmas, tau)
+
+        j = torch.arange(W, device=dev)
+        lo = torch.clamp(torch.round(f * l).long() - W // 2, 0, l - W)
+        u = ((lo.unsqueeze(-1) + j) < f.unsqueeze(-1) * l).float()
+        u[..., 0], u[..., -1] = 1.0, 0.0
+        ubar = u.clone()
+        px = torch.zeros([D] + dims + [W], device=dev)
+        pt = torch.zeros(dims + [W], device=dev)
+        sx, mux, mubarx = [torch.zeros([D] + dims + [proj], device=dev) for _ in range(3)]
+
+        incidence = self.incidence(W, dev)
+        shifted = self.shiftedSets(W, dev)
+
+        n_voxels = 1
+        for s in dims[:-1] + [l]:
+            n_voxels *= s
+        self.window_moves = 0 # windows moved over the solve
+        window = {"lo" : lo} # start label of every window, moved on the checks
+
+        # iterate, with the differences taken across the windows
+        gradient = lambda ubar: torch.stack([self.windowDifference(ubar, window["lo"], d, 1.0, 0.0)
+                                             for d in range(D)], dim=0) * dims[0]
+        clipping = lambda px, pt, u, tauu: self.windowClipping(px, pt, u, window["lo"], tauu, l)
+        # u is 0 on the label above a window
+        difference = lambda ubar: torch.cat((ubar[..., 1:], torch.zeros_like(ubar[..., :1])), dim=-1) - ubar
+        labels = lambda: (window["lo"].unsqueeze(-1) + j + 1) / l
+        step = self.liftedStep(gradient, difference, clipping, labels, 0.25, f.unsqueeze(-1), lmbda, nu, l,
+                               incidence)
+
+        def moved(variables):
+            # re-expansion check: windows whose crossing is near an edge are moved back around it. The
+            # crossing is lo + sum u, which for a u spread over several labels is stabler than its 0.5-crossing
+            u, ubar, px, pt, sx, mux, mubarx = variables
+            lo = window["lo"]
+            crossing = lo + torch.round(u.sum(dim=-1)).long()
+            new = torch.clamp(crossing - W // 2, 0, l - W)
+            move = (torch.abs(crossing - lo - W // 2) > W // 4) & (new != lo)
+            if bool(move.any()):
+                shift = torch.where(move, new - lo, torch.zeros_like(lo))
+                u, ubar = [self.shiftWindow(x, shift, 1.0, 0.0) for x in (u, ubar)]
+                px = torch.stack([self.shiftWindow(x, shift, 0.0, 0.0) for x in px], dim=0)
+                pt = self.shiftWindow(pt, shift, 0.0, 0.0)
+                idx = shifted[torch.clamp(shift, -W, W) + W]
+                sx, mux, mubarx = [torch.gather(torch.cat((x, torch.zeros_like(x[..., :1])), dim=-1), -1,
+                                                idx.expand(x.shape)) for x in (sx, mux, mubarx)]
+                window["lo"] = new
+                self.window_moves += int(move.sum())
+            return [u, ubar, px, pt, sx, mux, mubarx]
+
+        def resume(extra):
+            window["lo"] = extra["lo"]
+            self.window_moves = int(extra["window_moves"])
+
+        key = None
+        if checkpoint_path is not None:
+            key = self.checkpointKey(f, l, lmbda, nu, tol, "windowed")
+            key.update(window=W)
+        variables, monitor = self.solveLoop([u, ubar, px, pt, sx, mux, mubarx], step, steps, repeats, tol, n_voxels,
+                                            dev, unorm=lambda u: torch.sum(torch.abs(u)) + torch.sum(window["lo"]),
+                                            moved=moved, resume=resume,
+                                            extra=lambda: {"lo" : window["lo"], "window_moves" : self.window_moves},
+                                            checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every, key=key)
+        u, lo = variables[0], window["lo"]
+
+        # u on all labels
+        u = self.windowGather(u, -lo, torch.arange(l, device=dev), 1.0, 0.0)
+
+        self.state = None
+        self.trace = monitor.energyTrace()
+
+        return (u, monitor.nrj, monitor.eps, int(monitor.it))
+
+    def windowGather(self, x, shift, j, below : float, above : float):
+        # x[..., j + shift] per voxel, with below / above for the labels outside x
+        
+        W = x.shape[-1]
+        padded = torch.cat((torch.full_like(x, below), x, torch.full_like(x, above)), dim=-1)
+        idx = torch.clamp(j + shift.unsqueeze(-1) + W, 0, 3 * W - 1)
+        return torch.gather(padded, -1, idx.expand(list(x.shape[:-1]) + [j.shape[0]]))
+
+    def windowDifference(self, x, lo, dim : int, below : float, above : float):
+        # forward difference along dim of the windowed x (window start lo) at the labels of every window,
+        # 0 on the last slice
+        
+        n = x.shape[dim]
+        j = torch.arange(x.shape[-1], device=x.device)
+        nxt = self.windowGather(x.narrow(dim, 1, n - 1), lo.narrow(dim, 0, n - 1) - lo.narrow(dim, 1, n - 1), j,
+                                below, above)
+        diff = nxt - x.narrow(dim, 0, n - 1)
+        return torch.cat((diff, torch.zeros_like(x.narrow(dim, 0, 1))), dim=dim)
+
+    def windowClipping(self, px, pt, u, lo, tauu, l : int):
+        # clipping on the windows: backward differences of px (the previous voxel's px at the labels of the
+        # window, 0 outside its own) and of pt, u = 1 / 0 on the first / last label of the window as on
+        # those of all labels in clipping
+        
+        W = u.shape[-1]
+        j = torch.arange(W, device=u.device)
+        div = torch.zeros_like(u)
+        for d in range(px.shape[0]):
+            n = u.shape[d]
+            before = torch.cat((px[d].narrow(d, 0, n - 1), torch.zeros_like(px[d].narrow(d, 0, 1))), dim=d)
+            prev = self.windowGather(px[d].narrow(d, 0, n - 1), lo.narrow(d, 1, n - 1) - lo.narrow(d, 0, n - 1), j,
+                                     0.0, 0.0)
+            after = torch.cat((torch.zeros_like(px[d].narrow(d, 0, 1)), prev), dim=d)
+            div = div + (before - after) * px.shape[1]
+        dt = torch.cat((pt[..., :-1], torch.zeros_like(pt[..., :1])), dim=-1) - \
+            torch.cat((torch.zeros_like(pt[..., :1]), pt[..., :-1]), dim=-1)
+        div = div + dt * l
+
+        new = torch.clamp(u + tauu * div, min=0, max=1)
+        new[..., 0], new[..., -1] = 1.0, 0.0
+        return new, 2.0 * new - u
+
+    def shiftWindow(self, x, shift, below : float, above : float):
+        # move the windows of x by shift labels
+        return self.windowGather(x, shift, torch.arange(x.shape[-1], device=x.device), below, above)
+
+    def shiftedSets(self, W : int, dev : torch.device) -> Tensor:
+        # S[s + W, K] = index of the set (k1 + s, k2 + s) for the K-th set (k1, k2) of a window of W labels
+        # moved by s, or the number of sets if it leaves the window
+        
+        k1, k2 = torch.triu_indices(W, W, device=dev)
+        index = torch.full((W, W), k1.shape[0], dtype=torch.long, device=dev)
+        index[k1, k2] = torch.arange(k1.shape[0], device=dev)
+        s = torch.arange(-W, W + 1, device=dev).unsqueeze(-1)
+        a, b = k1 + s, k2 + s
+        inside = (a >= 0) & (b < W)
+        return torch.where(inside, index[a.clamp(0, W - 1), b.clamp(0, W - 1)], k1.shape[0])
+
+    def forwardMasked(self, f, repeats, l, lmbda, nu, tol, mask, checkpoint_path : Optional[str] = None,
+                      checkpoint_every : int = 1000):
+        # forward on the voxels where mask (the spatial dimensions of f) is True only: every variable holds one
+        # row per such voxel, in the order of torch.nonzero(mask), and the differences read the neighbours
+        # from the tables of maskNeighbours. A voxel without a neighbour in the mask along a dimension has a
+        # zero difference there, as on the last row of the grid, so the masked-out voxels are a boundary of
+        # the domain. Step sizes and the bound of l2projection are those of the full grid. Returns u on the
+        # full grid, the lifted data (u = 1 on the labels below f) outside the mask; the compact variables
+        # are not kept as a solver state
+
+        if checkpoint_path is not None and checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be positive")
+
+        l = int(l)
+        D = f.dim() - 1
+        dims = [f.size(dim = x) for x in range(f.dim())]
+        C = dims[-1]
+        dev = f.device
+        proj = int(l * (l - 1) / 2 + l)
+        tauu, sigmap, sigmas, tau = self.stepSizes(f, l)
+        steps = (tauu, sigmap, sigmas, tau)
+
+        index, nxt, prv, has_next, has_prev = self.maskNeighbours(mask.to(dev))
+        V = index.shape[0]
+        fv = f.reshape(-1, C)[index]
+        u = torch.stack([fv] * l, dim=-1)
+        ubar = u.clone()
+        px = torch.zeros([D, V, C, l], device=dev)
+        pt = torch.zeros([V, C, l], device=dev)
+        sx, mux, mubarx = [torch.zeros([D, V, C, proj], device=dev) for _ in range(3)]
+
+        incidence = self.incidence(l, dev)
+        labels, alpha = self.labelGeometry(l, dev)
+
+        # iterate, with the differences taken along the neighbour tables
+        gradient = lambda ubar: torch.stack([ubar[nxt[d]] - ubar for d in range(D)], dim=0) * dims[0]
+        clipping = lambda px, pt, u, tauu: self.maskedClipping(px, pt, u, prv, has_next, has_prev, tauu, dims[0])
+        difference = lambda ubar: torch.cat((torch.diff(ubar, dim=-1), torch.zeros_like(ubar[..., :1])), dim=-1)
+        step = self.liftedStep(gradient, difference, clipping, lambda: labels, alpha, fv.unsqueeze(-1), lmbda, nu, l,
+                               incidence)
+
+        key = None
+        if checkpoint_path is not None:
+            key = self.checkpointKey(f, l, lmbda, nu, tol, "masked")
+            key.update(mask=hashlib.sha1(mask.detach().cpu().numpy().tobytes()).hexdigest())
+
+        self.grid_cells = dims[0] # differences and l2projection as on the full grid
+        try:
+            variables, monitor = self.solveLoop([u, ubar, px, pt, sx, mux, mubarx], step, steps, repeats, tol, V * l,
+                                                dev, checkpoint_path=checkpoint_path,
+                                                checkpoint_every=checkpoint_every, key=key)
+        finally:
+            self.grid_cells = 0
+        u = variables[0]
+
+        # u on the full grid
+        full = (labels < f.unsqueeze(-1)).float()
+        full[..., 0], full[..., -1] = 1.0, 0.0
+        full = full.reshape(-1, C, l)
+        full[index] = u
+        u = full.reshape(dims + [l])
+
+        self.state = None
+        self.trace = monitor.energyTrace()
+
+        return (u, monitor.nrj, monitor.eps, int(monitor.it))
+
+    def maskNeighbours(self, mask) -> Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]:
+        # compact index of the voxels in the mask (flat indices into the grid, [V]) and, per dimension d,
+        # the rows of their next / previous voxel along d ([D, V], the row itself if that is off the grid
+        # or masked out) and whether they have one ([D, V, 1, 1], float to broadcast against the variables)
+
+        V = int(mask.sum())
+        index = torch.nonzero(mask.reshape(-1)).squeeze(-1)
+        row = torch.full([mask.numel()], -1, dtype=torch.long, device=mask.device)
+        row[index] = torch.arange(V, device=mask.device)
+        row = row.reshape(mask.shape)
+        coords = torch.nonzero(mask)
+
+        nxt, prv, has_next, has_prev = [], [], [], []
+        for d in range(mask.dim()):
+            for step, rows, has in [(1, nxt, has_next), (-1, prv, has_prev)]:
+                c = coords.clone()
+                c[:, d] += step
+                inside = (c[:, d] >= 0) & (c[:, d] < mask.shape[d])
+                c[:, d] = c[:, d].clamp(0, mask.shape[d] - 1)
+                r = row[tuple(c.t())]
+                found = inside & (r >= 0)
+                rows.append(torch.where(found, r, torch.arange(V, device=mask.device)))
+                has.append(found.float().view(V, 1, 1))
+
+        return index, torch.stack(nxt), torch.stack(prv), torch.stack(has_next), torch.stack(has_prev)
+
+    def maskedClipping(self, px, pt, u, prv, has_next, has_prev, tauu, cells : int):
+        # clipping on the voxels of the mask: backward differences of px along the neighbour tables (px of
+        # a voxel without a next one is not used, as on the last row of the grid) and of pt
+
+        div = torch.zeros_like(u)
+        for d in range(px.shape[0]):
+            before = px[d] * has_next[d]
+            div = div + (before - before[prv[d]] * has_prev[d]) * cells
+        dt = torch.cat((pt[..., :-1], torch.zeros_like(pt[..., :1])), dim=-1) - \
+            torch.cat((torch.zeros_like(pt[..., :1]), pt[..., :-1]), dim=-1)
+        div = div + dt * u.shape[-1]
+
+        new = torch.clamp(u + tauu * div, min=0, max=1)
+        new[..., 0], new[..., -1] = 1.0, 0.0
+        return new, 2.0 * new - u
+
+    def forwardTiled(self, f, repeats, l, lmbda, nu, tol, tile : int, directory : Optional[str] = None,
+                     workers : int = 1, threads : int = 1):
+        # domain decomposition for grids whose lifted variables do not fit in memory: the primal and dual
+        # variables live in files (memory-mapped, in directory or a temporary one) and every sweep loads
+        # one tile of at most tile cells per spatial dimension at a time, with a halo of check_every + 1
+        # cells on each side, runs up to check_every iterations on it and writes its interior back. A
+        # variable only depends on its neighbours of the last iteration, so the interiors are the same as
+        # in the solve on the full grid; sweeps read the last one and write the next one (Jacobi), which
+        # takes two copies of the variables on disk. Returns the same as forwardInPlace, u memory-mapped
+        #
+        # workers > 1 splits the tiles of every sweep into as many bands along the first dimension and
+        # sweeps them in parallel processes with threads torch threads each, which share the files
+        # (in /dev/shm unless directory is given) and synchronize after every sweep
+        
+        if self.adaptive or self.restart or self.criterion == "residual":
+            raise ValueError("the tiled solve does not support adaptive, restart or the residual criterion")
+        
+        dev = f.device
+        l = int(l)
+        D = f.dim() - 1
+        dims = [f.size(dim = x) for x in range(f.dim())]
+        proj = int(l * (l - 1) / 2 + l)
+        halo = self.check_every + 1
+        steps = self.stepSizes(f, l) # of the full grid
+        incidence = self.incidence(l, dev)
+        incidence_t = incidence.t().contiguous()
+        
+        # variables of the last and the next sweep
+        shapes = {"u" : dims + [l], "ubar" : dims + [l], "px" : [D] + dims + [l], "pt" : dims + [l],
+                  "sx" : [D] + dims + [proj], "mux" : [D] + dims + [proj], "mubarx" : [D] + dims + [proj]}
+        if self.compact is not None: # recomputed, see mubarCompact
+            del shapes["mubarx"]
+        if directory is None and workers > 1 and os.path.isdir("/dev/shm"):
+            directory = "/dev/shm"
+        directory = tempfile.mkdtemp(dir=directory)
+        variables = [{name : self.mapped(os.path.join(directory, f"{name}_{i}"), shape) for name, shape in shapes.items()}
+                     for i in range(2)]
+        last = variables[0]
+        
+        tiles = self.tiles(dims[:-1], tile, halo)
+        for region, interior, grid in tiles: # u = ubar = f
+            f_tile = f[tuple(grid)].unsqueeze(-1)
+            last["u"][tuple(grid)].copy_(f_tile)
+            last["ubar"][tuple(grid)].copy_(f_tile)
+        
+        n_voxels = 1
+        for s in dims[:-1] + [l]:
+            n_voxels *= s
+        monitor = ConvergenceMonitor(self.criterion, tol, n_voxels, self.check_every, 1, [], dev, self.trace_checks)
+        
+        self.grid_cells = dims[0]
+        self.buffer_bytes = 0
+        self.state = None
+        pool = None
+        try:
+            if workers > 1: # bands of tiles, the workers map the same files
+                self.mapped(os.path.join(directory, "f"), dims).copy_(f)
+                bands = [tiles[i * len(tiles) // workers:(i + 1) * len(tiles) // workers] for i in range(workers)]
+                pool = torch.multiprocessing.get_context("spawn").Pool(
+                    workers, initializer=initTileWorker,
+                    initargs=(self, directory, shapes, dims, l, lmbda, nu, steps, threads))
+            
+            # sweeps end on the check iterations of forwardInPlace: 0, check_every, 2 check_every, ...
+            it, parity = 0, 0
+            while it < int(repeats):
+                end = min(int(repeats) - 1, (it + self.check_every - 1) // self.check_every * self.check_every)
+                check = monitor.due(end)
+                if pool is None:
+                    sums = [self.sweepTiles(tiles, f, variables[parity], variables[1 - parity], it, end, check,
+                                            l, lmbda, nu, steps, incidence, incidence_t)]
+                else:
+                    sums = pool.map(sweepTileWorker, [(band, parity, it, end, check) for band in bands if len(band) > 0])
+                nrj = torch.tensor(sum([s[0] for s in sums]), device=dev)
+                unorm = torch.tensor(sum([s[1] for s in sums]), device=dev)
+                self.buffer_bytes = max([self.buffer_bytes] + [s[2] for s in sums])
+                parity = 1 - parity
+                it = end + 1
+                if check:
+                    monitor.update(end, nrj, unorm, None)
+                    if bool(monitor.converged):
+                        break
+            last = variables[parity]
+            
+            if self.compact is not None:
+                last["mubarx"] = self.mapped(os.path.join(directory, "mubarx"), [D] + dims + [proj])
+                for region, interior, grid in tiles:
+                    buf = self.allocateBuffers(f[tuple(region)], l, lmbda, nu, proj)
+                    for name in ["px", "sx", "mux"]:
+                        buf[name].copy_(last[name][self.tileIndex(name, region)])
+                    mubarx = self.mubarCompact(buf, steps[3], incidence_t)
+                    last["mubarx"][self.tileIndex("mubarx", grid)].copy_(mubarx[self.tileIndex("mubarx", interior)])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self.grid_cells = 0
+            for name in os.listdir(directory): # the mappings stay valid
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+        
+        self.state = SolverState(last["u"], last["ubar"], last["px"], last["pt"], last["sx"], last["mux"], last["mubarx"])
+        self.trace = monitor.energyTrace()
+        
+        return (last["u"], monitor.nrj, monitor.eps, int(monitor.it))
+    
+    def tiles(self, dims : List[int], tile : int, halo : int) -> List[Tuple[List[slice], List[slice], List[slice]]]:
+        # tiles of the grid as (loaded region, interior within the region, interior within the grid),
+        # slices of the spatial dimensions dims
+        
+        tiles : List[Tuple[List[slice], List[slice], List[slice]]] = [([], [], [])]
+        for n in dims:
+            tiles = [(region + [slice(max(0, a - halo), min(n, a + tile + halo))],
+                      interior + [slice(a - max(0, a - halo), min(n, a + tile) - max(0, a - halo))],
+                      grid + [slice(a, min(n, a + tile))])
+                     for region, interior, grid in tiles for a in range(0, n, tile)]
+        return tiles
+    
+    def tileIndex(self, name : str, s : List[slice]):
+        # index of the spatial slices s in the variable name
+        return tuple(([slice(None)] if name in ["px", "sx", "mux", "mubarx"] else []) + s)
+    
+    def sweepTiles(self, tiles, f, last : Dict[str, Tensor], nxt : Dict[str, Tensor], it : int, end : int, check : bool,
+                   l : int, lmbda, nu, steps : Tuple[Tensor, Tensor, Tensor, Tensor], incidence, incidence_t):
+        # iterations it, ..., end of the tiled solve on the given tiles, from last into nxt. Returns the sums
+        # of |u - u_old| and |u| of the last iteration over the interiors (check only) and the largest
+        # size of the tile buffers
+        
+        tauu, sigmap, sigmas, tau = steps
+        proj = int(l * (l - 1) / 2 + l)
+        nrj, unorm, nbytes = 0.0, 0.0, 0
+        for region, interior, grid in tiles:
+            buf = self.allocateBuffers(f[tuple(region)], l, lmbda, nu, proj)
+            nbytes = max(nbytes, self.bufferBytes(buf))
+            for name, x in last.items():
+                buf[name].copy_(x[self.tileIndex(name, region)])
+            for i in range(it, end + 1):
+                self.iterateInPlace(buf, tauu, sigmap, sigmas, tau, incidence, incidence_t, check and i == end, False)
+            if check: # div holds |u - u_old| of the last iteration
+                nrj += buf["div"][tuple(interior)].sum().item()
+                unorm += buf["u"][tuple(interior)].sum().item()
+            for name, x in nxt.items():
+                x[self.tileIndex(name, grid)].copy_(buf[name][self.tileIndex(name, interior)])
+        return nrj, unorm, nbytes
+    
+    def mapped(self, filename : str, shape : List[int]):
+        # float32 tensor backed by a file instead of memory, zeros if the file is new
+        
+        n = 1
+        for s in shape:
+            n *= s
+        return torch.from_file(filename, shared=True, size=n, dtype=torch.float32).view(shape)
+    
+    def forwardBatch(self, f, repeats, l, lmbda, nu, tol):
+        # solve B independent problems in lockstep: f has shape [B] + dims, lmbda and nu are
+        # scalars or of shape [B]. The problems are stacked along the channel dimension, which the
+        # iteration never couples, and problems that meet the tolerance are dropped from the batch.
+        # Returns u of shape [B] + dims + [l] and nrj, eps, it of shape [B]
+        
+        dev = f.device
+        B = f.shape[0]
+        dims = [f.size(dim = x) for x in range(1, f.dim())]
+        C = dims[-1]
+        l = int(l)
+        proj = int(l * (l - 1) / 2 + l)
+        
+        # [B] + spatial + [C] -> spatial + [B * C], problem b owns channels b*C, ..., b*C + C-1
+        fb = f.permute(list(range(1, f.dim() - 1)) + [0, f.dim() - 1]).reshape(dims[:-1] + [B * C])
+        lmbda = torch.broadcast_to(torch.as_tensor(lmbda, dtype=torch.float32, device=dev), [B])
+        nu = torch.broadcast_to(torch.as_tensor(nu, dtype=torch.float32, device=dev), [B])
+        lmbda = lmbda.repeat_interleave(C).unsqueeze(-1)
+        nu = nu.repeat_interleave(C).unsqueeze(-1)
+        
+        tauu, sigmap, sigmas, tau = self.stepSizes(fb, l)
+        steps = (tauu, sigmap, sigmas, tau)
+        buf = self.allocateBuffers(fb, l, lmbda, nu, proj, per_channel=True)
+        self.buffer_bytes = self.bufferBytes(buf)
+        
+        incidence = self.incidence(l, dev)
+        incidence_t = incidence.t().contiguous()
+        
+        n_voxels = 1
+        for s in dims[:-1] + [l]:
+            n_voxels *= s
+        
+        u_out = torch.empty(dims[:-1] + [B * C, l], dtype=torch.float32, device=dev)
+        nrj_out = torch.zeros([B], dtype=torch.float32, device=dev)
+        eps_out = torch.zeros([B], dtype=torch.float32, device=dev)
+        it_out = torch.zeros([B], dtype=torch.int64, device=dev)
+        active = torch.arange(B, device=dev) # problems still in the batch
+        offsets = torch.arange(C, device=dev)
+        monitor = ConvergenceMonitor(self.criterion, tol, n_voxels, self.check_every, self.sync_every, [B], dev)
+        scale_p, scale_d, alpha = [torch.full([B], x, device=dev) for x in [1.0, 1.0, 0.5]] # adaptive step sizes
+        
+        # START loop
+        for it in range(int(repeats)):
+            
+            check = monitor.due(it)
+            if self.adaptive or self.sync_every > 1: # adapted steps, converged problems frozen
+                tauu, sigmap, sigmas, tau = self.effectiveSteps(steps, scale_p, scale_d, monitor.active, C)
+            self.iterateInPlace(buf, tauu, sigmap, sigmas, tau, incidence, incidence_t, check, True)
+            if check:
+                if self.adaptive:
+                    scale_p, scale_d, alpha = self.adaptiveStepSizes(buf, steps, scale_p, scale_d, alpha, incidence, C)
+                current = self.effectiveSteps(steps, scale_p, scale_d, torch.ones_like(scale_p), C)
+                self.criterionSums(buf, current, True)
+                residual = self.residual(buf, current[0].squeeze(-1))
+                # per problem sums over its channels
+                nrj, unorm, residual = [x if x is None else x.reshape(-1, C).sum(dim=-1)
+                                        for x in [buf["nrj"], buf["unorm"], residual]]
+                sync = monitor.update(it, nrj, unorm, residual)
+                if self.restart:
+                    self.restartExtrapolation(buf, monitor.increased, C)
+                if sync and bool(torch.any(monitor.converged)):
+                    # write out and drop the problems that met the tolerance
+                    done = monitor.converged
+                    nrj_out[active] = monitor.nrj
+                    eps_out[active] = monitor.eps
+                    it_out[active] = monitor.it
+                    local = torch.arange(active.shape[0], device=dev)
+                    u_out[..., (active[done].unsqueeze(-1) * C + offsets).flatten(), :] = \
+                        buf["u"][..., (local[done].unsqueeze(-1) * C + offsets).flatten(), :]
+                    active = active[~done]
+                    if active.shape[0] == 0:
+                        break
+                    buf = self.compactBuffers(buf, (local[~done].unsqueeze(-1) * C + offsets).flatten())
+                    monitor.compact(~done)
+                    scale_p, scale_d, alpha = scale_p[~done], scale_d[~done], alpha[~done]
+        
+        if active.shape[0] > 0:
+            nrj_out[active] = monitor.nrj
+            eps_out[active] = monitor.eps
+            it_out[active] = monitor.it
+            u_out[..., (active.unsqueeze(-1) * C + offsets).flatten(), :] = buf["u"]
         
         torch.cuda.empty_cache()
         
-        return (u, nrj, nrj/(torch.prod(torch.tensor(dims[:-1] + [int(l)]))), it_total)
+        # spatial + [B * C, l] -> [B] + spatial + [C, l]
+        u_out = u_out.reshape(dims[:-1] + [B, C, l]).permute([len(dims) - 1] + list(range(len(dims) - 1)) + [len(dims), len(dims) + 1])
+        
+        return (u_out.contiguous(), nrj_out, eps_out, it_out)
+    
+    def iterateInPlace(self, buf : Dict[str, Tensor], tauu, sigmap, sigmas, tau, incidence, incidence_t,
+                       check : bool, per_channel : bool):
+        # one primal-dual iteration on the preallocated buffers. On check iterations, also keeps the changes
+        # p - p_old (in px_prev, pt_prev), mu - mu_old (in t) and u - u_old (in du) that the convergence
+        # criterion and the adaptive step sizes need
+        
+        differences = check and (self.criterion == "residual" or self.adaptive)
+        relax = self.relaxation != 1.0
+        if differences or relax:
+            buf["px_prev"].copy_(buf["px"])
+            buf["pt_prev"].copy_(buf["pt"])
+        if relax:
+            buf["sx_prev"].copy_(buf["sx"])
+        if differences and self.adaptive:
+            buf["ubar_prev"].copy_(buf["ubar"])
+        
+        if self.compact is not None: # mubarx is recomputed from px before the parabola step updates it
+            self.l2projectionCompact(buf, sigmas, tau, incidence_t) # project onto l2 ball
+        self.parabolaInPlace(buf, sigmap, incidence) # project onto parabola (set K)
+        if relax:
+            self.relaxInPlace(buf["px"], buf["px_prev"])
+            self.relaxInPlace(buf["pt"], buf["pt_prev"])
+        if self.compact is None:
+            self.l2projectionInPlace(buf, sigmas) # project onto l2 ball 
+            if relax:
+                self.relaxInPlace(buf["sx"], buf["sx_prev"])
+            self.muInPlace(buf, incidence_t, tau) # constrain lagrange multipliers
+        else:
+            self.muCompact(buf, incidence_t, tau, differences, per_channel)
+        self.clippingInPlace(buf, tauu, check, per_channel) # project onto set C
+        
+        if differences:
+            torch.sub(buf["px"], buf["px_prev"], out=buf["px_prev"])
+            torch.sub(buf["pt"], buf["pt_prev"], out=buf["pt_prev"])
+    
+    def relaxInPlace(self, x, x_old):
+        # x = x_old + relaxation * (x - x_old)
+        x.sub_(x_old).mul_(self.relaxation).add_(x_old)
+    
+    def restartExtrapolation(self, buf : Dict[str, Tensor], restart, C : int):
+        # ubar = u, mubarx = mux where restart is set, per problem for batched solves (C > 0)
+        
+        if C > 0:
+            restart = restart.repeat_interleave(C).unsqueeze(-1)
+        torch.where(restart, buf["u"], buf["ubar"], out=buf["ubar"])
+        torch.where(restart, buf["mux"], buf["mubarx"], out=buf["mubarx"])
+    
+    def criterionSums(self, buf : Dict[str, Tensor], steps : Tuple[Tensor, Tensor, Tensor, Tensor], per_channel : bool):
+        # sums the convergence criterion needs after a check iteration, per channel for batched solves.
+        # The changes of p and mu are divided by their (possibly per-variable) step sizes
+        
+        if self.criterion == "relative": # u >= 0
+            self.sumAbs(buf["div"].copy_(buf["u"]), buf["unorm"], per_channel)
+        elif self.criterion == "residual":
+            tauu, sigmap, sigmas, tau = steps
+            if self.compact is None: # else summed in muCompact
+                self.sumAbs(buf["t"].div_(tau), buf["dmu"], per_channel)
+            self.sumAbs(buf["px_prev"].div_(sigmap), buf["dpx"], per_channel)
+            self.sumAbs(buf["pt_prev"].div_(sigmap), buf["dpt"], per_channel)
+    
+    def effectiveSteps(self, steps : Tuple[Tensor, Tensor, Tensor, Tensor], scale_p, scale_d, active, C : int):
+        # step sizes scaled by the adaptive factors (primal: tauu, tau, dual: sigmap, sigmas) and zeroed for
+        # converged problems, per channel [B * C, 1] for batched solves of B problems with C channels (C > 0)
+        
+        sp, sd = scale_p * active, scale_d * active
+        if C > 0:
+            sp = sp.repeat_interleave(C).unsqueeze(-1)
+            sd = sd.repeat_interleave(C).unsqueeze(-1)
+        tauu, sigmap, sigmas, tau = steps
+        return tauu * sp, sigmap * sd, sigmas * sd, tau * sp
+    
+    def adaptiveStepSizes(self, buf : Dict[str, Tensor], steps : Tuple[Tensor, Tensor, Tensor, Tensor], 
+                          scale_p, scale_d, alpha, incidence, C : int):
+        # residual balancing with backtracking, Goldstein et al. (2015), Adaptive primal-dual hybrid gradient
+        # methods for saddle-point problems, on the primal blocks (u, mu) and the dual block p, from the
+        # changes of the last check iteration. Primal steps are scale_p * (tauu, tau), dual steps
+        # scale_d * (sigmap, sigmas); balancing keeps scale_p * scale_d fixed, backtracking shrinks both.
+        # Everything stays on the device. C > 0 for batched solves, see effectiveSteps
+        
+        delta, eta, c, beta = 1.5, 0.95, 0.9, 0.5
+        
+        du, dpx, dpt, dmu = buf["du"], buf["px_prev"], buf["pt_prev"], buf["t"]
+        ux, ut, musum, w, r = buf["ux"], buf["ut"], buf["musum"], buf["ubar_prev"], buf["ux_sq"]
+        tauu, sigmap, sigmas, tau = self.effectiveSteps(steps, scale_p, scale_d, torch.ones_like(scale_p), C)
+        
+        def total(x):
+            # per problem sum
+            dims = [d for d in range(x.dim()) if not (C > 0 and d == x.dim() - 2)]
+            n = torch.sum(x, dim=dims)
+            return n.reshape(-1, C).sum(dim=-1) if C > 0 else n
+        
+        def norm(x, ord : float, step):
+            # per problem |x|_1 or |x|_2^2, weighted by 1 / step
+            return total(x.abs() / step) if ord == 1 else total(x * x / step)
+        
+        # K (du, dmu) = (grad du + A dmu, d/dt du) and <(dpx, dpt), K (du, dmu)>
+        self.forwardDifferencesInPlace(du, ux, ux.shape[0])
+        torch.matmul(dmu, incidence, out=musum)
+        ux.add_(musum)
+        self.labelDifferenceInPlace(du, ut)
+        inner = total(torch.mul(dpx, ux, out=r)) + total(torch.mul(dpt, ut, out=buf["bd"]))
         
+        # backtracking: shrink both steps if the last iteration violated the step size condition
+        b = c / 2 * (norm(du, 2, tauu) + norm(dmu, 2, tau) + norm(dpx, 2, sigmap) + norm(dpt, 2, sigmap)) - 2 * inner
+        backtrack = b < 0
+        
+        # primal residual |u - u_old| / tauu + |mu - mu_old| / tau, dual residual
+        # |(p - p_old) / sigmap - K (ubar_old - u, mu_old - mu)|, see Goldstein et al. The
+        # dual step uses ubar and mu (not mubar), hence the mu part is - A dmu
+        primal = norm(du, 1, tauu) + norm(dmu, 1, tau)
+        w.sub_(buf["u"])
+        self.forwardDifferencesInPlace(w, ux, ux.shape[0])
+        ux.sub_(musum)
+        torch.div(dpx, sigmap, out=r)
+        self.labelDifferenceInPlace(w, ut)
+        torch.div(dpt, sigmap, out=buf["bd"])
+        dual = norm(r.sub_(ux), 1, 1.0) + norm(buf["bd"].sub_(ut), 1, 1.0)
+        
+        # residual balancing: grow the step of the block whose residual dominates
+        grow_p = primal > delta * dual
+        grow_d = primal < dual / delta
+        factor = torch.where(grow_p, 1 / (1 - alpha), torch.where(grow_d, 1 - alpha, 1.0))
+        alpha = torch.where(grow_p | grow_d, alpha * eta, alpha)
+        
+        scale_p = torch.where(backtrack, beta * scale_p, scale_p * factor)
+        scale_d = torch.where(backtrack, beta * scale_d, scale_d / factor)
+        
+        return scale_p, scale_d, alpha
+    
+    def residual(self, buf : Dict[str, Tensor], tauu) -> Optional[Tensor]:
+        # primal-dual residual from the sums of the last check iteration, see criterionSums
+        
+        if self.criterion != "residual":
+            return None
+        return buf["nrj"] / tauu + buf["dpx"] + buf["dpt"] + buf["dmu"]
+    
+    def sumAbs(self, x, out, per_channel : bool):
+        # sum of |x| over all dimensions, or over all but the channel dimension -2; overwrites x
+        
+        dims = [d for d in range(x.dim()) if not (per_channel and d == x.dim() - 2)]
+        torch.sum(x.abs_(), dim=dims, out=out)
+    
+    def checkState(self, state : SolverState, f, l : int):
+        
+        dims = [f.size(dim = x) for x in range(f.dim())]
+        proj = int(l * (l - 1) / 2 + l)
+        shapes = {"u" : dims + [l], "ubar" : dims + [l], "px" : [f.dim()-1] + dims + [l], "pt" : dims + [l],
+                  "sx" : [f.dim()-1] + dims + [proj], "mux" : [f.dim()-1] + dims + [proj], "mubarx" : [f.dim()-1] + dims + [proj]}
+        for name, x in state._asdict().items():
+            if list(x.shape) != shapes[name]:
+                raise ValueError(f"warm start {name} has shape {list(x.shape)}, expected {shapes[name]} for this grid and level")
+    
+    def checkpointKey(self, f, l : int, lmbda, nu, tol, loop : str) -> Dict[str, object]:
+        # what a checkpoint must have been written by to be resumed: the loop, its options and the problem
+        # (a hash of the data f)
+        return {"loop" : loop, "dims" : list(f.shape), "l" : l, "lmbda" : float(lmbda), "nu" : float(nu),
+                "tol" : float(tol), "criterion" : self.criterion, "check_every" : self.check_every,
+                "sync_every" : self.sync_every, "labels" : None if self.labels is None else self.labels.tolist(),
+                "f" : hashlib.sha1(f.detach().cpu().numpy().tobytes()).hexdigest()}
+    
+    def saveCheckpoint(self, path : str, it : int, key : Dict[str, object], variables : Dict[str, Tensor],
+                       monitor : ConvergenceMonitor, extra : Dict[str, Tensor]) -> None:
+        # the variables, the convergence monitor and anything else the loop carries from one iteration to
+        # the next (extra) before iteration it, written to a temporary file that then replaces path, so an
+        # interrupted write leaves the last checkpoint intact
+        
+        checkpoint = {"key" : key, "it" : it, "variables" : variables, "monitor" : monitor.saveState(), "extra" : extra}
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".checkpoint")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                torch.save(checkpoint, file)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    
+    def loadCheckpoint(self, path : str, key : Dict[str, object], dev : torch.device) -> Optional[Dict[str, object]]:
+        # the checkpoint at path if there is one, see saveCheckpoint
+        
+        if not os.path.exists(path):
+            return None
+        checkpoint = torch.load(path, map_location=dev)
+        if checkpoint["key"] != key:
+            raise ValueError(f"the checkpoint {path} belongs to another problem or solver, remove it to start over")
+        return checkpoint
+    
+    def stepSizes(self, f, l : int) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+        # fixed step sizes, see forward
+        
+        if self.precondition:
+            return self.preconditionedStepSizes(f, l)
+        
+        dev = f.device
+        res = torch.tensor(1 / f.shape[0], device = dev)
+        denom = torch.tensor(4 * f.ndim, device=dev, dtype=torch.float32)
+        tauu = 1.0 / torch.sqrt(denom) * res
+        sigmap = 1.0 / torch.sqrt(denom) * res
+        sigmas = torch.tensor(1.0, device = dev)
+        proj = int(l * (l - 1) / 2 + l)
+        tau = torch.tensor( 1.0 / proj, device=dev)
+        
+        return tauu, sigmap, sigmas, tau
+    
+    def preconditionedStepSizes(self, f, l : int) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+        # diagonal preconditioning with alpha = 1, Pock and Chambolle (2011): the step of every primal
+        # (dual) variable is 1 / the sum of |K| over its column (row). The parabola projection couples
+        # px and pt, so they share the smallest step of their rows, one per label. Returns tauu (scalar),
+        # sigmap [l], sigmas (scalar), tau [proj], which broadcast against the iterates
+        
+        dev = f.device
+        N = f.shape[0] # forward differences are scaled by 1 / res
+        D = f.dim() - 1
+        
+        # u: D forward differences and the label difference, two entries each
+        tauu = torch.tensor(1.0 / (2 * D * N + 2 * l), device=dev)
+        
+        # px at label z: forward difference and the sets (k1, k2) with k1 <= z <= k2; pt: label difference
+        z = torch.arange(l, device=dev)
+        sigmap = 1.0 / torch.clamp((2 * N + (z + 1) * (l - z)).to(torch.float32), min=2 * l)
+        
+        # s: identity on mu
+        sigmas = torch.tensor(1.0, device=dev)
+        
+        # mu for the set (k1, k2): its k2 - k1 + 1 labels in px and the identity in s
+        k1, k2 = torch.triu_indices(l, l, device=dev)
+        tau = 1.0 / (k2 - k1 + 2).to(torch.float32)
+        
+        return tauu, sigmap, sigmas, tau
+    
+    def bufferBytes(self, buf : Dict[str, Tensor]) -> int:
+        return sum([x.numel() * x.element_size() for x in buf.values()])
+
+    def estimateResources(self, dims : List[int], l : int, warm_start : bool = False,
+                          active : Optional[int] = None) -> Tuple[int, int]:
+        # peak bytes and floating point operations per iteration of a solve on a grid f of shape dims
+        # (spatial dimensions and channels), without allocating anything: the in-place loop builds its
+        # buffers on the meta device, the allocating loop peaks at ~9 O(l^2) and ~50 O(l) arrays per
+        # spatial dimension (measured on CPU). warm_start adds the solver state passed in, as in forwardPyramid.
+        # With a label window the variables hold window labels, plus u on all labels at the end. active: the
+        # number of voxels in the mask of a masked solve, see forwardMasked
+
+        D = len(dims) - 1
+        L = self.label_window if 0 < self.label_window < l else l # labels per voxel, see forwardWindowed
+        proj = int(L * (L - 1) / 2 + L)
+        voxels = 1
+        for n in dims:
+            voxels *= n
+        grid_voxels = voxels
+        if active is not None:
+            voxels = active * dims[-1]
+        size_l = 4 * D * voxels * L # px, float32
+        size_proj = 4 * D * voxels * proj # sx, float32
+
+        if self.inplace:
+            meta = torch.device("meta")
+            f = torch.empty(dims, dtype=torch.float32, device=meta)
+            one = torch.tensor(1.0, device=meta)
+            buf = self.allocateBuffers(f, l, one, one, proj)
+            nbytes = self.bufferBytes(buf)
+            if self.compact is not None: # mubarx for the solver state, see mubarCompact
+                nbytes += buf["sx"].numel() * buf["sx"].element_size()
+        else:
+            nbytes = 9 * size_proj + 50 * size_l
+        nbytes += 2 * 4 * L * proj # incidence and its transpose
+        if L < l: # u on all labels and the window starts
+            nbytes += 4 * voxels * l + 8 * voxels
+        if active is not None: # neighbour tables and u on the full grid
+            nbytes += (8 + 24 * D) * active + 4 * grid_voxels * l
+        if warm_start:
+            nbytes += 3 * size_proj + size_l + 3 * size_l // D
+
+        # two products with the incidence matrix (three in compact mode, which recomputes mubarx),
+        # ~10 operations per element of sx and ~50 + 10 D per lifted voxel for the rest of the update
+        matmuls = 2 if self.compact is None else 3
+        flops = matmuls * 2 * D * voxels * L * proj + 10 * D * voxels * proj + (50 + 10 * D) * voxels * L
+
+        return nbytes, flops
+
+    def compactBuffers(self, buf : Dict[str, Tensor], channels) -> Dict[str, Tensor]:
+        # keep only the given channels (dimension -2) of every buffer
+        
+        out = torch.jit.annotate(Dict[str, Tensor], {})
+        for name, x in buf.items():
+            if name == "alpha": # per label, shared by the channels
+                out[name] = x
+            elif x.dim() >= 2:
+                out[name] = x.index_select(x.dim() - 2, channels)
+            elif x.dim() == 1:
+                out[name] = x.index_select(0, channels)
+            else:
+                out[name] = x
+        return out
+    
+    def allocateBuffers(self, f, l : int, lmbda, nu, proj : int, per_channel : bool = False) -> Dict[str, Tensor]:
+        
+        dev = f.device
+        dim = f.dim()
+        dims = [f.size(dim = x) for x in range(dim)]
+        
+        buf = torch.jit.annotate(Dict[str, Tensor], {})
+        
+        # primal and dual variables
+        buf["u"] = f.unsqueeze(-1).repeat([1] * dim + [l])
+        buf["ubar"] = buf["u"].clone()
+        buf["px"] = torch.zeros([dim-1] + dims + [l], dtype=torch.float32, device=dev)
+        buf["pt"] = torch.zeros(dims + [l], dtype=torch.float32, device=dev)
+        if self.compact is None:
+            buf["sx"] = torch.zeros([dim-1] + dims + [proj], dtype=torch.float32, device=dev)
+            buf["mux"] = torch.zeros([dim-1] + dims + [proj], dtype=torch.float32, device=dev)
+            buf["mubarx"] = torch.zeros([dim-1] + dims + [proj], dtype=torch.float32, device=dev)
+        else: # no mubarx, see l2projectionCompact
+            dtype = self.compact_dtypes[self.compact]
+            buf["sx"] = torch.zeros([dim-1] + dims + [proj], dtype=dtype, device=dev)
+            buf["mux"] = torch.zeros([dim-1] + dims + [proj], dtype=dtype, device=dev)
+        
+        # data term lmbda * (k/l - f)^2 (label values k/l, see labelGeometry) is constant over the iterations
+        labels, buf["alpha"] = self.labelGeometry(l, dev)
+        buf["dataterm"] = lmbda * torch.pow(labels - buf["u"], 2)
+        buf["nu"] = nu
+        buf["nu_bound"] = nu * self.cells(buf["sx"].shape[1])
+        
+        # work buffers
+        buf["ux"] = torch.empty([dim-1] + dims + [l], dtype=torch.float32, device=dev)
+        buf["ux_sq"] = torch.empty([dim-1] + dims + [l], dtype=torch.float32, device=dev)
+        buf["musum"] = torch.empty([dim-1] + dims + [l], dtype=torch.float32, device=dev)
+        # O(l^2) work buffers, one block of rows in compact mode
+        rows = dims if self.compact is None else [min(self.compact_rows, dims[0])] + dims[1:]
+        buf["t"] = torch.empty([dim-1] + rows + [proj], dtype=torch.float32, device=dev)
+        buf["s_norm"] = torch.empty(rows + [proj], dtype=torch.float32, device=dev)
+        buf["s_mask"] = torch.empty(rows + [proj], dtype=torch.bool, device=dev)
+        if self.compact is not None:
+            buf["sc"] = torch.empty([dim-1] + rows + [proj], dtype=torch.float32, device=dev)
+        for name in ["ut", "sq", "norm", "B", "y", "a", "b", "sb", "sb3", "d", "c", "v", "w", "div", "bd"]:
+            buf[name] = torch.empty(dims + [l], dtype=torch.float32, device=dev)
+        for name in ["mask", "mask_b", "mask1", "mask3", "mask_c", "norm_zero"]:
+            buf[name] = torch.empty(dims + [l], dtype=torch.bool, device=dev)
+        if self.criterion == "residual" or self.adaptive or self.relaxation != 1.0:
+            buf["px_prev"] = torch.empty([dim-1] + dims + [l], dtype=torch.float32, device=dev)
+            buf["pt_prev"] = torch.empty(dims + [l], dtype=torch.float32, device=dev)
+        if self.relaxation != 1.0:
+            buf["sx_prev"] = torch.empty([dim-1] + dims + [proj], dtype=torch.float32, device=dev)
+        if self.adaptive:
+            buf["ubar_prev"] = torch.empty(dims + [l], dtype=torch.float32, device=dev)
+            buf["du"] = torch.empty(dims + [l], dtype=torch.float32, device=dev)
+        
+        # sums for the convergence criterion, per channel for batched solves
+        for name in ["nrj", "unorm", "dpx", "dpt", "dmu", "dmu_block"]:
+            buf[name] = torch.zeros([dims[-1]] if per_channel else [], dtype=torch.float32, device=dev)
+        
+        return buf
+    
+    def forwardDifferencesInPlace(self, ubar, out, D : int):
+        
+        for dim in range(int(D)):
+            n = ubar.shape[dim]
+            torch.sub(ubar.narrow(dim, 1, n - 1), ubar.narrow(dim, 0, n - 1), out=out[dim].narrow(dim, 0, n - 1))
+            out[dim].narrow(dim, n - 1, 1).zero_()
+        out.div_(1 / self.cells(ubar.shape[0]))
+    
+    def cells(self, n : int) -> int:
+        # cells along the first dimension of the grid, n unless a tile of it (or its masked voxels) is solved
+        return self.grid_cells if self.grid_cells > 0 else n
+    
+    def labelDifferenceInPlace(self, ubar, out):
+        # forward difference along the labels, scaled by the number of labels
+        
+        L = ubar.shape[-1]
+        torch.sub(ubar[..., 1:], ubar[..., :-1], out=out[..., :-1])
+        out[..., -1:].zero_()
+        out.div_(1 / L)
+    
+    def backwardDifferenceInPlace(self, p, out, dim : int, scale : int):
+        # (p[j] - p[j-1]) with p[-1] = p[n-1] = 0, written into out
+        
+        n = p.shape[dim]
+        if n == 1:
+            out.zero_()
+        else:
+            torch.sub(p.narrow(dim, 1, n - 2), p.narrow(dim, 0, n - 2), out=out.narrow(dim, 1, n - 2))
+            out.narrow(dim, 0, 1).copy_(p.narrow(dim, 0, 1))
+            torch.neg(p.narrow(dim, n - 2, 1), out=out.narrow(dim, n - 1, 1))
+            out.div_(1 / scale)
+    
+    def parabolaInPlace(self, buf : Dict[str, Tensor], sigmap, incidence):
+        
+        px, pt, ubar, mux = buf["px"], buf["pt"], buf["ubar"], buf["mux"]
+        ux, ut, musum, dataterm, alpha = buf["ux"], buf["ut"], buf["musum"], buf["dataterm"], buf["alpha"]
+        sq, norm, B, y = buf["sq"], buf["norm"], buf["B"], buf["y"]
+        a, b, sb, sb3, d, c, v, w = buf["a"], buf["b"], buf["sb"], buf["sb3"], buf["d"], buf["c"], buf["v"], buf["w"]
+        mask, mask_b, mask1, mask3, norm_zero = buf["mask"], buf["mask_b"], buf["mask1"], buf["mask3"], buf["norm_zero"]
+        
+        # take forward differences
+        self.forwardDifferencesInPlace(ubar, ux, ux.shape[0])
+        self.labelDifferenceInPlace(ubar, ut)
+        
+        if self.compact is None:
+            torch.matmul(mux, incidence, out=musum)
+        else:
+            self.constraintSumsCompact(buf, incidence)
+        
+        # ux = px + sigmap * (ux + musum), ut = pt + sigmap * ut
+        ux.add_(musum).mul_(sigmap).add_(px)
+        ut.mul_(sigmap).add_(pt)
+        
+        # B = bound(ux), mask = ut < B
+        torch.mul(ux, ux, out=buf["ux_sq"])
+        torch.sum(buf["ux_sq"], dim=0, out=sq)
+        torch.mul(sq, alpha, out=B)
+        B.sub_(dataterm)
+        torch.lt(ut, B, out=mask)
+        
+        torch.add(ut, dataterm, out=y)
+        torch.sqrt(sq, out=norm)
+        
+        torch.mul(norm, 2.0 * alpha, out=a)
+        torch.mul(y, 2.0 * alpha, out=b)
+        b.neg_().add_(1.0).mul_(2.0 / 3.0)
+        torch.lt(b, 0, out=mask_b)
+        torch.neg(b, out=sb)
+        sb.sqrt_()
+        torch.pow(sb, 3.0, out=sb3)
+        
+        # d = (a - sqrt(-b)^3) * (a + sqrt(-b)^3) if b < 0 else a^2 + b^3
+        torch.sub(a, sb3, out=d)
+        torch.add(a, sb3, out=c)
+        d.mul_(c)
+        torch.pow(a, 2.0, out=v)
+        torch.pow(b, 3.0, out=c)
+        v.add_(c)
+        torch.where(mask_b, d, v, out=d)
+        
+        torch.sqrt(d, out=c)
+        c.add_(a).pow_(1.0 / 3.0)
+        torch.ge(d, 0, out=mask1)
+        torch.eq(c, 0, out=buf["mask_c"])
+        mask1.logical_and_(buf["mask_c"])
+        torch.lt(d, 0, out=mask3)
+        
+        # v = 0 if mask1 else (2 sqrt(-b) cos(acos(a / sqrt(-b)^3) / 3) if mask3 else c - b / c)
+        torch.div(a, sb3, out=v)
+        v.acos_().mul_(1.0 / 3.0).cos_()
+        torch.mul(sb, 2.0, out=w)
+        w.mul_(v)
+        torch.div(b, c, out=v)
+        torch.sub(c, v, out=v)
+        torch.where(mask3, w, v, out=v)
+        v.masked_fill_(mask1, 0.0)
+        
+        # px = ((v / (2 alpha)) * ux / norm if norm > 0 else 0) if mask else ux
+        v.div_(2.0 * alpha)
+        torch.mul(ux, v, out=px)
+        px.div_(norm)
+        torch.eq(norm, 0, out=norm_zero)
+        px.masked_fill_(norm_zero, 0.0)
+        torch.where(mask, px, ux, out=px)
+        
+        # pt = bound(px) if mask else ut
+        torch.mul(px, px, out=buf["ux_sq"])
+        torch.sum(buf["ux_sq"], dim=0, out=sq)
+        sq.mul_(alpha).sub_(dataterm)
+        torch.where(mask, sq, ut, out=pt)
+    
+    def l2projectionInPlace(self, buf : Dict[str, Tensor], sigmas):
+        
+        sx, mubarx, t, s_norm, s_mask = buf["sx"], buf["mubarx"], buf["t"], buf["s_norm"], buf["s_mask"]
+        
+        # mx = sx - sigmas * mubarx
+        torch.mul(mubarx, sigmas, out=t)
+        sx.sub_(t)
+        torch.mul(sx, sx, out=t)
+        torch.sum(t, dim=0, out=s_norm)
+        s_norm.sqrt_()
+        torch.gt(s_norm, buf["nu_bound"], out=s_mask)
+        
+        torch.mul(sx, buf["nu"], out=t)
+        t.div_(s_norm)
+        torch.where(s_mask, t, sx, out=sx)
+    
+    def muInPlace(self, buf : Dict[str, Tensor], incidence_t, tau):
+        
+        px, sx, mux, mubarx, t = buf["px"], buf["sx"], buf["mux"], buf["mubarx"], buf["t"]
+        
+        torch.matmul(px, incidence_t, out=t)
+        
+        # mux = cx + tau * (sx - t), mubarx = 2 * mux - cx
+        torch.sub(sx, t, out=t)
+        t.mul_(tau)
+        mubarx.copy_(mux)
+        mux.add_(t)
+        mubarx.neg_().add_(mux, alpha=2.0)
+        
+        if self.relaxation != 1.0: # relax mux, t holds the relaxed change
+            mux.sub_(t)
+            t.mul_(self.relaxation)
+            mux.add_(t)
+    
+    def blocks(self, n : int) -> List[Tuple[int, int]]:
+        # (start, length) of the row blocks of the compact updates
+        return [(i, min(self.compact_rows, n - i)) for i in range(0, n, self.compact_rows)]
+    
+    def constraintSumsCompact(self, buf : Dict[str, Tensor], incidence):
+        # musum = mux @ incidence, block by block in float32
+        
+        mux, musum = buf["mux"], buf["musum"]
+        for i, r in self.blocks(mux.shape[1]):
+            sc = buf["sc"].narrow(1, 0, r)
+            sc.copy_(mux.narrow(1, i, r))
+            torch.matmul(sc, incidence, out=musum.narrow(1, i, r))
+    
+    def l2projectionCompact(self, buf : Dict[str, Tensor], sigmas, tau, incidence_t):
+        # l2projectionInPlace with mubarx = 2 mux - mux_old = mux + tau * (sx - px @ incidence_t) recomputed
+        # from the variables of the last iteration (px before its parabola step), block by block in float32
+        
+        px, sx, mux = buf["px"], buf["sx"], buf["mux"]
+        for i, r in self.blocks(sx.shape[1]):
+            t, sc = buf["t"].narrow(1, 0, r), buf["sc"].narrow(1, 0, r)
+            s_norm, s_mask = buf["s_norm"].narrow(0, 0, r), buf["s_mask"].narrow(0, 0, r)
+            sx_i = sx.narrow(1, i, r)
+            
+            torch.matmul(px.narrow(1, i, r), incidence_t, out=t)
+            sc.copy_(sx_i)
+            torch.sub(sc, t, out=t)
+            t.mul_(tau).add_(mux.narrow(1, i, r))
+            
+            # mx = sx - sigmas * mubarx
+            sc.sub_(t.mul_(sigmas))
+            torch.mul(sc, sc, out=t)
+            torch.sum(t, dim=0, out=s_norm)
+            s_norm.sqrt_()
+            torch.gt(s_norm, buf["nu_bound"], out=s_mask)
+            
+            torch.mul(sc, buf["nu"], out=t)
+            t.div_(s_norm)
+            torch.where(s_mask, t, sc, out=sc)
+            sx_i.copy_(sc)
+    
+    def muCompact(self, buf : Dict[str, Tensor], incidence_t, tau, residual : bool, per_channel : bool):
+        # muInPlace without mubarx, block by block in float32. For the residual criterion, also sums
+        # |mux - mux_old| / tau = |sx - px @ incidence_t| into dmu
+        
+        px, sx, mux = buf["px"], buf["sx"], buf["mux"]
+        if residual:
+            buf["dmu"].zero_()
+        for i, r in self.blocks(sx.shape[1]):
+            t, sc = buf["t"].narrow(1, 0, r), buf["sc"].narrow(1, 0, r)
+            
+            torch.matmul(px.narrow(1, i, r), incidence_t, out=t)
+            sc.copy_(sx.narrow(1, i, r))
+            torch.sub(sc, t, out=t)
+            if residual:
+                self.sumAbs(sc.copy_(t), buf["dmu_block"], per_channel)
+                buf["dmu"].add_(buf["dmu_block"])
+            mux.narrow(1, i, r).add_(t.mul_(tau))
+    
+    def mubarCompact(self, buf : Dict[str, Tensor], tau, incidence_t):
+        # mubarx of the last iteration for the solver state, in the compact dtype
+        
+        px, sx, mux = buf["px"], buf["sx"], buf["mux"]
+        mubarx = torch.empty_like(mux)
+        for i, r in self.blocks(sx.shape[1]):
+            t, sc = buf["t"].narrow(1, 0, r), buf["sc"].narrow(1, 0, r)
+            torch.matmul(px.narrow(1, i, r), incidence_t, out=t)
+            sc.copy_(sx.narrow(1, i, r))
+            torch.sub(sc, t, out=t)
+            mubarx.narrow(1, i, r).copy_(t.mul_(tau).add_(mux.narrow(1, i, r)))
+        return mubarx
+    
+    def clippingInPlace(self, buf : Dict[str, Tensor], tauu, energy : bool, per_channel : bool):
+        
+        px, pt, u, ubar, div, bd = buf["px"], buf["pt"], buf["u"], buf["ubar"], buf["div"], buf["bd"]
+        
+        # ubar temporarily holds the previous iterate
+        ubar.copy_(u)
+        
+        # take backward differences
+        for i in range(px.shape[0]):
+            if i == 0:
+                self.backwardDifferenceInPlace(px[i], div, i, self.cells(px.shape[1]))
+            else:
+                self.backwardDifferenceInPlace(px[i], bd, i, self.cells(px.shape[1]))
+                div.add_(bd)
+        self.backwardDifferenceInPlace(pt, bd, pt.dim() - 1, pt.shape[-1])
+        div.add_(bd)
+        
+        u.add_(div.mul_(tauu))
+        u.clamp_(min=0, max=1)
+        u[..., 0].fill_(1)
+        u[..., -1].fill_(0)
+        
+        relax = self.relaxation != 1.0
+        if relax: # relax u and project it again, bd holds the unrelaxed change
+            torch.sub(u, ubar, out=bd)
+            u.add_(bd, alpha=self.relaxation - 1.0)
+            u.clamp_(min=0, max=1)
+            u[..., 0].fill_(1)
+            u[..., -1].fill_(0)
+        
+        if energy:
+            torch.sub(u, ubar, out=div)
+            if self.adaptive:
+                buf["du"].copy_(div)
+            self.sumAbs(div, buf["nrj"], per_channel)
+        
+        if relax: # extrapolate from the unrelaxed update
+            ubar.add_(bd, alpha=2.0)
+        else:
+            ubar.neg_().add_(u, alpha=2.0)
+    
     def updateStepSizes(self, tau_u, tau, sigma_p, sigma_s, gamma_u, gamma_mu, theta_u, theta_mu):
         theta_u = 1 / torch.sqrt(2*gamma_u*tau_u)
         theta_mu = 1 / torch.sqrt(2*gamma_mu*tau)
@@ -152,18 +1736,31 @@ class PrimalDual(torch.nn.Module):
         
         return tau_u, tau, sigma_p, sigma_s
     
-    def adaptiveStepSizes(u, mux, px, pt, sx, u_old, mux_old, px_old, pt_old, sx_old,
-                          sigmap, sigmas, tauu, tau, alpha, eta):
-        c = 0.9
+    def labelGeometry(self, l : int, dev : torch.device, dtype : torch.dtype = torch.float32) -> Tuple[Tensor, Tensor]:
+        # values of the l labels (k/l, k = 1, ..., l, or self.labels) and the curvatures of their parabolas.
+        # Labels at t_1 < ... < t_l discretize the lifted constraint |int_t1^t2 p^x dt| <= nu with the weights
+        # w_k = l (t_(k+1) - t_k) (1 for evenly spaced labels); with px = w p^x that is the constraint on the
+        # sums of px of the evenly spaced solve, and the parabola of label k becomes
+        # pt >= 0.25 |px|^2 / w_k^2 - lmbda (t_k - f)^2, so only the projection changes, not the step sizes.
+        # The last label takes the spacing of the one before it
         
-        u_norm = torch.linalg.vector_norm(u-u_old, ord=2)**2
-        mux_norm = torch.linalg.vector_norm(mux-mux_old, ord=2)**2
-        px_norm = torch.linalg.vector_norm(px-px_old, ord=2)**2
-        pt_norm = torch.linalg.vector_norm(pt-pt_old, ord=2)**2
-        sx_norm = torch.linalg.vector_norm(sx-sx_old, ord=2)**2
-        # backtrack = (c / (2*tauu) * u_norm + c / (2*tau) * mux_norm + 
-        #              c / (2*sigmap) * px_norm + c / (2*sigmas) * sx_norm) - 
-        #             2*()
+        if self.labels is None:
+            labels = torch.arange(1, l+1, device=dev, dtype=dtype) / l
+            return labels, torch.full([l], 0.25, device=dev, dtype=dtype)
+        if self.labels.dim() != 1 or self.labels.shape[0] != l:
+            raise ValueError(f"labels must hold one value per label, got {list(self.labels.shape)} for l = {l}")
+        labels = self.labels.to(device=dev, dtype=dtype)
+        w = torch.diff(labels) * l
+        w = torch.cat((w, w[-1:]))
+        return labels, 0.25 / (w * w)
+    
+    def incidence(self, l : int, dev : torch.device) -> Tensor:
+        # A[K, z] = 1 if k1 <= z <= k2 for the K-th set (k1, k2), ordered k1 <= k2 row by row
+        # (eq. 4.24 in thesis), so that sums over the sets are one matrix multiply
+        k1, k2 = torch.triu_indices(l, l, device=dev)
+        z = torch.arange(l, device=dev)
+        A = (k1.unsqueeze(-1) <= z) & (z <= k2.unsqueeze(-1))
+        return A.to(torch.float32)
     
     def forward_differences(self, ubar, D):
 
@@ -189,7 +1786,7 @@ class PrimalDual(torch.nn.Module):
 
 
     #@torch.jit.script
-    def parabola(self, px, pt, ubar, mux, lmbda, l, f, k_indices, dims, sigmap):
+    def parabola(self, px, pt, ubar, mux, lmbda, l, f, incidence, dims, sigmap):
 
         # take forward differences
         ux = self.forward_differences(ubar, len(dims)-1)
@@ -198,16 +1795,8 @@ class PrimalDual(torch.nn.Module):
         ut = (torch.cat((torch.diff(ubar, dim=-1), \
                          torch.zeros_like(ubar[...,:1], dtype = torch.float32)), dim = -1)) / (1 / ubar.shape[-1])  #/ (1 / ubar.shape[-1])
         
-        musum_list = []
-
-        for z in range(int(l)):
-
-            #musum_temp = mux[..., k_indices[z]].sum(dim=-1)
-            musum_temp = torch.index_select(mux, -1, torch.tensor(k_indices[z],  device = px.device)).sum(dim=-1)
-
-            musum_list.append(musum_temp)
-
-        musum = torch.stack(musum_list, dim=-1)
+        # musum[..., z] = sum of mux over all sets (k1, k2) with k1 <= z <= k2
+        musum = torch.matmul(mux, incidence)
 
         # Calculate u1, u2, and u3 using the formulas in the original function
     
@@ -216,10 +1805,16 @@ class PrimalDual(torch.nn.Module):
         
         img = torch.stack([f] * l, dim=-1)
 
-        # Calculate B using bound and broadcast it along the last dimension
-        k = torch.arange(1, int(l)+1, dtype=torch.int64, device = px.device).repeat(dims + [1])
+        # label values and curvatures, broadcast along the last dimension
+        labels, alpha = self.labelGeometry(int(l), px.device)
         
-        B = self.bound(ux, lmbda, k, l, img) # chcked
+        return self.projectParabola(ux, ut, lmbda, labels, alpha, img)
+    
+    def projectParabola(self, ux, ut, lmbda, labels, alpha, img):
+        # projection of (ux, ut) onto the parabolas pt >= alpha |px|^2 - lmbda (labels - img)^2 of the labels
+        # with values labels (k/l for k = 1, ..., l) and curvatures alpha (0.25), see labelGeometry
+        
+        B = self.bound(ux, lmbda, labels, alpha, img) # chcked
         
         # Use mask to select elements where u3 < B
         mask = (ut < B)
@@ -227,12 +1822,12 @@ class PrimalDual(torch.nn.Module):
         xx = ux.detach().clone() #[mask]
         xt = ut.detach().clone() #[mask]
         
-        y = xt + lmbda * torch.pow(k / l - img, 2)
+        y = xt + lmbda * torch.pow(labels - img, 2)
         norm = torch.sqrt(torch.sum(xx * xx, dim=0))
 
         #v = torch.zeros_like(norm)
-        a = 2.0 * 0.25 * norm
-        b = 2.0 / 3.0 * (1.0 - 2.0 * 0.25 * y)
+        a = 2.0 * alpha * norm
+        b = 2.0 / 3.0 * (1.0 - 2.0 * alpha * y)
         d = torch.zeros_like(a)
         mask_b = (b < 0)
         d = torch.where(mask_b, (a - torch.pow(torch.sqrt(-b), 3.0)) * (a + torch.pow(torch.sqrt(-b), 3.0)), 
@@ -247,9 +1842,9 @@ class PrimalDual(torch.nn.Module):
 
         px = torch.where(torch.stack([mask] * ux.size(dim = 0), dim=0), 
                          torch.where(torch.stack([norm] * ux.size(dim = 0), dim=0) == 0, 0.0, 
-                                     (v / (2.0*0.25) ) * xx / norm),
+                                     (v / (2.0*alpha) ) * xx / norm),
                          ux)
-        pt = torch.where(mask, self.bound(px, lmbda, k, l, img),
+        pt = torch.where(mask, self.bound(px, lmbda, labels, alpha, img),
                          ut)
         
         return px, pt
@@ -257,8 +1852,8 @@ class PrimalDual(torch.nn.Module):
 
         
     #@torch.jit.script
-    def bound(self, x, lmbda, k, l, f):
-        return 0.25 * torch.sum(x * x, dim=0) - lmbda * torch.pow(k / l - f, 2)
+    def bound(self, x, lmbda, labels, alpha, f):
+        return alpha * torch.sum(x * x, dim=0) - lmbda * torch.pow(labels - f, 2)
 
     
                      
@@ -274,22 +1869,16 @@ class PrimalDual(torch.nn.Module):
         mx = sx - sigmas * mubarx
         norm = torch.sqrt(torch.sum(mx * mx, dim = 0))
         
-        mask = (norm > (nu ) * sx.shape[1] ) # * sx.shape[1]
+        mask = (norm > (nu ) * self.cells(sx.shape[1]) ) # * sx.shape[1]
         sx = torch.where(torch.stack([mask] * mx.size(dim = 0), dim=0), mx * nu / norm, mx) # TODO sx.shape[1]?
         
         return sx
 
     #@torch.jit.script
-    def mu(self, px, sx, mux, proj, l, k1_k2_combinations, tau):
-
-        # t1 = torch.stack(tuple([p1[:,:,:,k[0].item():(k[1].item()+1)].sum(dim=3) for k in k1_k2_combinations]), dim=-1)
-        # t2 = torch.stack(tuple([p2[:,:,:,k[0].item():(k[1].item()+1)].sum(dim=3) for k in k1_k2_combinations]), dim=-1)
-        
-        t_list = []
-        for k in k1_k2_combinations:
-            t_list.append(px[..., k[0].item():(k[1].item() + 1)].sum(dim=-1))
+    def mu(self, px, sx, mux, proj, l, incidence, tau):
 
-        t = torch.stack(t_list, dim=-1)
+        # t[..., K] = px[..., k1:(k2+1)].sum(-1) for the K-th set (k1, k2)
+        t = torch.matmul(px, incidence.t())
 
         cx = mux.detach().clone()
         mux = cx+tau*(sx-t)
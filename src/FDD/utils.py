@@ -2,6 +2,8 @@ import torch
 from torch.overrides import TorchFunctionMode
 import numpy as np
 import pkg_resources
+import queue
+import threading
 
 _DEVICE_CONSTRUCTOR = {
     # standard ones
@@ -71,8 +73,8 @@ def setDevice():
         torch.set_default_tensor_type('torch.cuda.FloatTensor')
     elif torch.backends.mps.is_available(): # mac gpus
         device = torch.device("mps")
-    elif torch.backends.mkl.is_available(): # intel cpus
-        device = torch.device("mkl")
+    else: # cpus (mkl is a backend, not a device)
+        device = torch.device("cpu")
     torch.set_grad_enabled(True)
     return device
 
@@ -131,4 +133,53 @@ def interpolate(k, uk0, uk1, l):
 def load_model(fn, device):
     model_file_path = pkg_resources.resource_filename('FDD', 'models/' + fn)
     model = torch.jit.load(model_file_path, map_location=device)
-    return model
\ No newline at end of file
+    return model
+
+def chunkBounds(chunks):
+    # per-column minimum and maximum of X and Y over an iterable of (X, Y) chunks
+    bounds = None
+    for X, Y in chunks:
+        X = np.asarray(X, dtype = np.float64).reshape(len(X), -1)
+        Y = np.asarray(Y, dtype = np.float64)
+        chunk = [X.min(axis = 0), X.max(axis = 0), Y.min(axis = 0), Y.max(axis = 0)]
+        bounds = chunk if bounds is None else [np.minimum(bounds[0], chunk[0]), np.maximum(bounds[1], chunk[1]),
+                                               np.minimum(bounds[2], chunk[2]), np.maximum(bounds[3], chunk[3])]
+    if bounds is None:
+        raise ValueError("no chunks to read")
+    return bounds
+
+def prefetched(items, depth=1):
+    # iterate over items, reading up to depth items ahead in a thread. An exception of the reader is raised
+    # where the item it failed on would have been returned
+    buffer = queue.Queue(maxsize = depth)
+    done = object()
+    stop = threading.Event()
+
+    def read():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        buffer.put((item, None), timeout = 0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            buffer.put((done, None))
+        except Exception as error:
+            buffer.put((done, error))
+
+    reader = threading.Thread(target = read, daemon = True)
+    reader.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        reader.join()
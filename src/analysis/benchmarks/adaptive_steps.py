@@ -0,0 +1,47 @@
+# Iterations to tolerance with fixed vs. adaptive step sizes. The stopping criteria scale with the
+# step sizes, so the tolerance here is the mean distance of u to a reference solution from a long
+# fixed-step run, checked every --every iterations.
+#
+#   python adaptive_steps.py --N 30 --target 0.03
+
+import argparse
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=30)
+    parser.add_argument("--level", type=int, default=8)
+    parser.add_argument("--lmbda", type=float, default=50)
+    parser.add_argument("--iter", type=int, default=4000)
+    parser.add_argument("--every", type=int, default=250)
+    parser.add_argument("--target", type=float, default=0.03)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    f = torch.rand(args.N, args.N, 1)
+    f[:args.N//2] = torch.clamp(f[:args.N//2] + 0.3, max=1)
+    level, lmbda, nu, tol = torch.tensor(args.level), torch.tensor(args.lmbda), torch.tensor(0.01), torch.tensor(0.0)
+
+    ref = PrimalDual(inplace=True).forward(f, torch.tensor(5 * args.iter), level, lmbda, nu, tol)[0]
+
+    print(f"{args.N}x{args.N} grid, level {args.level}, mean |u - u*| after")
+    print(f"{'iter':>8}{'fixed':>10}{'adaptive':>10}")
+    first = {False : None, True : None}
+    times = {False : 0.0, True : 0.0}
+    for it in range(args.every, args.iter + 1, args.every):
+        dist = {}
+        for adaptive in [False, True]:
+            t0 = time.time()
+            u = PrimalDual(inplace=True, adaptive=adaptive).forward(f, torch.tensor(it), level, lmbda, nu, tol)[0]
+            times[adaptive] = time.time() - t0
+            dist[adaptive] = (u - ref).abs().mean().item()
+            if first[adaptive] is None and dist[adaptive] <= args.target:
+                first[adaptive] = it
+        print(f"{it:>8}{dist[False]:>10.4f}{dist[True]:>10.4f}")
+
+    print(f"iterations to {args.target}: fixed {first[False]}, adaptive {first[True]}")
+    print(f"time for {args.iter} iterations: fixed {times[False]:.2f}s, adaptive {times[True]:.2f}s")
@@ -0,0 +1,39 @@
+# Wall time of B small solves, one PrimalDual.forward call each vs. one PrimalDual.forwardBatch call.
+#
+#   python batch.py --N 20 --B 16
+
+import argparse
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=20)
+    parser.add_argument("--B", type=int, default=16)
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=1000)
+    parser.add_argument("--tol", type=float, default=1e-4)
+    args = parser.parse_args()
+    
+    torch.manual_seed(0)
+    f = torch.rand(args.B, args.N, args.N, 1)
+    f[:, :args.N//2] = torch.clamp(f[:, :args.N//2] + 0.3, max=1)
+    lmbda = torch.logspace(0, 2.5, args.B)
+    nu = torch.tensor(0.01)
+    repeats, level, tol = torch.tensor(args.iter), torch.tensor(args.level), torch.tensor(args.tol)
+    
+    model = PrimalDual(inplace=True)
+    t0 = time.time()
+    its = [model.forward(f[b], repeats, level, lmbda[b], nu, tol)[3] for b in range(args.B)]
+    t_seq = time.time() - t0
+    
+    t0 = time.time()
+    it_batch = model.forwardBatch(f, repeats, level, lmbda, nu, tol)[3]
+    t_batch = time.time() - t0
+    
+    print(f"{args.B} problems on a {args.N}x{args.N} grid, level {args.level}, {torch.get_num_threads()} threads")
+    print(f"iterations per problem: {its}")
+    print(f"sequential {t_seq:.2f}s, batched {t_batch:.2f}s, speedup {t_seq / t_batch:.2f}")
@@ -0,0 +1,78 @@
+# Binning the points into the grid cells (FDD.castDataToGridSmooth): the loop over the points it used
+# before vs. the current bincount version, time for growing numbers of points on a fixed grid, scalar and
+# vector outcome (several points per cell: the fill of empty cells takes scalar outcomes only). For the sizes the loop is run at, checks that the cell means, the counts and the points
+# of every cell are the same.
+#
+#   python binning.py --N 100 --points 1000 10000 100000 1000000 10000000 --loop 100000
+
+import argparse
+import time
+
+import numpy as np
+from FDD import FDD
+from scipy.spatial import cKDTree
+
+
+def loop(model):
+    # castDataToGridSmooth before the vectorized binning
+    grid_x = np.stack(np.meshgrid(*model.gridAxes(model.resolution)), axis = -1)
+    if model.Y.ndim > 1:
+        grid_y = np.zeros(list(grid_x.shape[:-1]) + [model.Y.shape[1]])
+    else:
+        grid_y = np.zeros(list(grid_x.shape[:-1]))
+    grid_x_og = np.empty(list(grid_x.shape[:-1]), dtype = object)
+    indices = [(np.clip(model.X[:, i] // model.resolution, 0, grid_y.shape[i] - 1)).astype(int)
+               for i in range(model.X.shape[1])]
+    indices = np.array(indices).T
+    counts = np.zeros_like(grid_y)
+    for index in np.ndindex(grid_x_og.shape):
+        grid_x_og[index] = []
+    for i, index_tuple in enumerate(indices):
+        index = tuple(index_tuple)
+        if np.all(index < grid_y.shape):
+            grid_y[index] += model.Y[i]
+            counts[index] += 1
+            grid_x_og[index].append(model.X[i])
+    grid_y = np.divide(grid_y, counts, where=counts != 0, out=grid_y)
+    empty_cells = np.where(counts == 0)
+    if len(empty_cells[0]) > 0:
+        tree = cKDTree(model.X + model.resolution / 2)
+        _, closest_indices = tree.query(np.vstack(empty_cells).T * model.resolution, k=1)
+        grid_y[empty_cells] = model.Y[closest_indices]
+    return grid_y, counts, grid_x_og
+
+
+def same(model, reference):
+    grid_y, counts, grid_x_og = reference
+    grid_y_new = model.grid_y if model.Y.ndim > 1 else model.grid_y[..., 0]
+    cells = all(np.array_equal(model.cellPoints(index), np.stack(p) if len(p) else np.empty((0, model.X.shape[1])))
+                for index, p in np.ndenumerate(grid_x_og))
+    counts = counts if model.Y.ndim == 1 else counts[..., 0]
+    return np.array_equal(grid_y_new, grid_y) and np.array_equal(model.grid_counts, counts) and cells
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=100)
+    parser.add_argument("--points", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6, 10**7])
+    parser.add_argument("--loop", type=int, default=10**5) # largest number of points to run the loop at
+    args = parser.parse_args()
+
+    print(f"grid {args.N}x{args.N}")
+    print(f"{'points':>10}{'Y':>8}{'loop (s)':>10}{'bincount (s)':>14}{'speedup':>9}  identical")
+    for n in args.points:
+        np.random.seed(0)
+        X = np.random.rand(n, 2)
+        for outcome in ["scalar", "vector"] if n >= 20 * args.N ** 2 else ["scalar"]:
+            Y = np.random.normal(size=n) if outcome == "scalar" else np.random.normal(size=(n, 3))
+            model = FDD(Y, X, level = 16, resolution = 1 / args.N, pick_nu = "MS", scripted = False)
+            t0 = time.time()
+            model.castDataToGridSmooth()
+            t_new = time.time() - t0
+            if n <= args.loop:
+                t0 = time.time()
+                reference = loop(model)
+                t_loop = time.time() - t0
+                print(f"{n:>10}{outcome:>8}{t_loop:>10.2f}{t_new:>14.3f}{t_loop / t_new:>9.0f}  {same(model, reference)}")
+            else:
+                print(f"{n:>10}{outcome:>8}{'':>10}{t_new:>14.3f}")
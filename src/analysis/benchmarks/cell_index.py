@@ -0,0 +1,80 @@
+# Points of every grid cell as an object array of per-cell lists (grid_x_og, before) vs. the points sorted by
+# cell with per-cell offsets (FDD.cell_points, cell_offsets): memory allocated to build them (tracemalloc, on
+# top of the points themselves), size and time of pickling them, time to take the mean of the points of
+# every cell, and a check that both give the same points and means.
+#
+#   python cell_index.py --N 100 --points 1000000
+
+import argparse
+import pickle
+import time
+import tracemalloc
+
+import numpy as np
+from FDD import FDD
+
+
+def objectArray(model):
+    # grid_x_og as castDataToGridSmooth built it: a list of the rows of X in every cell
+    shape = model.grid_x.shape[:-1]
+    cells = np.ravel_multi_index([np.clip(model.X[:, i] // model.resolution, 0, shape[i] - 1).astype(int)
+                                  for i in range(model.X.shape[1])], shape)
+    order = np.argsort(cells, kind = "stable")
+    groups = np.split(model.X[order], np.cumsum(np.bincount(cells, minlength = int(np.prod(shape))))[:-1])
+    grid_x_og = np.empty(shape, dtype = object)
+    for index, group in zip(np.ndindex(shape), groups):
+        grid_x_og[index] = list(group)
+    return grid_x_og
+
+
+def offsets(model):
+    shape = model.grid_x.shape[:-1]
+    cells = np.ravel_multi_index([np.clip(model.X[:, i] // model.resolution, 0, shape[i] - 1).astype(int)
+                                  for i in range(model.X.shape[1])], shape)
+    order = np.argsort(cells, kind = "stable")
+    return model.X[order], np.concatenate([[0], np.cumsum(np.bincount(cells, minlength = int(np.prod(shape))))])
+
+
+def measure(build, model):
+    tracemalloc.start()
+    t0 = time.time()
+    index = build(model)
+    elapsed = time.time() - t0
+    nbytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    t0 = time.time()
+    size = len(pickle.dumps(index, protocol = pickle.HIGHEST_PROTOCOL))
+    return index, elapsed, nbytes, size, time.time() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=100)
+    parser.add_argument("--points", type=int, default=10**6)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    X = np.random.rand(args.points, 2)
+    model = FDD(X[:, 0], X, level = 16, resolution = 1 / args.N, pick_nu = "MS", scripted = False)
+
+    grid_x_og, t_old, nbytes_old, size_old, t_pickle_old = measure(objectArray, model)
+    t0 = time.time()
+    means_old = np.stack([np.mean(np.stack(p), axis = 0) for p in grid_x_og.flat if len(p) > 0])
+    t_means_old = time.time() - t0
+
+    (points, offsets_), t_new, nbytes_new, size_new, t_pickle_new = measure(offsets, model)
+    t0 = time.time()
+    means, counts = model.cellMeans()
+    t_means_new = time.time() - t0
+
+    same = all(np.array_equal(np.stack(p) if len(p) else np.empty((0, 2)), model.cellPoints(index))
+               for index, p in np.ndenumerate(grid_x_og))
+    close = np.abs(means[counts > 0] - means_old).max()
+
+    print(f"grid {args.N}x{args.N}, {args.points} points")
+    print(f"{'index':>10}{'build (s)':>11}{'memory (MB)':>13}{'pickle (MB)':>13}{'pickle (s)':>12}{'means (s)':>11}")
+    print(f"{'object':>10}{t_old:>11.2f}{nbytes_old / 2**20:>13.1f}{size_old / 2**20:>13.1f}{t_pickle_old:>12.2f}"
+          f"{t_means_old:>11.2f}")
+    print(f"{'offsets':>10}{t_new:>11.2f}{nbytes_new / 2**20:>13.1f}{size_new / 2**20:>13.1f}{t_pickle_new:>12.2f}"
+          f"{t_means_new:>11.3f}")
+    print(f"same points per cell: {same}, largest difference of the means: {close:.1e}")
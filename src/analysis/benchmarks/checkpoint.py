@@ -0,0 +1,83 @@
+# Checkpoint and resume (FDD.run(checkpoint_path=...)): a solve in a separate process is killed once it
+# has written a checkpoint, rerun from the checkpoint and compared bit for bit (u, jumps on the grid,
+# energy, criterion, iterations and the energy trace) to the same solve run without interruption, on the
+# allocating loop, the in-place loop with adaptive step sizes, the label window solve and the masked solve
+# (mask="data", on a grid with empty cells), CPU. Also the time of an uninterrupted
+# solve with and without checkpoints, the size of a checkpoint and the time of the resumed solve.
+#
+#   python checkpoint.py --N 40 --level 16 --iter 2000 --every 200
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from FDD import FDD
+
+loops = {"allocating" : {}, "inplace-adaptive" : {"inplace" : True, "adaptive" : True},
+         "label-window" : {"label_window" : 8}, "masked" : {"mask" : "data"}}
+
+
+def model(args, loop):
+    np.random.seed(0)
+    X = np.random.rand(20 * args.N ** 2, 2)
+    if loop == "masked": # no points in a corner
+        X = X[(X[:, 0] > 0.3) | (X[:, 1] > 0.3)]
+    Y = 0.5 * X[:, 0] + 0.4 * (X[:, 1] > 0.5) + 0.05 * np.random.normal(size=X.shape[0])
+    return FDD(Y, X, level = args.level, lmbda = 50, nu = 0.01, iter = args.iter, tol = 1e-9, trace = True,
+               resolution = 1 / args.N, pick_nu = "MS", scripted = False, **loops[loop])
+
+
+def fit(args, loop, path=None):
+    fdd = model(args, loop)
+    t0 = time.time()
+    u, jumps, J_grid, nrj, eps, it = fdd.run(checkpoint_path = path, checkpoint_every = args.every)
+    return [u, J_grid, nrj, eps, np.array(it), fdd.energy_trace.nrj.numpy()], time.time() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=40)
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=2000)
+    parser.add_argument("--every", type=int, default=200)
+    parser.add_argument("--worker", type=str, default=None) # loop, run until killed
+    parser.add_argument("--path", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        fit(args, args.worker, args.path)
+        sys.exit(0)
+
+    print(f"grid {args.N}x{args.N}, level {args.level}, {args.iter} iterations, checkpoint every {args.every}")
+    print(f"{'loop':>18}{'plain (s)':>11}{'checkpoints (s)':>17}{'size (MB)':>11}{'killed at':>11}{'resumed (s)':>13}"
+          f"  identical")
+    with tempfile.TemporaryDirectory() as tmp:
+        for loop in loops:
+            reference, t_plain = fit(args, loop)
+            _, t_checkpoints = fit(args, loop, os.path.join(tmp, "timed.pt"))
+
+            # kill the solve a little after its second checkpoint
+            path = os.path.join(tmp, f"{loop}.pt")
+            worker = subprocess.Popen([sys.executable, __file__, "--N", str(args.N), "--level", str(args.level),
+                                       "--iter", str(args.iter), "--every", str(args.every), "--worker", loop,
+                                       "--path", path])
+            written = []
+            while len(written) < 2 and worker.poll() is None:
+                time.sleep(0.05)
+                if os.path.exists(path) and os.path.getmtime(path) not in written:
+                    written.append(os.path.getmtime(path))
+            time.sleep(0.5 * (written[1] - written[0]) if len(written) == 2 else 0)
+            worker.kill()
+            worker.wait()
+            size = os.path.getsize(path)
+
+            killed = torch.load(path)["it"] # iterations the resumed solve skips
+            resumed, t_resumed = fit(args, loop, path)
+            same = all(np.array_equal(a, b, equal_nan = True) for a, b in zip(reference, resumed)) # u is NaN off the mask
+            print(f"{loop:>18}{t_plain:>11.1f}{t_checkpoints:>17.1f}{size / 2**20:>11.1f}{killed:>11}{t_resumed:>13.1f}"
+                  f"  {same}")
@@ -0,0 +1,62 @@
+# Peak memory and iterations/sec of the in-place loop with float32 sx, mux, mubarx vs. compact storage
+# (PrimalDual(compact=...)), CPU. Each configuration runs in a fresh process so that ru_maxrss is not
+# shared between them, and the peak RSS is reported above that of the process before the solve.
+# Also reports the size of the work buffers and the distance of the solution to the float32 one.
+#
+#   python compact_memory.py --N 200 --level 32 --iter 200
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+def solve(N, level, iter, compact, out):
+    torch.manual_seed(0)
+
+    f = torch.rand(N, N, 1)
+    f[:N//2] = torch.clamp(f[:N//2] + 0.3, max=1)
+
+    # tol < 0 so that the solve runs for exactly iter iterations
+    args = (f, torch.tensor(iter), torch.tensor(level), torch.tensor(50.0), torch.tensor(0.01), torch.tensor(-1.0))
+
+    model = PrimalDual(inplace=True, compact=None if compact == "none" else compact)
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # MB on linux, torch alone
+    t0 = time.time()
+    u = model.forward(*args)[0]
+    elapsed = time.time() - t0
+    np.save(out, u.sum(dim=-1).numpy() / level)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss0
+    print(f"{iter / elapsed:.3f} {rss:.1f} {model.buffer_bytes / 2**20:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=200)
+    parser.add_argument("--level", type=int, default=32)
+    parser.add_argument("--iter", type=int, default=200)
+    parser.add_argument("--compact", type=str, default=None)
+    parser.add_argument("--out", type=str, default="compact_memory.npy")
+    args = parser.parse_args()
+
+    if args.compact is not None: # worker
+        solve(args.N, args.level, args.iter, args.compact, args.out)
+        sys.exit(0)
+
+    print(f"grid {args.N}x{args.N}, level {args.level}, {args.iter} iterations")
+    print(f"{'storage':<12}{'it/s':>10}{'solve RSS (MB)':>16}{'buffers (MB)':>16}{'mean |du|':>12}")
+    for compact in ["none", "float32", "bfloat16", "float16"]:
+        out = f"{compact}_{args.out}"
+        res = subprocess.run([sys.executable, __file__, "--N", str(args.N), "--level", str(args.level),
+                              "--iter", str(args.iter), "--compact", compact, "--out", out],
+                             capture_output=True, text=True, check=True).stdout.split()
+        if compact == "none":
+            ref = np.load(out)
+        diff = np.abs(np.load(out) - ref).mean()
+        print(f"{compact:<12}{float(res[0]):>10.2f}{float(res[1]):>16.1f}{float(res[2]):>16.1f}{diff:>12.5f}")
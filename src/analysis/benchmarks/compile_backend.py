@@ -0,0 +1,71 @@
+# Iterations/sec of the allocating loop, op by op (backend="eager") vs. compiled with torch.compile
+# (backend="compile"), and the time of the first solve of a fresh process with an empty and with a
+# filled compile cache (--cache). Each first solve runs in a fresh process, the rates are measured on
+# a second solve. Also the largest difference of u between the two backends.
+#
+#   python compile_backend.py --N 100 200 400 --level 16 --cache /tmp/fdd_compile_cache
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+def solve(N, level, iter, backend, cache, out):
+    torch.manual_seed(0)
+    f = torch.rand(N, N, 1)
+
+    # tol < 0 so that the solve runs for exactly iter iterations
+    args = (f, torch.tensor(iter), torch.tensor(level), torch.tensor(50.0), torch.tensor(0.01), torch.tensor(-1.0))
+
+    model = PrimalDual(backend=backend, cache_dir=cache)
+    t0 = time.time()
+    model.forward(*args)
+    first = time.time() - t0
+    t0 = time.time()
+    u = model.forward(*args)[0]
+    rate = iter / (time.time() - t0)
+    torch.save(u, out)
+    print(f"{first:.3f} {rate:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, nargs="+", default=[100, 200, 400])
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=100)
+    parser.add_argument("--cache", type=str, default="fdd_compile_cache")
+    parser.add_argument("--backend", type=str, default=None)
+    parser.add_argument("--out", type=str, default=None) # worker: file u is saved to
+    args = parser.parse_args()
+
+    if args.backend is not None: # worker
+        solve(args.N[0], args.level, args.iter, args.backend, args.cache, args.out)
+        sys.exit(0)
+
+    tmp = tempfile.mkdtemp()
+
+    def run(N, backend):
+        out = os.path.join(tmp, backend + ".pt")
+        times = [float(x) for x in subprocess.run([sys.executable, __file__, "--N", str(N), "--level", str(args.level),
+                                                   "--iter", str(args.iter), "--backend", backend, "--cache", args.cache,
+                                                   "--out", out], capture_output=True, text=True, check=True).stdout.split()]
+        return times + [torch.load(out, weights_only = True)]
+
+    print(f"level {args.level}, {args.iter} iterations, torch {torch.__version__}, Python {sys.version.split()[0]}")
+    print(f"{'N':>6}{'eager it/s':>12}{'compile it/s':>14}{'first, cold (s)':>17}{'first, cached (s)':>19}"
+          f"{'max |u diff|':>14}")
+    shutil.rmtree(args.cache, ignore_errors=True)
+    for N in args.N:
+        _, eager, u_eager = run(N, "eager")
+        cold, compiled, u_compiled = run(N, "compile")
+        cached, _, _ = run(N, "compile")
+        diff = (u_eager - u_compiled).abs().max().item()
+        print(f"{N:>6}{eager:>12.2f}{compiled:>14.2f}{cold:>17.2f}{cached:>19.2f}{diff:>14.2e}")
+    shutil.rmtree(tmp)
@@ -0,0 +1,67 @@
+# Time per call of the non-local constraint sums in PrimalDual.mu and PrimalDual.parabola,
+# per-set Python loops (previous implementation) vs. one incidence matrix multiply.
+#
+#   python constraint_sums.py --N 100
+
+import argparse
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+def loop_sums(px, mux, l):
+    # previous implementation: one slice/sum per set (k1, k2) and one index_select per label z
+    t_list = []
+    for k1 in range(l):
+        for k2 in range(k1, l):
+            t_list.append(px[..., k1:(k2 + 1)].sum(dim=-1))
+    t = torch.stack(t_list, dim=-1)
+    
+    musum_list = []
+    for z in range(l):
+        K, K_indices = 0, []
+        for k1 in range(l):
+            for k2 in range(k1, l):
+                if k1 <= z <= k2:
+                    K_indices.append(K)
+                K += 1
+        musum_list.append(torch.index_select(mux, -1, torch.tensor(K_indices, device=mux.device)).sum(dim=-1))
+    musum = torch.stack(musum_list, dim=-1)
+    
+    return t, musum
+
+
+def incidence_sums(px, mux, incidence):
+    return torch.matmul(px, incidence.t()), torch.matmul(mux, incidence)
+
+
+def timeit(fn, repeats):
+    fn()
+    t0 = time.time()
+    for _ in range(repeats):
+        out = fn()
+    return (time.time() - t0) / repeats, out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    
+    torch.manual_seed(0)
+    model = PrimalDual()
+    
+    print(f"grid {args.N}x{args.N}, time per call (ms)")
+    print(f"{'level':>6}{'loop':>12}{'incidence':>12}{'speedup':>10}{'max abs diff':>15}")
+    for l in [8, 16, 32, 64]:
+        proj = l * (l + 1) // 2
+        px = torch.randn(2, args.N, args.N, 1, l)
+        mux = torch.randn(2, args.N, args.N, 1, proj)
+        incidence = model.incidence(l, px.device)
+        
+        t_loop, (t0, m0) = timeit(lambda: loop_sums(px, mux, l), args.repeats)
+        t_inc, (t1, m1) = timeit(lambda: incidence_sums(px, mux, incidence), args.repeats)
+        diff = max((t0 - t1).abs().max().item(), (m0 - m1).abs().max().item())
+        print(f"{l:>6}{1000 * t_loop:>12.1f}{1000 * t_inc:>12.1f}{t_loop / t_inc:>10.1f}{diff:>15.2e}")
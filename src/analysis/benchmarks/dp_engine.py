@@ -0,0 +1,56 @@
+# 1-D fits of the design of simulations_1d_SURE.py: time of FDD.run with the primal-dual solver
+# (engine="torch") vs. the exact dynamic program (engine="dp"), the jumps each finds on the grid and the
+# largest difference between their u, and the rate of bootstrap refits (resampled points, new FDD and
+# run) with the dp engine.
+#
+#   python dp_engine.py --N 500 1000 4000 --bootstrap 50
+
+import argparse
+import time
+
+import numpy as np
+from FDD import FDD
+
+
+def generate1D(N, jumps=[(0.2, 0.9), (0.4, 1), (0.6, 1.5), (0.8, -2)], sigma=0.05):
+    X = np.random.rand(N)
+    Y = np.sin(2 * np.pi * X) + sum(size * (X > at) for at, size in jumps) + sigma * np.random.normal(size=N)
+    return X, Y
+
+
+def fit(X, Y, engine, args):
+    model = FDD(Y, X, level = args.level, lmbda = args.lmbda, nu = args.nu, iter = args.iter, tol = 5e-5,
+                resolution = 1 / int(Y.size * 0.25), pick_nu = "MS", scripted = False, engine = engine)
+    t0 = time.time()
+    u, jumps, J_grid, nrj, eps, it = model.run()
+    return u, J_grid, time.time() - t0, model.resolution
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, nargs="+", default=[500, 1000, 4000])
+    parser.add_argument("--level", type=int, default=32)
+    parser.add_argument("--lmbda", type=float, default=1000)
+    parser.add_argument("--nu", type=float, default=0.02)
+    parser.add_argument("--iter", type=int, default=10000)
+    parser.add_argument("--bootstrap", type=int, default=50)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    fit(*generate1D(100), "dp", args) # compile the numba kernel
+
+    print(f"level {args.level}, lmbda {args.lmbda}, nu {args.nu}")
+    print(f"{'N':>6}{'torch (s)':>11}{'dp (s)':>9}{'max |du|':>10}{'dp refits/s':>13}  jumps torch / dp")
+    for N in args.N:
+        X, Y = generate1D(N)
+        u_torch, J_torch, t_torch, res = fit(X, Y, "torch", args)
+        u_dp, J_dp, t_dp, _ = fit(X, Y, "dp", args)
+
+        t0 = time.time()
+        for b in range(args.bootstrap):
+            i = np.random.randint(0, N, N)
+            fit(X[i], Y[i], "dp", args)
+        rate = args.bootstrap / (time.time() - t0)
+
+        at = lambda J: " ".join(f"{x:.3f}" for x in (np.where(J == 1)[0] + 1) * res)
+        print(f"{N:>6}{t_torch:>11.3f}{t_dp:>9.4f}{np.abs(u_torch - u_dp).max():>10.3f}{rate:>13.1f}  {at(J_torch)} / {at(J_dp)}")
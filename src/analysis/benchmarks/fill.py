@@ -0,0 +1,68 @@
+# Fill of the empty grid cells in castDataToGridSmooth: the closest point by a KD-tree query on one core (as
+# before), on all cores (fill="kdtree") and the closest cell with points by a distance transform of the
+# occupancy grid (fill="edt"), on sparse 2D and 3D grids (simulations_3d.py has about one point for every
+# 1.5 cells). Time of the fill and of the whole binning, and the mean / largest difference of the values the
+# distance transform gives the empty cells to those of the closest point.
+#
+#   python fill.py --grid2 1000 --grid3 100 --points 10000 100000 1000000
+
+import argparse
+import os
+import time
+
+import numpy as np
+from FDD import FDD
+from scipy.spatial import cKDTree
+
+
+def data(n, d):
+    np.random.seed(0)
+    X = np.random.rand(n, d)
+    Y = X.sum(axis = 1) + (X[:, 0] > 0.5) + 0.1 * np.random.normal(size = n)
+    return X, Y
+
+
+def oneCore(model, grid_y):
+    # fillEmptyCells before the fill option, query on one core
+    empty_cells = np.where(model.grid_counts == 0)
+    tree = cKDTree(model.X + model.resolution / 2)
+    _, closest_indices = tree.query(np.vstack(empty_cells).T * model.resolution, k=1, workers=1)
+    grid_y[empty_cells] = model.Y[closest_indices]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grid2", type=int, default=1000) # cells per side
+    parser.add_argument("--grid3", type=int, default=100)
+    parser.add_argument("--points", type=int, nargs="+", default=[10**4, 10**5, 10**6])
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+    print(f"{'grid':>12}{'points':>9}{'empty':>7}{'1 core (s)':>12}{'kdtree (s)':>12}{'edt (s)':>9}"
+          f"{'binning (s)':>13}{'mean |dy|':>11}{'max |dy|':>10}")
+    for d, side in [(2, args.grid2), (3, args.grid3)]:
+        for n in args.points:
+            X, Y = data(n, d)
+            t0 = time.time()
+            model = FDD(Y, X, level = 16, resolution = 1 / side, pick_nu = "MS", scripted = False, fill = "edt")
+            t_binning = time.time() - t0
+            unfilled = model.grid_y.copy()
+            empty = model.grid_counts == 0
+            unfilled[empty] = 0
+
+            timings, filled = [], []
+            for fill in ["one core", "kdtree", "edt"]:
+                grid_y = unfilled[..., 0].copy()
+                t0 = time.time()
+                if fill == "one core":
+                    oneCore(model, grid_y)
+                else:
+                    model.fill = fill
+                    model.fillEmptyCells(grid_y, model.X, model.Y)
+                timings.append(time.time() - t0)
+                filled.append(grid_y)
+            diff = np.abs(filled[2] - filled[1])[empty] * (Y.max() - Y.min()) # in units of Y
+            same = np.array_equal(filled[0], filled[1])
+            print(f"{'x'.join([str(side)] * d):>12}{n:>9}{empty.mean():>7.2f}{timings[0]:>12.3f}{timings[1]:>12.3f}"
+                  f"{timings[2]:>9.3f}{t_binning:>13.2f}{diff.mean():>11.4f}{diff.max():>10.3f}"
+                  + ("" if same else "  one core and kdtree differ"))
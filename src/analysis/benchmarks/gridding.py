@@ -0,0 +1,58 @@
+# Nearest-point gridding (gridding="points", FDD.castDataToGridPoints): the loop over the grid points with
+# the distances to all data points it used before vs. one KD-tree query for all grid points, and the query
+# for the 4 closest points averaged with inverse-distance weights (neighbors=4). Time for growing numbers of
+# points on a fixed grid; for the sizes the loop is run at, checks that grid_y and the points of the cells
+# are the same as with the loop.
+#
+#   python gridding.py --N 100 --points 1000 10000 100000 1000000 --loop 100000
+
+import argparse
+import time
+
+import numpy as np
+from FDD import FDD
+
+
+def loop(model):
+    # castDataToGridPoints before the tree query
+    grid_x = model.grid_x
+    grid_y = np.zeros(list(grid_x.shape[:-1]) + [1])
+    cell_points = np.empty((int(np.prod(grid_x.shape[:-1])), model.X.shape[1]))
+    it = np.nditer(grid_x[...,0], flags = ['multi_index'])
+    for x in it:
+        distances = np.linalg.norm(model.X - grid_x[it.multi_index], axis=1, ord = 2)
+        closest_seed = np.argmin(distances)
+        grid_y[it.multi_index] = model.Y[closest_seed]
+        cell_points[np.ravel_multi_index(it.multi_index, grid_x.shape[:-1])] = model.X_raw[closest_seed,:]
+    return grid_y, cell_points
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=100)
+    parser.add_argument("--points", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6])
+    parser.add_argument("--loop", type=int, default=10**5) # largest number of points to run the loop at
+    args = parser.parse_args()
+
+    print(f"grid {args.N}x{args.N}")
+    print(f"{'points':>10}{'loop (s)':>10}{'tree (s)':>10}{'neighbors=4 (s)':>17}  identical")
+    for n in args.points:
+        np.random.seed(0)
+        X = np.random.rand(n, 2)
+        Y = 0.5 * X[:, 0] + 0.4 * (X[:, 1] > 0.5) + 0.05 * np.random.normal(size=n)
+        timings = []
+        for neighbors in [1, 4]:
+            t0 = time.time()
+            model = FDD(Y, X, level = 16, resolution = 1 / args.N, pick_nu = "MS", scripted = False,
+                        gridding = "points", neighbors = neighbors)
+            timings.append(time.time() - t0)
+            if neighbors == 1:
+                tree = model
+        if n <= args.loop:
+            t0 = time.time()
+            grid_y, cell_points = loop(tree)
+            t_loop = time.time() - t0
+            same = np.array_equal(grid_y, tree.grid_y) and np.array_equal(cell_points, tree.cell_points)
+            print(f"{n:>10}{t_loop:>10.2f}{timings[0]:>10.2f}{timings[1]:>17.2f}  {same}")
+        else:
+            print(f"{n:>10}{'':>10}{timings[0]:>10.2f}{timings[1]:>17.2f}")
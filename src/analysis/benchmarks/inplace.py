@@ -0,0 +1,54 @@
+# Iterations/sec and peak RSS of the primal-dual loop, allocating vs. in-place (CPU).
+# Each configuration runs in a fresh process so that ru_maxrss is not shared between them.
+#
+#   python inplace.py --N 200 --level 32 --iter 200
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+def solve(N, level, iter, inplace, threads):
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    
+    f = torch.rand(N, N, 1)
+    f[:N//2] = torch.clamp(f[:N//2] + 0.3, max=1)
+    
+    # tol < 0 so that the solve runs for exactly iter iterations
+    args = (f, torch.tensor(iter), torch.tensor(level), torch.tensor(50.0), torch.tensor(0.01), torch.tensor(-1.0))
+    
+    model = PrimalDual(inplace=inplace)
+    t0 = time.time()
+    model.forward(*args)
+    elapsed = time.time() - t0
+    
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # MB on linux
+    print(f"{iter / elapsed:.3f} {rss:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=200)
+    parser.add_argument("--level", type=int, default=32)
+    parser.add_argument("--iter", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--inplace", type=int, default=None)
+    args = parser.parse_args()
+    
+    if args.inplace is not None: # worker
+        solve(args.N, args.level, args.iter, bool(args.inplace), args.threads)
+        sys.exit(0)
+    
+    print(f"grid {args.N}x{args.N}, level {args.level}, {args.iter} iterations, {args.threads} threads")
+    print(f"{'mode':<12}{'it/s':>10}{'peak RSS (MB)':>16}")
+    for inplace in [0, 1]:
+        out = subprocess.run([sys.executable, __file__, "--N", str(args.N), "--level", str(args.level),
+                              "--iter", str(args.iter), "--threads", str(args.threads), "--inplace", str(inplace)],
+                             capture_output=True, text=True, check=True).stdout.split()
+        print(f"{'inplace' if inplace else 'allocating':<12}{float(out[0]):>10.2f}{float(out[1]):>16.1f}")
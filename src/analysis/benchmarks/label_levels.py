@@ -0,0 +1,57 @@
+# Evenly spaced labels vs. labels at the quantiles of the data (labels="quantile") on a skewed outcome
+# (log-normal, clipped at its 99th percentile like spend_norm in analysis/power.py): for every level, the
+# predicted memory of the solve, its time and iterations and the largest / mean difference of u (in units
+# of Y) and the cells whose jump indicator differs from a solve with evenly spaced labels at --reference
+# levels.
+#
+#   python label_levels.py --N 40 --level 8 12 16 --reference 64
+
+import argparse
+import time
+
+import numpy as np
+from FDD import FDD
+
+
+def generate(n, sigma=0.3):
+    # log-normal with a jump of 0.8 in its log across x1 = 0.5 and a smooth trend along x0
+    X = np.random.rand(n, 2)
+    Z = 0.5 * np.sin(2 * np.pi * X[:, 0]) + 0.8 * (X[:, 1] > 0.5) + sigma * np.random.normal(size=n)
+    Y = np.exp(Z)
+    return X, np.minimum(Y, np.quantile(Y, 0.99))
+
+
+def fit(X, Y, level, labels, args):
+    model = FDD(Y, X, level = level, lmbda = args.lmbda, nu = args.nu, iter = args.iter, tol = 1e-5,
+                resolution = 1 / args.N, pick_nu = "MS", scripted = False, labels = labels)
+    nbytes = model.estimate_resources()[0]
+    t0 = time.time()
+    u, jumps, J_grid, nrj, eps, it = model.run()
+    return u, J_grid, time.time() - t0, it, nbytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=40)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--level", type=int, nargs="+", default=[8, 12, 16])
+    parser.add_argument("--reference", type=int, default=64)
+    parser.add_argument("--lmbda", type=float, default=50)
+    parser.add_argument("--nu", type=float, default=0.01)
+    parser.add_argument("--iter", type=int, default=5000)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    X, Y = generate(args.points)
+    u_ref, J_ref, t_ref, it_ref, nbytes_ref = fit(X, Y, args.reference, None, args)
+
+    print(f"grid {args.N}x{args.N}, {args.points} points, reference: level {args.reference} evenly spaced, "
+          f"{t_ref:.1f} s, {nbytes_ref / 2**20:.1f} MB (it 0: tol not reached in {args.iter})")
+    print(f"{'level':>6}{'labels':>10}{'estimate (MB)':>15}{'time (s)':>10}{'it':>7}{'max |du|':>10}"
+          f"{'mean |du|':>11}{'jumps off':>11}")
+    for level in args.level:
+        for labels in [None, "quantile"]:
+            u, J_grid, elapsed, it, nbytes = fit(X, Y, level, labels, args)
+            diff = np.abs(u - u_ref)
+            print(f"{level:>6}{'even' if labels is None else labels:>10}{nbytes / 2**20:>15.1f}{elapsed:>10.1f}"
+                  f"{it:>7}{diff.max():>10.4f}{diff.mean():>11.5f}{int(np.sum(J_grid != J_ref)):>11}")
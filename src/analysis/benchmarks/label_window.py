@@ -0,0 +1,74 @@
+# Solve on all labels vs. on a window of labels around the solution (label_window), CPU: time,
+# iterations to tol, predicted and measured peak memory (RSS above that of the process before the
+# solve), the windows moved over the solve and the largest / mean difference of the extracted surface
+# (FDD.isosurface) to the solve on all labels. Each configuration runs in a fresh process.
+#
+#   python label_window.py --N 80 --level 32 --window 0 8 12 16
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from FDD import FDD
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+def image(N):
+    # ramp plus a jump of 0.4 (more labels than the smaller windows) across the middle row
+    torch.manual_seed(0)
+    x = torch.linspace(0, 1, N)
+    X, Y = torch.meshgrid(x, x, indexing="ij")
+    return (0.3 * X + 0.4 * (Y > 0.5) + 0.1 + 0.02 * torch.randn(N, N)).clamp(0, 1).unsqueeze(-1)
+
+
+def solve(N, level, iter, window, out):
+    f = image(N)
+    args = (f, torch.tensor(iter), torch.tensor(level), torch.tensor(50.0), torch.tensor(0.01), torch.tensor(1e-5))
+    model = PrimalDual(label_window=window)
+    nbytes = model.estimateResources(list(f.shape), level)[0]
+
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # MB on linux
+    t0 = time.time()
+    u, nrj, eps, it = model.forward(*args)
+    elapsed = time.time() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss0
+
+    fdd = FDD.__new__(FDD) # isosurface only needs the level, label values and the grid shape
+    fdd.level, fdd.grid_y, fdd.label_values = level, f.numpy(), None
+    np.save(out, fdd.isosurface(u.numpy()))
+    print(f"{elapsed:.2f} {it} {nbytes / 2**20:.1f} {rss:.1f} {getattr(model, 'window_moves', 0)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=80)
+    parser.add_argument("--level", type=int, default=32)
+    parser.add_argument("--iter", type=int, default=3000)
+    parser.add_argument("--window", type=int, nargs="+", default=[0, 8, 12, 16])
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.out is not None: # worker
+        solve(args.N, args.level, args.iter, args.window[0], args.out)
+        sys.exit(0)
+
+    print(f"grid {args.N}x{args.N}, level {args.level}, tol 1e-5 (it 0: not reached in {args.iter})")
+    print(f"{'window':>8}{'time (s)':>10}{'it':>7}{'estimate (MB)':>15}{'RSS (MB)':>10}{'moves':>8}{'max |du|':>10}{'mean |du|':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        full = None
+        for window in [0] + [w for w in args.window if w > 0]:
+            out = os.path.join(tmp, f"{window}.npy")
+            res = subprocess.run([sys.executable, __file__, "--N", str(args.N), "--level", str(args.level),
+                                  "--iter", str(args.iter), "--window", str(window), "--out", out],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            u = np.load(out)
+            full = u if full is None else full
+            diff = np.abs(u - full)
+            print(f"{window:>8}{float(res[0]):>10.2f}{int(res[1]):>7}{float(res[2]):>15.1f}{float(res[3]):>10.1f}"
+                  f"{int(res[4]):>8}{diff.max():>10.4f}{diff.mean():>11.5f}")
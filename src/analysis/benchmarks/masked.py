@@ -0,0 +1,67 @@
+# Solve on the whole grid (empty cells filled with the nearest point) vs. on the cells that hold data only
+# (mask="data"), on a raster with NaN pixels like those of analysis/uhi.py passed as points: a disk of water
+# plus scattered fill values, for several fractions of valid pixels. Time, iterations and predicted memory
+# of run(), and the largest / mean difference of u over the valid cells. With --labels quantile both solves
+# place their labels at the quantiles of the cells they solve on (the masked one without the empty cells),
+# and the lowest label of each is reported.
+#
+#   python masked.py --N 60 --valid 0.9 0.6 0.3
+#   python masked.py --N 60 --valid 0.9 0.6 0.3 --labels quantile
+
+import argparse
+import time
+
+import numpy as np
+from FDD import FDD
+
+
+def raster(N, valid, sigma=0.02):
+    # ramp plus a jump of 0.5 across the middle column; NaN on a disk left of the jump and on random pixels,
+    # about 1 - valid of the raster in total
+    x = np.linspace(0, 1, N)
+    A, B = np.meshgrid(x, x, indexing="ij")
+    Y = 0.3 * A + 0.5 * (B > 0.5) + sigma * np.random.normal(size=(N, N))
+    disk = (A - 0.5) ** 2 + (B - 0.3) ** 2 < (1 - valid) / 2 / np.pi
+    p = (1 - valid - disk.mean()) / (1 - disk.mean())
+    Y[disk | (np.random.rand(N, N) < p)] = np.nan
+    return Y
+
+
+def fit(X, Y, mask, args):
+    model = FDD(Y, X, level = args.level, lmbda = args.lmbda, nu = args.nu, iter = args.iter, tol = 1e-5,
+                resolution = 1 / args.N, pick_nu = "MS", scripted = False, mask = mask, labels = args.labels)
+    nbytes = model.estimate_resources()[0]
+    t0 = time.time()
+    u, jumps, J_grid, nrj, eps, it = model.run()
+    lowest = np.nan if model.label_values is None else model.label_values[0]
+    return u, time.time() - t0, it, nbytes, lowest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=60)
+    parser.add_argument("--valid", type=float, nargs="+", default=[0.9, 0.6, 0.3])
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--lmbda", type=float, default=50)
+    parser.add_argument("--nu", type=float, default=0.01)
+    parser.add_argument("--iter", type=int, default=5000)
+    parser.add_argument("--labels", type=str, default=None) # None (evenly spaced) or "quantile"
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    print(f"grid {args.N}x{args.N}, level {args.level} (it 0: tol not reached in {args.iter})")
+    print(f"{'valid':>6}{'mask':>6}{'estimate (MB)':>15}{'time (s)':>10}{'it':>7}{'lowest label':>14}{'max |du|':>10}"
+          f"{'mean |du|':>11}")
+    for valid in args.valid:
+        img = raster(args.N, valid)
+        i, j = np.nonzero(~np.isnan(img))
+        X = np.stack([i, j], axis=1) / args.N + 0.5 / args.N # pixel centres in the unit square
+        Y = img[i, j]
+        u_full, t_full, it_full, nbytes_full, lowest_full = fit(X, Y, None, args)
+        u, elapsed, it, nbytes, lowest = fit(X, Y, "data", args)
+        solved = ~np.isnan(u)
+        diff = np.abs(u - u_full)[solved]
+        share = solved.mean()
+        print(f"{share:>6.2f}{'none':>6}{nbytes_full / 2**20:>15.1f}{t_full:>10.1f}{it_full:>7}{lowest_full:>14.3f}")
+        print(f"{share:>6.2f}{'data':>6}{nbytes / 2**20:>15.1f}{elapsed:>10.1f}{it:>7}{lowest:>14.3f}{diff.max():>10.4f}"
+              f"{diff.mean():>11.5f}")
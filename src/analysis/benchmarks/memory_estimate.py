@@ -0,0 +1,53 @@
+# Predicted peak memory of a solve (FDD.estimate_resources) vs. the measured peak RSS, CPU, for the
+# allocating and in-place loops and compact storage. Each configuration runs in a fresh process so that
+# ru_maxrss is not shared between them, and the peak RSS is reported above that of the process before
+# the solve.
+#
+#   python memory_estimate.py --N 120 --level 32
+
+import argparse
+import resource
+import subprocess
+import sys
+
+import numpy as np
+from FDD import FDD
+
+
+configs = {"allocating" : {}, "inplace" : {"inplace" : True}, "bfloat16" : {"compact" : "bfloat16"}}
+
+
+def solve(N, level, iter, config):
+    np.random.seed(0)
+    X = np.random.rand(N * N // 2, 2)
+    Y = X[:, 0] + 0.3 * (X[:, 1] > 0.5) + 0.02 * np.random.normal(size=X.shape[0])
+
+    # tol < 0 so that the solve runs for exactly iter iterations
+    model = FDD(Y, X, level = level, lmbda = 50, nu = 0.01, iter = iter, tol = -1, resolution = 1/N,
+                pick_nu = "MS", scripted = False, **configs[config])
+    nbytes, flops = model.estimate_resources()
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # MB on linux
+    model.run()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss0
+    print(f"{nbytes / 2**20:.1f} {rss:.1f} {flops / 1e9:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=120)
+    parser.add_argument("--level", type=int, default=32)
+    parser.add_argument("--iter", type=int, default=30)
+    parser.add_argument("--config", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.config is not None: # worker
+        solve(args.N, args.level, args.iter, args.config)
+        sys.exit(0)
+
+    print(f"grid {args.N}x{args.N}, level {args.level}")
+    print(f"{'loop':<12}{'estimate (MB)':>16}{'solve RSS (MB)':>16}{'GFLOP/it':>10}")
+    for config in configs:
+        res = subprocess.run([sys.executable, __file__, "--N", str(args.N), "--level", str(args.level),
+                              "--iter", str(args.iter), "--config", config],
+                             capture_output=True, text=True, check=True).stdout.split()
+        print(f"{config:<12}{float(res[0]):>16.1f}{float(res[1]):>16.1f}{float(res[2]):>10.3f}")
@@ -0,0 +1,54 @@
+# Wall time of FDD.run with the torch engine (allocating and in-place loops) vs. the numba engine
+# (FDD(engine="numba")) on the 2D simulation design (circle with a jump, see simulations_2d.py) for
+# several sample sizes, and the parity of the numba engine with the torch one: iterations to tolerance
+# and the largest difference of the estimated function. The numba kernels are compiled (and cached)
+# on a warm-up run first.
+#
+#   python numba_engine.py --N 100 250 500 1000 --level 16
+
+import argparse
+import time
+
+import numpy as np
+from FDD import FDD
+
+
+def generate(jsize=0.1, sigma=0.02, N=500):
+    X = np.random.rand(N, 2)
+    r = np.sqrt(np.sum((X - 1/2)**2, axis=1))
+    Y = r + jsize * (r >= 1/4) + np.random.normal(0, sigma, N)
+    return X, Y
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, nargs="+", default=[100, 250, 500, 1000])
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=5000)
+    parser.add_argument("--tol", type=float, default=5e-5)
+    args = parser.parse_args()
+
+    engines = {"torch" : {}, "torch inplace" : {"inplace" : True}, "numba" : {"engine" : "numba"}}
+
+    np.random.seed(0)
+    X, Y = generate(N=100)
+    FDD(Y, X, level = args.level, iter = 10, resolution = 1/8, pick_nu = "MS", scripted = False, engine = "numba").run()
+
+    print(f"level {args.level}, tol {args.tol}")
+    print(f"{'N':>6}{'grid':>8}" + "".join([f"{name + ' (s)':>18}" for name in engines]) +
+          f"{'it torch / numba':>20}{'max |u diff|':>14}")
+    for N in args.N:
+        np.random.seed(0)
+        X, Y = generate(N=N)
+        resolution = 1/int((N * 2/3)**(1/2))
+        times, results = [], []
+        for name, kwargs in engines.items():
+            model = FDD(Y, X, level = args.level, lmbda = 50, nu = 0.01, iter = args.iter, tol = args.tol,
+                        resolution = resolution, pick_nu = "MS", scripted = False, **kwargs)
+            t0 = time.time()
+            results.append(model.run())
+            times.append(time.time() - t0)
+        grid = "x".join([str(n) for n in model.grid_y.shape[:-1]])
+        diff = np.abs(results[0][0] - results[2][0]).max()
+        print(f"{N:>6}{grid:>8}" + "".join([f"{t:>18.3f}" for t in times]) +
+              f"{str(results[0][5]) + ' / ' + str(results[2][5]):>20}{diff:>14.5f}")
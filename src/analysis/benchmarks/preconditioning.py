@@ -0,0 +1,49 @@
+# Iterations to tolerance as the level grows, global step sizes vs. diagonal preconditioning.
+# The tolerance is the mean distance of u to a reference solution from a long preconditioned run,
+# checked after 125, 250, 500, ... iterations.
+#
+#   python preconditioning.py --N 16 --levels 16 32 64
+
+import argparse
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=16)
+    parser.add_argument("--levels", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--lmbda", type=float, default=50)
+    parser.add_argument("--iter", type=int, default=4000)
+    parser.add_argument("--target", type=float, default=0.01)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    f = torch.rand(args.N, args.N, 1)
+    f[:args.N//2] = torch.clamp(f[:args.N//2] + 0.3, max=1)
+    lmbda, nu, tol = torch.tensor(args.lmbda), torch.tensor(0.01), torch.tensor(0.0)
+
+    budgets = [125]
+    while budgets[-1] * 2 <= args.iter:
+        budgets.append(budgets[-1] * 2)
+
+    print(f"{args.N}x{args.N} grid, iterations until mean |u - u*| <= {args.target}")
+    print(f"{'level':>8}{'global':>10}{'precond':>10}{'s/it global':>14}{'s/it precond':>14}")
+    for level in args.levels:
+        l = torch.tensor(level)
+        ref = PrimalDual(precondition=True).forward(f, torch.tensor(4 * args.iter), l, lmbda, nu, tol)[0]
+        first = {}
+        speed = {}
+        for precondition in [False, True]:
+            model = PrimalDual(inplace=True, precondition=precondition)
+            first[precondition] = None
+            for it in budgets:
+                t0 = time.time()
+                u = model.forward(f, torch.tensor(it), l, lmbda, nu, tol)[0]
+                speed[precondition] = (time.time() - t0) / it
+                if (u - ref).abs().mean().item() <= args.target:
+                    first[precondition] = it
+                    break
+        print(f"{level:>8}{str(first[False]):>10}{str(first[True]):>10}{speed[False]:>14.5f}{speed[True]:>14.5f}")
@@ -0,0 +1,51 @@
+# Iterations and wall time to tolerance on the 2D and 3D simulation designs (circle / sphere with a
+# jump, see simulations_2d.py and simulations_3d.py) with over-relaxation and adaptive restarts.
+# Saves the energy trace of every run to --out.
+#
+#   python restarts.py --N 1000 --out restarts.npz
+
+import argparse
+
+import numpy as np
+from FDD import FDD
+
+
+def generate(d, jsize=0.1, sigma=0.02, N=500):
+    X = np.random.rand(N, d)
+    r = np.sqrt(np.sum((X - 1/2)**2, axis=1))
+    Y = r + jsize * (r >= 1/4) + np.random.normal(0, sigma, N)
+    return X, Y
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=1000)
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=20000)
+    parser.add_argument("--tol", type=float, default=1e-5)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    # over-relaxation needs step sizes that strictly satisfy the step size condition, which the
+    # preconditioned ones do by construction
+    options = {"plain" : {}, "restart" : {"restart" : True}, "relaxed+restart" : {"relaxation" : 1.5, "restart" : True},
+               "precond" : {"precondition" : True}, "precond+relaxed" : {"precondition" : True, "relaxation" : 1.5},
+               "precond+relaxed+restart" : {"precondition" : True, "relaxation" : 1.5, "restart" : True}}
+
+    traces = {}
+    print(f"{'design':>8}{'options':>26}{'iter':>8}{'time':>8}")
+    for d in [2, 3]:
+        np.random.seed(0)
+        X, Y = generate(d, N=args.N)
+        resolution = 1/int((args.N * 2/3)**(1/d))
+        for name, kwargs in options.items():
+            model = FDD(Y, X, level = args.level, lmbda = 50, nu = 0.01, iter = args.iter, tol = args.tol,
+                        resolution = resolution, pick_nu = "MS", scripted = False, inplace = True, trace = True, **kwargs)
+            it = model.run()[5]
+            trace = model.energy_trace
+            print(f"{str(d) + 'D':>8}{name:>26}{it:>8}{trace.time[-1].item():>8.2f}")
+            for field in trace._fields:
+                traces[f"{d}D/{name}/{field}"] = getattr(trace, field).numpy()
+
+    if args.out is not None:
+        np.savez(args.out, **traces)
@@ -0,0 +1,77 @@
+# Reading points from a CSV file into FDD: the whole file with pandas (as analysis/power.py does with its
+# extracts) vs. FDD.from_chunks on pandas chunks, with and without reading the next chunk while binning the
+# current one (prefetch). Time to the grid and peak memory allocated (tracemalloc, which sees the NumPy and
+# pandas arrays) in a fresh process per configuration, and the largest difference of grid_y to the in-memory grid. Bounds of
+# the data are passed to from_chunks, so the file is read once.
+#
+#   python streaming.py --points 2000000 --chunk 200000 --N 100
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from FDD import FDD
+
+
+def generate(path, n):
+    np.random.seed(0)
+    X = np.random.rand(n, 2)
+    Y = 0.5 * X[:, 0] + 0.4 * (X[:, 1] > 0.5) + 0.05 * np.random.normal(size=n)
+    pd.DataFrame({"x0": X[:, 0], "x1": X[:, 1], "y": Y}).to_csv(path, index = False)
+    data = pd.read_csv(path) # bounds of the data as read back
+    X, Y = data[["x0", "x1"]].values, data["y"].values
+    np.savez(path + ".bounds.npz", min_x = X.min(axis = 0), max_x = X.max(axis = 0), min_y = Y.min(), max_y = Y.max())
+
+
+def grid(args, mode):
+    bounds = tuple(np.load(args.csv + ".bounds.npz").values())
+    kwargs = dict(level = 16, resolution = 1 / args.N, pick_nu = "MS", scripted = False)
+    t0 = time.time()
+    if mode == "memory":
+        data = pd.read_csv(args.csv)
+        model = FDD(data["y"].values, data[["x0", "x1"]].values, **kwargs)
+    else:
+        chunks = ((c[["x0", "x1"]].values, c["y"].values) for c in pd.read_csv(args.csv, chunksize = args.chunk))
+        model = FDD.from_chunks(chunks, bounds = bounds, prefetch = mode == "prefetch", **kwargs)
+    return model.grid_y, time.time() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=2000000)
+    parser.add_argument("--chunk", type=int, default=200000)
+    parser.add_argument("--N", type=int, default=100)
+    parser.add_argument("--csv", type=str, default=None) # worker
+    parser.add_argument("--mode", type=str, default=None)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        tracemalloc.start()
+        grid_y, elapsed = grid(args, args.mode)
+        peak = tracemalloc.get_traced_memory()[1]
+        np.save(args.out, grid_y)
+        print(f"{elapsed:.2f} {peak / 2**20:.1f}")
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = os.path.join(tmp, "points.csv")
+        generate(csv, args.points)
+        print(f"{args.points} points ({os.path.getsize(csv) / 2**20:.0f} MB CSV), chunks of {args.chunk}, "
+              f"grid {args.N}x{args.N}")
+        print(f"{'read':>10}{'time (s)':>10}{'peak (MB)':>11}{'max |d grid_y|':>16}")
+        reference = None
+        for mode in ["memory", "chunks", "prefetch"]:
+            out = os.path.join(tmp, f"{mode}.npy")
+            res = subprocess.run([sys.executable, __file__, "--csv", csv, "--mode", mode, "--N", str(args.N),
+                                  "--chunk", str(args.chunk), "--out", out],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            grid_y = np.load(out)
+            reference = grid_y if reference is None else reference
+            print(f"{mode:>10}{float(res[0]):>10.2f}{float(res[1]):>11.1f}{np.abs(grid_y - reference).max():>16.2e}")
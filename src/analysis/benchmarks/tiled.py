@@ -0,0 +1,84 @@
+# Peak memory and wall time of the in-place solve on the full grid vs. the tiled, out-of-core solve
+# (PrimalDual.forwardTiled) for several tile sizes, CPU, and the largest difference between the two
+# solutions. Each configuration runs in a fresh process so that ru_maxrss is not shared between them,
+# and the peak RSS is reported above that of the process before the solve. The RSS includes the
+# memory-mapped variables of the tiled solve while their pages are resident, which the kernel writes
+# back and evicts under memory pressure, so the peak anonymous memory (RssAnon, sampled every 10 ms)
+# is what bounds it.
+#
+#   python tiled.py --N 300 --level 16 --tiles 50 100
+
+import argparse
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+def rssAnon():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("RssAnon"):
+                return int(line.split()[1]) / 1024 # MB
+
+
+def solve(N, level, iter, tile, out):
+    torch.manual_seed(0)
+
+    f = torch.rand(N, N, 1)
+    f[:N//2] = torch.clamp(f[:N//2] + 0.3, max=1)
+
+    # tol < 0 so that the solve runs for exactly iter iterations
+    args = (f, torch.tensor(iter), torch.tensor(level), torch.tensor(50.0), torch.tensor(0.01), torch.tensor(-1.0))
+
+    model = PrimalDual(inplace=True)
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # MB on linux, torch alone
+    anon0, anon = rssAnon(), [0.0]
+    done = threading.Event()
+    def sample():
+        while not done.wait(0.01):
+            anon[0] = max(anon[0], rssAnon())
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    t0 = time.time()
+    u = model.forward(*args)[0] if tile == 0 else model.forwardTiled(*args, tile)[0]
+    elapsed = time.time() - t0
+    done.set()
+    sampler.join()
+    np.save(out, u.numpy())
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss0
+    print(f"{elapsed:.3f} {rss:.1f} {anon[0] - anon0:.1f} {model.buffer_bytes / 2**20:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=300)
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=50)
+    parser.add_argument("--tiles", type=int, nargs="+", default=[50, 100])
+    parser.add_argument("--tile", type=int, default=None)
+    parser.add_argument("--out", type=str, default="tiled.npy")
+    args = parser.parse_args()
+
+    if args.tile is not None: # worker
+        solve(args.N, args.level, args.iter, args.tile, args.out)
+        sys.exit(0)
+
+    print(f"grid {args.N}x{args.N}, level {args.level}, {args.iter} iterations")
+    print(f"{'tile':<12}{'time (s)':>10}{'solve RSS (MB)':>16}{'anonymous (MB)':>16}{'buffers (MB)':>16}{'max |du|':>12}")
+    for tile in [0] + args.tiles:
+        out = f"{tile}_{args.out}"
+        res = subprocess.run([sys.executable, __file__, "--N", str(args.N), "--level", str(args.level),
+                              "--iter", str(args.iter), "--tile", str(tile), "--out", out],
+                             capture_output=True, text=True, check=True).stdout.split()
+        if tile == 0:
+            ref = np.load(out)
+        diff = np.abs(np.load(out) - ref).max()
+        name = "full grid" if tile == 0 else str(tile)
+        print(f"{name:<12}{float(res[0]):>10.2f}{float(res[1]):>16.1f}{float(res[2]):>16.1f}{float(res[3]):>16.1f}{diff:>12.5f}")
@@ -0,0 +1,58 @@
+# Strong scaling of the tiled solve over worker processes (PrimalDual.forwardTiled(workers=...), one
+# torch thread per worker) vs. the in-place solve on the full grid with as many torch threads, CPU.
+# Efficiency is T(1) / (n T(n)). Also reports the largest difference to the full-grid solution. Core
+# counts above the cores available to the process are skipped: oversubscribed, they time contention.
+#
+#   python tiled_scaling.py --N 400 --level 16 --cores 1 2 4 8
+#
+# Measured so far on a single-core host only (--N 200 --level 16 --iter 50 --cores 1): 1 core, threads
+# 8.5s, workers 10.7s, max |du| 0. The speedup over 2..N cores has not been measured yet.
+
+import argparse
+import os
+import time
+
+import torch
+from FDD.primaldual_multi_scaled_tune import PrimalDual
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=400)
+    parser.add_argument("--level", type=int, default=16)
+    parser.add_argument("--iter", type=int, default=50)
+    parser.add_argument("--tile", type=int, default=0) # 0: one band of tiles per worker
+    parser.add_argument("--cores", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    f = torch.rand(args.N, args.N, 1)
+    f[:args.N//2] = torch.clamp(f[:args.N//2] + 0.3, max=1)
+
+    # tol < 0 so that the solve runs for exactly iter iterations
+    solve = (f, torch.tensor(args.iter), torch.tensor(args.level), torch.tensor(50.0), torch.tensor(0.01),
+             torch.tensor(-1.0))
+
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"grid {args.N}x{args.N}, level {args.level}, {args.iter} iterations, {available} cores available")
+    print(f"{'cores':>6}{'threads (s)':>14}{'efficiency':>12}{'workers (s)':>14}{'efficiency':>12}{'max |du|':>12}")
+    threads = torch.get_num_threads()
+    for n in args.cores:
+        if n > available:
+            print(f"{n:>6}  skipped, {available} cores available")
+            continue
+        torch.set_num_threads(n)
+        t0 = time.time()
+        u = PrimalDual(inplace=True).forward(*solve)[0]
+        t_threads = time.time() - t0
+        torch.set_num_threads(threads)
+
+        tile = args.tile if args.tile > 0 else -(-args.N // n)
+        t0 = time.time()
+        u_tiled = PrimalDual(inplace=True).forwardTiled(*solve, tile, workers=n)[0]
+        t_workers = time.time() - t0
+
+        if n == min(c for c in args.cores if c <= available):
+            base_threads, base_workers = t_threads * n, t_workers * n
+        print(f"{n:>6}{t_threads:>14.2f}{base_threads / (n * t_threads):>12.2f}{t_workers:>14.2f}"
+              f"{base_workers / (n * t_workers):>12.2f}{(u - u_tiled).abs().max().item():>12.5f}")
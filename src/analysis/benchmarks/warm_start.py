@@ -0,0 +1,32 @@
+# Iterations to tolerance along a regularization path in lmbda, cold starts vs. warm starts
+# from the solver state of the previous value.
+#
+#   python warm_start.py --N 1000
+
+import argparse
+
+import numpy as np
+from FDD import FDD
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--N", type=int, default=1000)
+    parser.add_argument("--level", type=int, default=16)
+    args = parser.parse_args()
+    
+    np.random.seed(0)
+    X = np.random.rand(args.N, 2)
+    Y = (X[:,0] > 0.5) * 0.5 + np.random.normal(0, 0.02, args.N)
+    
+    model = FDD(Y, X, level = args.level, lmbda = 1, nu = 0.01, iter = 10000, tol = 5e-5,
+                resolution = 1/int(np.sqrt(args.N * 2/3)), pick_nu = "MS", scripted = False, inplace = True)
+    
+    print(f"{'lmbda':>8}{'cold':>8}{'warm':>8}")
+    state = None
+    for lmbda in [10, 20, 30, 40, 50, 60, 70, 80]:
+        model.lmbda = lmbda
+        it_cold = model.run()[5]
+        it_warm = model.run(warm_start=state)[5]
+        state = model.state
+        print(f"{lmbda:>8}{it_cold:>8}{it_warm:>8}")